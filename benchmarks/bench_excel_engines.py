@@ -0,0 +1,63 @@
+"""Decode time per workbook reader engine on a generated INSIZE-style feed.
+
+Usage: python -m benchmarks.bench_excel_engines --rows 20000 --repeat 3
+   or: python benchmarks/bench_excel_engines.py --rows 20000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+# Run as a plain script, the repository root is not on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.parser import ExcelParser, available_engines
+
+
+def write_workbook(path: str, rows: int):
+    """Write a workbook with the INSIZE header layout and `rows` products"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['INSIZE EUROPE PRICE LIST'])
+    sheet.append([None, 'No', 'Description', 'Description 2', 'Availability', 'Range', 'Reading',
+                  'Family', 'Weight', 'Dimensions', 'Image', 'URL', 'Category', 'Subcategory',
+                  None, None, 'Precio', 'Descuento EU'])
+    for i in range(rows):
+        sheet.append([None, f"{1000 + i % 9000}-{i}", f"Digital caliper {i}", 'IP54' if i % 2 else None,
+                      str(i % 40), '0-150mm', 0.01, 'Calipers', '0.2 kg', '230x80x16mm',
+                      f"https://eshop.insize-eu.com/img/{i}.jpg", f"https://eshop.insize-eu.com/p/{i}",
+                      'Measuring', 'Calipers', None, None, 10.0 + i % 500, float(i % 4) * 5])
+    workbook.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'INSIZE_EUROPE.xlsx')
+        write_workbook(path, args.rows)
+        print(f"Workbook: {args.rows} rows, {os.path.getsize(path) / 1024:.0f} KiB")
+
+        reference = None
+        for engine in reversed(available_engines()):
+            excel_parser = ExcelParser(path, engine=engine)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                frame = excel_parser.read_frame()
+                timings.append(time.perf_counter() - start)
+            if reference is None:
+                reference = frame
+            identical = 'yes' if frame.equals(reference) else 'NO'
+            print(f"{engine:<18} best {min(timings):7.3f}s  "
+                  f"({args.rows / min(timings):>9,.0f} rows/s, identical frame: {identical})")
+
+
+if __name__ == '__main__':
+    main()
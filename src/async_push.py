@@ -0,0 +1,209 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from . import config, metrics
+from .models import Product
+from .rate_limiter import RateLimiter, graphql_bucket, is_throttled, record_graphql_response, retry_after
+from .shopify_bulk import DEFAULT_LOCATION, INVENTORY_BATCH_SIZE, INVENTORY_SET, PRODUCT_CREATE, PRODUCT_UPDATE
+from .shopify_fields import inventory_quantity, metafields_hash, product_input, product_update_input
+from .shopify_ids import index_entry
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional; without it pushes run one request at a time
+    aiohttp = None
+
+# Cost booked for a product mutation until its response reports the actual cost
+MUTATION_COST = 10
+
+class PushResult:
+    """Per-SKU outcome of a concurrent push"""
+    def __init__(self):
+        # 'added' or 'updated', None when the push failed
+        self.outcomes: Dict[str, Optional[str]] = {}
+        self.errors: Dict[str, str] = {}
+        # shopify_id_index entries of the successes
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # Indexed SKUs whose product no longer exists in Shopify
+        self.stale: List[str] = []
+
+    def __repr__(self) -> str:
+        return f"PushResult(pushed={len(self.entries)}, failed={len(self.errors)})"
+
+class AsyncPushEngine:
+    """Creates and updates products with several GraphQL requests in flight.
+
+    Each product is one productCreate or productUpdate, with its metafields
+    unless they are unchanged; the inventory of updated products is then set
+    in batches. Between open() and close() every batch reuses one event loop
+    and one pool of keep-alive connections. Requests share the GraphQL cost
+    bucket with the rest of the process: every request books its cost before
+    it is sent, so overlapping round-trips never spend more than the store's
+    budget. concurrency is capped by the number of mutations the bucket can
+    pay for at once.
+    """
+    def __init__(self, graphql_url: str, headers: Dict[str, str], concurrency: Optional[int] = None,
+                 bucket: RateLimiter = graphql_bucket):
+        if aiohttp is None:
+            raise ImportError("Concurrent pushes need aiohttp (pip install aiohttp)")
+        self.graphql_url = graphql_url
+        self.headers = headers
+        self.bucket = bucket
+        concurrency = config.SHOPIFY_PUSH_CONCURRENCY if concurrency is None else concurrency
+        self.concurrency = max(1, min(concurrency, int(bucket.capacity // MUTATION_COST)))
+        self.location_id: Optional[str] = None
+        # Set between open() and close(); connections are reused across batches
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional['aiohttp.ClientSession'] = None
+        # Shopify API requests made by this engine, for run statistics
+        self.api_calls = 0
+
+    def open(self):
+        """Start the event loop and the pooled HTTP session shared by every push() until close()"""
+        if self._session is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._session = self._loop.run_until_complete(self._open_session())
+
+    async def _open_session(self) -> 'aiohttp.ClientSession':
+        timeout = aiohttp.ClientTimeout(sock_connect=config.HTTP_CONNECT_TIMEOUT, sock_read=config.HTTP_READ_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        return aiohttp.ClientSession(headers=self.headers, timeout=timeout, connector=connector)
+
+    def close(self):
+        if self._session is None:
+            return
+        try:
+            self._loop.run_until_complete(self._session.close())
+        finally:
+            self._loop.close()
+            self._session = None
+            self._loop = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def push(self, products: List[Product], existing: Dict[str, Dict[str, Any]]) -> PushResult:
+        """Push a batch of products; existing maps indexed SKUs to their ID index entries.
+        Outside open()/close() the batch gets a session of its own
+        """
+        if self._session is None:
+            with self:
+                return self.push(products, existing)
+        return self._loop.run_until_complete(self._push(self._session, products, existing))
+
+    async def _push(self, session: 'aiohttp.ClientSession', products: List[Product],
+                    existing: Dict[str, Dict[str, Any]]) -> PushResult:
+        result = PushResult()
+        if self.location_id is None:
+            edges = (await self._graphql(session, 'location_find', DEFAULT_LOCATION, cost=1))['locations']['edges']
+            self.location_id = edges[0]['node']['id'] if edges else None
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(
+            self._push_one(session, semaphore, product, existing.get(product.sku), result)
+            for product in products
+        ))
+        await self._set_inventory(session, products, result)
+
+        logger.info(f"Pushed {len(result.entries)} products concurrently, {len(result.errors)} failed")
+        return result
+
+    async def _push_one(self, session: 'aiohttp.ClientSession', semaphore: asyncio.Semaphore, product: Product,
+                        ids: Optional[Dict[str, Any]], result: PushResult):
+        async with semaphore:
+            try:
+                if ids:
+                    outcome, key = 'updated', 'productUpdate'
+                    data = await self._graphql(session, 'product_update', PRODUCT_UPDATE, {
+                        'input': product_update_input(product, ids)
+                    })
+                else:
+                    outcome, key = 'added', 'productCreate'
+                    data = await self._graphql(session, 'product_create', PRODUCT_CREATE, {
+                        'input': product_input(product, self.location_id)
+                    })
+
+                payload = data[key]
+                if payload['userErrors']:
+                    raise Exception('; '.join(error['message'] for error in payload['userErrors']))
+                if not payload.get('product'):
+                    if ids:
+                        # Deleted in Shopify since it was indexed; the next push creates it again
+                        result.stale.append(product.sku)
+                    raise Exception("No product returned")
+
+                variant = payload['product']['variants']['edges'][0]['node']
+                result.entries[product.sku] = index_entry(
+                    product, payload['product']['id'], variant['id'],
+                    (variant.get('inventoryItem') or {}).get('id'),
+                    bool(ids and ids.get('has_image')) or bool(product.image_url),
+                    metafields_hash(product)
+                )
+                result.outcomes[product.sku] = outcome
+            except Exception as e:
+                logger.error(f"Failed to push product {product.sku}: {str(e)}")
+                result.outcomes[product.sku] = None
+                result.errors[product.sku] = str(e)
+
+    async def _set_inventory(self, session: 'aiohttp.ClientSession', products: List[Product], result: PushResult):
+        """productUpdate leaves inventory alone; set it for the updated products in batches"""
+        if not self.location_id:
+            return
+        quantities = [{
+            'inventoryItemId': result.entries[product.sku]['inventory_item_gid'],
+            'locationId': self.location_id,
+            'quantity': inventory_quantity(product)
+        } for product in products
+            if result.outcomes.get(product.sku) == 'updated' and result.entries[product.sku]['inventory_item_gid']]
+
+        for start in range(0, len(quantities), INVENTORY_BATCH_SIZE):
+            try:
+                data = await self._graphql(session, 'inventory_set', INVENTORY_SET, {'input': {
+                    'reason': 'correction',
+                    'setQuantities': quantities[start:start + INVENTORY_BATCH_SIZE]
+                }})
+                errors = data['inventorySetOnHandQuantities']['userErrors']
+                if errors:
+                    logger.warning(f"Failed to set some inventory quantities: {errors}")
+            except Exception as e:
+                logger.warning(f"Failed to set inventory quantities: {str(e)}")
+
+    async def _graphql(self, session: 'aiohttp.ClientSession', operation: str, query: str,
+                       variables: Optional[Dict[str, Any]] = None, cost: float = MUTATION_COST) -> Dict[str, Any]:
+        """Async counterpart of rate_limiter.graphql_post; returns the data or raises"""
+        self.api_calls += 1
+        metrics.SHOPIFY_CALLS.inc(operation=operation)
+        for attempt in range(config.SHOPIFY_MAX_RETRIES + 1):
+            last_attempt = attempt == config.SHOPIFY_MAX_RETRIES
+            delay = self.bucket.reserve(cost)
+            try:
+                if delay:
+                    await asyncio.sleep(delay)
+                async with session.post(self.graphql_url, json={'query': query, 'variables': variables or {}}) as response:
+                    rate_limited = response.status == 429 and not last_attempt
+                    if not rate_limited:
+                        response.raise_for_status()
+                        body = await response.json(content_type=None)
+                    wait = retry_after(response.headers)
+            finally:
+                # Answered: the state reported from now on includes this request
+                self.bucket.release(cost)
+            if rate_limited:
+                self.bucket.update(0)
+                self.bucket.throttled(wait)
+                await asyncio.sleep(wait)
+                continue
+
+            metrics.record_graphql_cost(body)
+            record_graphql_response(body, self.bucket)
+            if is_throttled(body) and not last_attempt:
+                cost = ((body.get('extensions') or {}).get('cost') or {}).get('requestedQueryCost') or cost
+                continue
+            if body.get('errors'):
+                raise Exception(f"GraphQL {operation} failed: {body['errors']}")
+            return body['data']
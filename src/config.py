@@ -9,10 +9,45 @@ INSIZE_USERNAME = os.getenv('INSIZE_USERNAME')
 INSIZE_PASSWORD = os.getenv('INSIZE_PASSWORD')
 INSIZE_EXCEL_URL = os.getenv('INSIZE_EXCEL_URL')
 
+# Feed download tuning
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+DOWNLOAD_MAX_RESUMES = int(os.getenv('DOWNLOAD_MAX_RESUMES', 5))
+
+# INSIZE session reuse and HTTP client settings
+INSIZE_SESSION_CACHE = os.getenv('INSIZE_SESSION_CACHE', '.cache/insize_session.json')
+INSIZE_SESSION_TTL = int(os.getenv('INSIZE_SESSION_TTL', 6 * 3600))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 4))
+
+# Workbook reader engine: auto, calamine, openpyxl-readonly or openpyxl
+EXCEL_ENGINE = os.getenv('EXCEL_ENGINE', 'auto')
+
+# Columnar cache of parsed feeds (needs pyarrow); set PARSE_CACHE_DIR empty to disable
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', '.cache/parsed_feeds')
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
 # Shopify credentials
 SHOPIFY_SHOP_URL = os.getenv('SHOPIFY_SHOP_URL')
 SHOPIFY_ACCESS_TOKEN = os.getenv('SHOPIFY_ACCESS_TOKEN')
 
+# Shopify bulk import: status poll interval, time limit per operation (seconds) and JSONL file size
+SHOPIFY_BULK_POLL_INTERVAL = float(os.getenv('SHOPIFY_BULK_POLL_INTERVAL', 5))
+SHOPIFY_BULK_TIMEOUT = float(os.getenv('SHOPIFY_BULK_TIMEOUT', 4 * 3600))
+SHOPIFY_BULK_MAX_FILE_BYTES = int(os.getenv('SHOPIFY_BULK_MAX_FILE_BYTES', 20 * 1000 * 1000))
+
+# Shopify rate limits: GraphQL cost points and REST requests (bucket size, restored per second).
+# Only the starting estimate; every response reports the store's actual bucket
+SHOPIFY_GRAPHQL_BUCKET = float(os.getenv('SHOPIFY_GRAPHQL_BUCKET', 1000))
+SHOPIFY_GRAPHQL_RESTORE_RATE = float(os.getenv('SHOPIFY_GRAPHQL_RESTORE_RATE', 50))
+SHOPIFY_REST_BUCKET = float(os.getenv('SHOPIFY_REST_BUCKET', 40))
+SHOPIFY_REST_RESTORE_RATE = float(os.getenv('SHOPIFY_REST_RESTORE_RATE', 2))
+SHOPIFY_MAX_RETRIES = int(os.getenv('SHOPIFY_MAX_RETRIES', 5))
+
+# Requests in flight for --concurrent pushes (needs aiohttp); capped by what the GraphQL bucket can pay for
+SHOPIFY_PUSH_CONCURRENCY = int(os.getenv('SHOPIFY_PUSH_CONCURRENCY', 8))
+
 # Database configuration
 DB_CONFIG = {
     'host': os.getenv('DB_HOST'),
@@ -22,6 +57,26 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD')
 }
 
+# Shared connection pool size
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+# Seconds to wait for a connection to be returned when all of them are checked out
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# Shopify push outbox: claim lease, retries and how long pushed entries are kept
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 900))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))
+
+# Metrics: local /metrics port and/or node-exporter textfile; empty disables them
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', '')
+
+# --profile output directory and the number of functions/allocations listed per stage
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 25))
+
 # Sync schedule
 SYNC_TIMES = [
     os.getenv('SYNC_TIME_1'),
@@ -30,4 +85,4 @@ SYNC_TIMES = [
 
 # Logging configuration
 LOG_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
-LOG_FILE = "logs/insize_sync.log" 
\ No newline at end of file
+LOG_FILE = os.getenv('LOG_FILE', "logs/insize_sync.log") 
\ No newline at end of file
@@ -1,77 +1,97 @@
 from loguru import logger
-import pandas as pd
+from typing import Dict, Iterable, List
+import csv
 import os
+from . import profiling
 from .database import Database
+from .models import Product
+from .logging_setup import setup_logging
 
-def export_to_shopify_csv(output_dir='shopify_exports'):
+# Shopify product CSV columns, in output order
+CSV_COLUMNS = [
+    'Handle', 'Title', 'Body (HTML)', 'Vendor', 'Type', 'Tags', 'Published',
+    'Option1 Name', 'Option1 Value', 'Variant SKU', 'Variant Inventory Tracker',
+    'Variant Inventory Qty', 'Variant Inventory Policy', 'Variant Fulfillment Service',
+    'Variant Price', 'Variant Compare At Price', 'Variant Requires Shipping', 'Variant Taxable',
+    'Image Src', 'Image Position', 'Status', 'SEO Title', 'SEO Description',
+    'Custom Field [custom.range]', 'Custom Field [custom.reading]', 'Custom Field [custom.family]',
+    'Custom Field [custom.weight]', 'Custom Field [custom.dimensions]'
+]
+
+def _shopify_row(product: Product) -> Dict[str, str]:
+    """Bir ürünü Shopify CSV satırına dönüştürür"""
+    # Stok miktarını al
+    stock_qty = product.availability or '0'
+    
+    return {
+        'Handle': product.sku.lower().replace(' ', '-'),  # URL-friendly handle
+        'Title': product.title or f"INSIZE {product.sku}",
+        'Body (HTML)': product.description,
+        'Vendor': 'INSIZE',
+        'Type': 'Tools & Equipment',  # Shopify standart kategori
+        'Tags': f"insize, measuring tools, {product.category}, {product.subcategory}",
+        'Published': 'TRUE' if stock_qty != '0' else 'FALSE',
+        'Option1 Name': 'Title',
+        'Option1 Value': 'Default Title',
+        'Variant SKU': product.sku,
+        'Variant Inventory Tracker': 'shopify',
+        'Variant Inventory Qty': stock_qty,  # INSIZE'dan gelen gerçek stok miktarı
+        'Variant Inventory Policy': 'deny',
+        'Variant Fulfillment Service': 'manual',
+        'Variant Price': f"{product.price:.2f}",
+        'Variant Compare At Price': f"{product.original_price:.2f}" if product.original_price else '',
+        'Variant Requires Shipping': 'TRUE',
+        'Variant Taxable': 'TRUE',
+        'Image Src': product.image_url,
+        'Image Position': '1',
+        'Status': 'active' if stock_qty != '0' else 'draft',
+        'SEO Title': f"INSIZE {product.sku} - {product.title}"[:70] if product.title else f"INSIZE {product.sku}",
+        'SEO Description': product.description[:320],
+        # Metafields as custom fields
+        'Custom Field [custom.range]': product.range,
+        'Custom Field [custom.reading]': product.reading,
+        'Custom Field [custom.family]': product.family,
+        'Custom Field [custom.weight]': product.weight,
+        'Custom Field [custom.dimensions]': product.dimensions
+    }
+
+def write_shopify_csv(chunks: Iterable[List[Product]], output_file: str) -> int:
+    """
+    Ürün parçalarını Shopify CSV dosyasına satır satır yazar.
+    Bellekte aynı anda yalnızca bir parça tutulur.
+    """
+    written = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for chunk in chunks:
+            # Resim URL'si olmayan ürünleri atla
+            rows = [_shopify_row(product) for product in chunk if product.image_url]
+            writer.writerows(rows)
+            written += len(rows)
+    return written
+
+def export_to_shopify_csv(output_dir='shopify_exports', chunk_size=1000):
     """
     Veritabanındaki ürünleri tek bir Shopify CSV dosyasına export eder.
+    Ürünler veritabanından parça parça okunup dosyaya akıtılır.
     """
+    db = None
     try:
         # Veritabanına bağlan
         db = Database()
         db.connect()
         
-        # Ürünleri getir
-        products_df = db.get_all_products()
-        total_products = len(products_df)
-        logger.info(f"Toplam {total_products} ürün export edilecek")
-        
-        # Shopify CSV formatına dönüştür
-        shopify_data = []
-        for _, product in products_df.iterrows():
-            # Resim URL'sini kontrol et
-            if not product['image_url'] or pd.isna(product['image_url']):
-                continue
-                
-            # Stok miktarını al
-            stock_qty = product['availability']
-            if not stock_qty or pd.isna(stock_qty):
-                stock_qty = '0'
-                
-            shopify_product = {
-                'Handle': product['sku'].lower().replace(' ', '-'),  # URL-friendly handle
-                'Title': product['title'] or f"INSIZE {product['sku']}",
-                'Body (HTML)': product['description'] or '',
-                'Vendor': 'INSIZE',
-                'Type': 'Tools & Equipment',  # Shopify standart kategori
-                'Tags': f"insize, measuring tools, {product['category'] or ''}, {product['subcategory'] or ''}",
-                'Published': 'TRUE' if stock_qty != '0' else 'FALSE',
-                'Option1 Name': 'Title',
-                'Option1 Value': 'Default Title',
-                'Variant SKU': product['sku'],
-                'Variant Inventory Tracker': 'shopify',
-                'Variant Inventory Qty': stock_qty,  # INSIZE'dan gelen gerçek stok miktarı
-                'Variant Inventory Policy': 'deny',
-                'Variant Fulfillment Service': 'manual',
-                'Variant Price': str(product['price'] or 0),
-                'Variant Compare At Price': str(product['original_price']) if product['original_price'] else '',
-                'Variant Requires Shipping': 'TRUE',
-                'Variant Taxable': 'TRUE',
-                'Image Src': product['image_url'],
-                'Image Position': '1',
-                'Status': 'active' if stock_qty != '0' else 'draft',
-                'SEO Title': f"INSIZE {product['sku']} - {product['title']}"[:70] if product['title'] else f"INSIZE {product['sku']}",
-                'SEO Description': product['description'][:320] if product['description'] else '',
-                # Metafields as custom fields
-                'Custom Field [custom.range]': product['range'] or '',
-                'Custom Field [custom.reading]': product['reading'] or '',
-                'Custom Field [custom.family]': product['family'] or '',
-                'Custom Field [custom.weight]': product['weight'] or '',
-                'Custom Field [custom.dimensions]': product['dimensions'] or ''
-            }
-            shopify_data.append(shopify_product)
-        
         # Klasörü oluştur
         os.makedirs(output_dir, exist_ok=True)
         
         # Tüm ürünleri tek bir CSV dosyasına yaz
         output_file = os.path.join(output_dir, 'shopify_products.csv')
-        shopify_df = pd.DataFrame(shopify_data)
-        shopify_df.to_csv(output_file, index=False, encoding='utf-8')
-        logger.info(f"Toplam {len(shopify_data)} ürün {output_file} dosyasına kaydedildi")
+        with profiling.stage('export'):
+            written = write_shopify_csv(db.iter_products(chunk_size=chunk_size), output_file)
+        logger.info(f"Toplam {written} ürün {output_file} dosyasına kaydedildi")
         
-        logger.success(f"Toplam {len(shopify_data)} ürün başarıyla export edildi")
+        logger.success(f"Toplam {written} ürün başarıyla export edildi")
         
     except Exception as e:
         logger.error(f"CSV export hatası: {str(e)}")
@@ -79,6 +99,8 @@ def export_to_shopify_csv(output_dir='shopify_exports'):
     finally:
         if db:
             db.close()
+        profiling.report()
 
 if __name__ == '__main__':
+    setup_logging()
     export_to_shopify_csv() 
\ No newline at end of file
@@ -1,33 +1,166 @@
-import psycopg2
-from psycopg2.extras import execute_values
+import io
+import time
+import uuid
+from psycopg2.extras import execute_values, Json, RealDictCursor
 from loguru import logger
 import pandas as pd
-from typing import List, Dict, Any
-from . import config
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple
+from itertools import islice
+from . import config, metrics
+from .db_pool import ConnectionPool, get_pool
+from .models import Product
 from datetime import datetime
 
+# products columns written by upsert_products, in COPY/VALUES order
+UPSERT_COLUMNS = [
+    'sku', 'title', 'description', 'price', 'availability', 'original_price',
+    'discount', 'range', 'reading', 'family', 'weight', 'dimensions',
+    'image_url', 'product_url', 'category', 'subcategory'
+]
+
+# Conditions a product must meet to be exported, applied cumulatively
+EXPORT_FILTERS = [
+    ("sku IS NOT NULL AND sku != ''", "SKU'su olan"),
+    ("title IS NOT NULL", "Başlığı olan"),
+    ("price IS NOT NULL", "Fiyatı olan"),
+    ("image_url IS NOT NULL AND image_url != ''", "Resmi olan"),
+    ("availability != '0'", "Stokta olan")  # 0 olmayan değerler stokta var demek
+]
+
+# Products complete enough to push. Out of stock products are kept so
+# their inventory is zeroed in Shopify
+PUSH_FILTERS = """
+    sku IS NOT NULL AND sku != ''  -- SKU'su olan ürünler
+    AND title IS NOT NULL  -- Başlığı olan ürünler
+    AND price IS NOT NULL  -- Fiyatı olan ürünler
+    AND availability IS NOT NULL  -- Stok durumu belli olan ürünler
+"""
+
+# Products passing every export filter, for exports and full pushes. The WHERE clause
+# is the predicate of idx_products_exportable, so they are read through that partial index
+EXPORTABLE_PRODUCTS_QUERY = f"""
+    SELECT *
+    FROM products
+    WHERE {' AND '.join(condition for condition, _ in EXPORT_FILTERS)}
+    ORDER BY sku
+"""
+
+# shopify_id_index columns, as keys of the entries passed around in Python
+SHOPIFY_ID_COLUMNS = ['sku', 'product_gid', 'variant_gid', 'inventory_item_gid', 'remote_hash', 'has_image',
+                      'metafields_hash']
+
+def _product_row(p: Product) -> Tuple:
+    return (
+        p.sku,
+        p.title,
+        p.description,
+        p.price,
+        p.availability,
+        p.original_price,
+        p.discount,
+        p.range,
+        p.reading,
+        p.family,
+        p.weight,
+        p.dimensions,
+        p.image_url,
+        p.product_url,
+        p.category,
+        p.subcategory
+    )
+
+def _content_hash_sql(alias: str) -> str:
+    """SQL expression hashing every upserted column except the key"""
+    columns = ', '.join(f"{alias}.{column}" for column in UPSERT_COLUMNS if column != 'sku')
+    return f"md5(ROW({columns})::text)"
+
+class UpsertResult:
+    """SKUs an upsert inserted, changed and left unchanged"""
+    def __init__(self, added: Set[str], changed: Set[str], unchanged: Set[str]):
+        self.added = added
+        self.changed = changed
+        self.unchanged = unchanged
+        
+    @property
+    def delta(self) -> Set[str]:
+        """SKUs whose content is new or different"""
+        return self.added | self.changed
+        
+    def counts(self) -> Dict[str, int]:
+        return {
+            'inserted': len(self.added),
+            'updated': len(self.changed),
+            'unchanged': len(self.unchanged)
+        }
+        
+    def __repr__(self) -> str:
+        return f"UpsertResult({self.counts()})"
+
+def _copy_value(value: Any) -> str:
+    """Encode a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+class _CopyStream(io.TextIOBase):
+    """Read-only file over an iterator of text chunks, fed to COPY FROM STDIN"""
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = ''
+        
+    def readable(self) -> bool:
+        return True
+        
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+        
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
 class Database:
-    def __init__(self):
+    def __init__(self, pool: Optional[ConnectionPool] = None):
+        self.pool = pool
         self.conn = None
         self.cursor = None
         
     def connect(self):
-        """Connect to PostgreSQL database"""
+        """Check out a connection from the shared pool"""
         try:
-            self.conn = psycopg2.connect(**config.DB_CONFIG)
+            if self.pool is None:
+                self.pool = get_pool()
+            self.conn = self.pool.getconn()
             self.cursor = self.conn.cursor()
-            logger.info("Successfully connected to database")
+            logger.debug("Checked out database connection")
         except Exception as e:
             logger.error(f"Database connection failed: {str(e)}")
             raise
             
     def close(self):
-        """Close database connection"""
-        if self.cursor:
+        """Return the connection to the pool"""
+        if self.cursor and not self.cursor.closed:
             self.cursor.close()
         if self.conn:
-            self.conn.close()
-            logger.info("Database connection closed")
+            self.pool.putconn(self.conn)
+            logger.debug("Returned database connection")
+        self.conn = None
+        self.cursor = None
+        
+    def __enter__(self):
+        self.connect()
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
             
     def create_tables(self):
         """Create necessary tables if they don't exist"""
@@ -65,6 +198,111 @@ class Database:
                 )
             """)
             
+            # Hash of the product content; rows are only rewritten when it changes
+            self.cursor.execute("""
+                ALTER TABLE products
+                ADD COLUMN IF NOT EXISTS content_hash CHAR(32)
+            """)
+            self.cursor.execute(f"""
+                UPDATE products
+                SET content_hash = {_content_hash_sql('products')}
+                WHERE content_hash IS NULL
+            """)
+            
+            # Set on insert and on real content changes only
+            self.cursor.execute("""
+                ALTER TABLE products
+                ADD COLUMN IF NOT EXISTS modified_at TIMESTAMP
+            """)
+            self.cursor.execute("""
+                UPDATE products
+                SET modified_at = COALESCE(last_updated, CURRENT_TIMESTAMP)
+                WHERE modified_at IS NULL
+            """)
+            self.cursor.execute("""
+                ALTER TABLE products
+                ALTER COLUMN modified_at SET DEFAULT CURRENT_TIMESTAMP
+            """)
+            # Served the modified_at delta query the outbox replaced
+            self.cursor.execute("DROP INDEX IF EXISTS idx_products_modified_at")
+            
+            self.cursor.execute("""
+                ALTER TABLE sync_logs
+                ADD COLUMN IF NOT EXISTS validation_report JSONB
+            """)
+            # Per-stage timings, throughput and resource use (see run_stats.RunStats)
+            self.cursor.execute("""
+                ALTER TABLE sync_logs
+                ADD COLUMN IF NOT EXISTS stage_metrics JSONB
+            """)
+            # Feed imports and Shopify pushes both log here; started_at bounds the next delta
+            self.cursor.execute("""
+                ALTER TABLE sync_logs
+                ADD COLUMN IF NOT EXISTS sync_type VARCHAR(20) DEFAULT 'feed',
+                ADD COLUMN IF NOT EXISTS started_at TIMESTAMP
+            """)
+            
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS feed_state (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_sha256 CHAR(64),
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Products still to be pushed to Shopify; filled by upsert_products
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    sku VARCHAR(255) NOT NULL,
+                    change_type VARCHAR(10) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    claimed_at TIMESTAMP,
+                    attempts INTEGER DEFAULT 0,
+                    processed_at TIMESTAMP,
+                    last_error TEXT
+                )
+            """)
+            # Entries that failed OUTBOX_MAX_ATTEMPTS times are closed with failed = TRUE
+            self.cursor.execute("""
+                ALTER TABLE product_outbox
+                ADD COLUMN IF NOT EXISTS failed BOOLEAN DEFAULT FALSE
+            """)
+            self.cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_product_outbox_pending
+                ON product_outbox (sku) WHERE processed_at IS NULL
+            """)
+            
+            # Shopify IDs of every pushed SKU, so pushes don't look products up remotely.
+            # remote_hash is the product_hash of the last successful push
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS shopify_id_index (
+                    sku VARCHAR(255) PRIMARY KEY,
+                    product_gid TEXT NOT NULL,
+                    variant_gid TEXT NOT NULL,
+                    inventory_item_gid TEXT,
+                    remote_hash CHAR(32),
+                    has_image BOOLEAN DEFAULT FALSE,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # metafields_hash of the metafields last written to Shopify
+            self.cursor.execute("""
+                ALTER TABLE shopify_id_index
+                ADD COLUMN IF NOT EXISTS metafields_hash CHAR(32)
+            """)
+
+            # Exportable products in SKU order without refiltering the catalog; upserts keep it current
+            self.cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_products_exportable
+                ON products (sku)
+                WHERE {' AND '.join(condition for condition, _ in EXPORT_FILTERS)}
+            """)
+            # Replaced by idx_products_exportable
+            self.cursor.execute("DROP MATERIALIZED VIEW IF EXISTS exportable_products")
+            
             self.conn.commit()
             logger.info("Database tables created successfully")
         except Exception as e:
@@ -72,137 +310,587 @@ class Database:
             logger.error(f"Failed to create tables: {str(e)}")
             raise
             
-    def upsert_products(self, products: List[Dict[str, Any]]):
-        """Insert or update products in bulk"""
+    def upsert_products(self, products: Iterable[Product], page_size: int = 1000, method: str = 'copy') -> UpsertResult:
+        """Insert or update products in bulk.
+        
+        Rows are loaded into a temporary staging table, with COPY FROM STDIN
+        (method='copy') or multi-row VALUES inserts (method='values'), and then
+        merged into products with one INSERT ... ON CONFLICT statement. Existing
+        rows are only rewritten when their content_hash differs. products may be
+        any iterable, e.g. ExcelParser.iter_products(); it is consumed page_size
+        rows at a time. Returns the added, changed and unchanged SKUs.
+        """
         try:
-            query = """
-                INSERT INTO products (
-                    sku, title, description, price, availability, original_price, 
-                    discount, range, reading, family, weight, dimensions, 
-                    image_url, product_url, category, subcategory
+            columns = ', '.join(UPSERT_COLUMNS)
+            # Temporary tables skip the WAL; seq keeps the last row of duplicated SKUs
+            self.cursor.execute("""
+                CREATE TEMP TABLE products_staging (
+                    LIKE products INCLUDING DEFAULTS,
+                    seq BIGSERIAL
+                ) ON COMMIT DROP
+            """)
+            
+            if method == 'copy':
+                staged = self._copy_to_staging(products, page_size)
+            elif method == 'values':
+                staged = self._insert_to_staging(products, page_size)
+            else:
+                raise ValueError(f"Unknown upsert method: {method}")
+                
+            updates = ',\n                    '.join(
+                f"{column} = EXCLUDED.{column}" for column in UPSERT_COLUMNS if column != 'sku'
+            )
+            # Added and changed SKUs are queued in the outbox in the same statement,
+            # unless they are already waiting there unclaimed
+            self.cursor.execute(f"""
+                WITH merged AS (
+                    INSERT INTO products ({columns}, content_hash)
+                    SELECT DISTINCT ON (sku) {columns}, {_content_hash_sql('s')}
+                    FROM products_staging s
+                    ORDER BY sku, seq DESC
+                    ON CONFLICT (sku) DO UPDATE
+                    SET {updates},
+                        content_hash = EXCLUDED.content_hash,
+                        last_updated = CURRENT_TIMESTAMP,
+                        modified_at = CURRENT_TIMESTAMP
+                    WHERE products.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                    RETURNING sku, (xmax = 0) AS inserted
+                ), queued AS (
+                    INSERT INTO product_outbox (sku, change_type)
+                    SELECT sku, CASE WHEN inserted THEN 'added' ELSE 'changed' END
+                    FROM merged m
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM product_outbox o
+                        WHERE o.sku = m.sku AND o.processed_at IS NULL AND o.claimed_at IS NULL
+                    )
                 )
-                VALUES %s
-                ON CONFLICT (sku) DO UPDATE
-                SET title = EXCLUDED.title,
-                    description = EXCLUDED.description,
-                    price = EXCLUDED.price,
-                    availability = EXCLUDED.availability,
-                    original_price = EXCLUDED.original_price,
-                    discount = EXCLUDED.discount,
-                    range = EXCLUDED.range,
-                    reading = EXCLUDED.reading,
-                    family = EXCLUDED.family,
-                    weight = EXCLUDED.weight,
-                    dimensions = EXCLUDED.dimensions,
-                    image_url = EXCLUDED.image_url,
-                    product_url = EXCLUDED.product_url,
-                    category = EXCLUDED.category,
-                    subcategory = EXCLUDED.subcategory,
-                    last_updated = CURRENT_TIMESTAMP
-            """
+                SELECT sku, inserted FROM merged
+            """)
+            added = set()
+            changed = set()
+            for sku, inserted in self.cursor.fetchall():
+                (added if inserted else changed).add(sku)
+                
+            self.cursor.execute("SELECT DISTINCT sku FROM products_staging")
+            unchanged = {row[0] for row in self.cursor.fetchall()} - added - changed
             
-            values = [(
-                p['sku'],
-                p.get('title', ''),
-                p.get('description', ''),
-                p['price'],
-                p['availability'],
-                p['original_price'],
-                p['discount'],
-                p.get('range', ''),
-                p.get('reading', ''),
-                p.get('family', ''),
-                p.get('weight', ''),
-                p.get('dimensions', ''),
-                p.get('image_url', ''),
-                p.get('product_url', ''),
-                p.get('category', ''),
-                p.get('subcategory', '')
-            ) for p in products]
-            
-            execute_values(self.cursor, query, values)
             self.conn.commit()
-            logger.info(f"Successfully upserted {len(products)} products")
+            
+            result = UpsertResult(added, changed, unchanged)
+            logger.info(
+                f"Successfully upserted {staged} products: {len(added)} inserted, "
+                f"{len(changed)} updated, {len(unchanged)} unchanged"
+            )
+            for outcome, count in result.counts().items():
+                metrics.UPSERTED_ROWS.inc(count, result=outcome)
+            return result
         except Exception as e:
             self.conn.rollback()
             logger.error(f"Failed to upsert products: {str(e)}")
             raise
             
-    def log_sync(self, products_updated: int, products_added: int, status: str, error_message: str = None):
+    def _copy_to_staging(self, products: Iterable[Product], page_size: int) -> int:
+        """Stream products into products_staging with COPY FROM STDIN"""
+        staged = 0
+        
+        def chunks() -> Iterator[str]:
+            nonlocal staged
+            iterator = iter(products)
+            while True:
+                page = list(islice(iterator, page_size))
+                if not page:
+                    break
+                staged += len(page)
+                yield ''.join(
+                    '\t'.join(_copy_value(value) for value in _product_row(p)) + '\n'
+                    for p in page
+                )
+                
+        self.cursor.copy_expert(
+            f"COPY products_staging ({', '.join(UPSERT_COLUMNS)}) FROM STDIN",
+            _CopyStream(chunks())
+        )
+        return staged
+        
+    def _insert_to_staging(self, products: Iterable[Product], page_size: int) -> int:
+        """Fill products_staging with multi-row VALUES inserts"""
+        query = f"INSERT INTO products_staging ({', '.join(UPSERT_COLUMNS)}) VALUES %s"
+        staged = 0
+        iterator = iter(products)
+        while True:
+            page = list(islice(iterator, page_size))
+            if not page:
+                break
+            execute_values(self.cursor, query, [_product_row(p) for p in page], page_size=page_size)
+            staged += len(page)
+        return staged
+            
+    def log_sync(self, products_updated: int, products_added: int, status: str, error_message: str = None,
+                 validation_report: Optional[Dict[str, Any]] = None, sync_type: str = 'feed',
+                 started_at: Optional[datetime] = None, stage_metrics: Optional[Dict[str, Any]] = None):
         """Log synchronization results"""
         try:
             self.cursor.execute("""
-                INSERT INTO sync_logs (products_updated, products_added, status, error_message)
-                VALUES (%s, %s, %s, %s)
-            """, (products_updated, products_added, status, error_message))
+                INSERT INTO sync_logs (products_updated, products_added, status, error_message,
+                                       validation_report, sync_type, started_at, stage_metrics)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (products_updated, products_added, status, error_message,
+                  Json(validation_report) if validation_report is not None else None,
+                  sync_type, started_at,
+                  Json(stage_metrics) if stage_metrics is not None else None))
             
             self.conn.commit()
             logger.info("Sync log recorded successfully")
+            metrics.SYNC_RUNS.inc(sync_type=sync_type, status=status.lower())
+            metrics.LAST_RUN.set(time.time(), sync_type=sync_type, status=status.lower())
         except Exception as e:
             self.conn.rollback()
             logger.error(f"Failed to log sync: {str(e)}")
             raise
             
-    def get_all_products(self):
-        """Veritabanından filtrelenmiş ürünleri getirir"""
+    def get_stage_trends(self, runs: int = 30, sync_type: Optional[str] = None):
+        """p50/p95 duration and throughput per stage over the most recent runs"""
+        try:
+            query = """
+                SELECT stage.key AS stage,
+                       COUNT(*) AS runs,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY (stage.value->>'seconds')::float) AS p50_seconds,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY (stage.value->>'seconds')::float) AS p95_seconds,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY (stage.value->>'rows_per_second')::float) AS p50_rows_per_second,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY (stage.value->>'peak_rss_mb')::float) AS p95_peak_rss_mb
+                FROM (
+                    SELECT stage_metrics
+                    FROM sync_logs
+                    WHERE stage_metrics IS NOT NULL
+                    AND (%(sync_type)s IS NULL OR sync_type = %(sync_type)s)
+                    ORDER BY id DESC
+                    LIMIT %(runs)s
+                ) recent,
+                jsonb_each(recent.stage_metrics->'stages') stage
+                GROUP BY stage.key
+                ORDER BY stage.key
+            """
+            return pd.read_sql_query(query, self.conn, params={'runs': runs, 'sync_type': sync_type})
+        except Exception as e:
+            logger.error(f"Failed to get stage trends: {str(e)}")
+            raise
+            
+    def current_timestamp(self) -> datetime:
+        """The database clock, comparable with the stored timestamps"""
+        self.cursor.execute("SELECT LOCALTIMESTAMP")
+        return self.cursor.fetchone()[0]
+            
+    def get_last_successful_sync(self, sync_type: str = 'shopify_push') -> Optional[datetime]:
+        """Start time of the last fully successful sync of the given type, or None.
+        
+        Products modified after it are the ones that still need pushing.
+        Partial successes don't count, so their failed products are retried.
+        """
+        try:
+            self.cursor.execute("""
+                SELECT COALESCE(started_at, sync_time)
+                FROM sync_logs
+                WHERE sync_type = %s AND UPPER(status) = 'SUCCESS'
+                ORDER BY id DESC
+                LIMIT 1
+            """, (sync_type,))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to get last successful sync: {str(e)}")
+            raise
+            
+    def claim_outbox(self, limit: int = 50) -> Dict[str, List[int]]:
+        """Claim up to `limit` pending outbox entries for this worker.
+        
+        Rows are picked with FOR UPDATE SKIP LOCKED so concurrent workers never
+        claim the same entry, and a claim is a lease: entries of a worker that
+        crashed become claimable again after OUTBOX_LEASE_SECONDS. SKUs already
+        being pushed by another worker are skipped. Returns entry ids by SKU.
+        """
+        try:
+            self.cursor.execute("""
+                UPDATE product_outbox o
+                SET claimed_at = CURRENT_TIMESTAMP, attempts = o.attempts + 1
+                FROM (
+                    SELECT id FROM product_outbox p
+                    WHERE processed_at IS NULL
+                    AND attempts < %(max_attempts)s
+                    AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second')
+                    AND NOT EXISTS (
+                        SELECT 1 FROM product_outbox busy
+                        WHERE busy.sku = p.sku AND busy.id <> p.id AND busy.processed_at IS NULL
+                        AND busy.claimed_at >= CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second'
+                    )
+                    ORDER BY id
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                ) claimable
+                WHERE o.id = claimable.id
+                RETURNING o.id, o.sku
+            """, {'max_attempts': config.OUTBOX_MAX_ATTEMPTS, 'lease': config.OUTBOX_LEASE_SECONDS, 'limit': limit})
+            claimed: Dict[str, List[int]] = {}
+            for entry_id, sku in self.cursor.fetchall():
+                claimed.setdefault(sku, []).append(entry_id)
+            self.conn.commit()
+            return claimed
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to claim outbox entries: {str(e)}")
+            raise
+            
+    def complete_outbox(self, entry_ids: List[int]):
+        """Mark claimed outbox entries as pushed"""
+        if not entry_ids:
+            return
+        try:
+            self.cursor.execute("""
+                UPDATE product_outbox
+                SET processed_at = CURRENT_TIMESTAMP, last_error = NULL
+                WHERE id = ANY(%s)
+            """, (list(entry_ids),))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to complete outbox entries: {str(e)}")
+            raise
+            
+    def complete_outbox_before(self, before: datetime) -> int:
+        """Mark unclaimed entries queued before `before` as pushed, after a full push covered them"""
+        try:
+            self.cursor.execute("""
+                UPDATE product_outbox
+                SET processed_at = CURRENT_TIMESTAMP
+                WHERE processed_at IS NULL AND claimed_at IS NULL AND created_at < %s
+            """, (before,))
+            completed = self.cursor.rowcount
+            self.conn.commit()
+            return completed
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to complete outbox entries: {str(e)}")
+            raise
+            
+    def fail_outbox(self, entry_ids: List[int], error_message: str) -> List[str]:
+        """Record a failed push; the entries are retried once their lease expires.
+        Entries out of attempts are dead-lettered instead; returns their SKUs
+        """
+        if not entry_ids:
+            return []
+        try:
+            self.cursor.execute("""
+                UPDATE product_outbox
+                SET last_error = %s,
+                    processed_at = CASE WHEN attempts >= %s THEN CURRENT_TIMESTAMP END,
+                    failed = attempts >= %s
+                WHERE id = ANY(%s)
+                RETURNING sku, failed
+            """, (error_message, config.OUTBOX_MAX_ATTEMPTS, config.OUTBOX_MAX_ATTEMPTS, list(entry_ids)))
+            dead = sorted({sku for sku, failed in self.cursor.fetchall() if failed})
+            self.conn.commit()
+            return dead
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to record outbox failure: {str(e)}")
+            raise
+            
+    def dead_letter_outbox(self) -> List[str]:
+        """Close entries out of attempts whose last lease expired without a result, e.g. after a crash.
+        Returns their SKUs
+        """
+        try:
+            self.cursor.execute("""
+                UPDATE product_outbox
+                SET processed_at = CURRENT_TIMESTAMP, failed = TRUE,
+                    last_error = COALESCE(last_error, 'Lease expired')
+                WHERE processed_at IS NULL
+                AND attempts >= %s
+                AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                RETURNING sku
+            """, (config.OUTBOX_MAX_ATTEMPTS, config.OUTBOX_LEASE_SECONDS))
+            dead = sorted({row[0] for row in self.cursor.fetchall()})
+            self.conn.commit()
+            return dead
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to dead-letter outbox entries: {str(e)}")
+            raise
+            
+    def purge_outbox(self, keep_days: Optional[int] = None) -> int:
+        """Delete outbox entries pushed or dead-lettered more than keep_days ago"""
+        keep_days = config.OUTBOX_RETENTION_DAYS if keep_days is None else keep_days
+        try:
+            self.cursor.execute("""
+                DELETE FROM product_outbox
+                WHERE processed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+            """, (keep_days,))
+            purged = self.cursor.rowcount
+            self.conn.commit()
+            return purged
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to purge outbox: {str(e)}")
+            raise
+            
+    def get_products_by_sku(self, skus: List[str]) -> List[Product]:
+        """Pushable products for the given SKUs; SKUs failing the push filters are left out"""
+        try:
+            self.cursor.execute(f"""
+                SELECT * FROM products
+                WHERE sku = ANY(%s)
+                AND {PUSH_FILTERS}
+                ORDER BY sku
+            """, (list(skus),))
+            columns = [column.name for column in self.cursor.description]
+            return [Product.from_db_row(dict(zip(columns, row))) for row in self.cursor.fetchall()]
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to get products by SKU: {str(e)}")
+            raise
+
+    def get_shopify_ids(self, skus: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """ID index entries by SKU, for the given SKUs or the whole index"""
+        try:
+            query = f"SELECT {', '.join(SHOPIFY_ID_COLUMNS)} FROM shopify_id_index"
+            if skus is None:
+                self.cursor.execute(query)
+            else:
+                self.cursor.execute(f"{query} WHERE sku = ANY(%s)", (list(skus),))
+            return {row[0]: dict(zip(SHOPIFY_ID_COLUMNS, row)) for row in self.cursor.fetchall()}
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to get Shopify IDs: {str(e)}")
+            raise
+
+    def count_shopify_ids(self) -> int:
+        try:
+            self.cursor.execute("SELECT COUNT(*) FROM shopify_id_index")
+            return self.cursor.fetchone()[0]
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to count Shopify IDs: {str(e)}")
+            raise
+
+    def save_shopify_ids(self, entries: Iterable[Dict[str, Any]]):
+        """Insert or update ID index entries, e.g. from mutation responses"""
+        rows = [tuple(entry.get(column) for column in SHOPIFY_ID_COLUMNS) for entry in entries]
+        if not rows:
+            return
+        try:
+            execute_values(self.cursor, f"""
+                INSERT INTO shopify_id_index ({', '.join(SHOPIFY_ID_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (sku) DO UPDATE
+                SET product_gid = EXCLUDED.product_gid,
+                    variant_gid = EXCLUDED.variant_gid,
+                    inventory_item_gid = COALESCE(EXCLUDED.inventory_item_gid, shopify_id_index.inventory_item_gid),
+                    remote_hash = EXCLUDED.remote_hash,
+                    has_image = EXCLUDED.has_image,
+                    -- Left as is by pushes that don't write metafields
+                    metafields_hash = COALESCE(EXCLUDED.metafields_hash, shopify_id_index.metafields_hash),
+                    updated_at = CURRENT_TIMESTAMP
+            """, rows)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to save Shopify IDs: {str(e)}")
+            raise
+
+    def save_metafields_hashes(self, hashes: Dict[str, str]):
+        """Record the metafields just written for indexed SKUs"""
+        if not hashes:
+            return
+        try:
+            execute_values(self.cursor, """
+                UPDATE shopify_id_index i
+                SET metafields_hash = v.metafields_hash, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v (sku, metafields_hash)
+                WHERE i.sku = v.sku
+            """, list(hashes.items()))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to save metafields hashes: {str(e)}")
+            raise
+
+    def delete_shopify_ids(self, skus: List[str]):
+        """Drop entries whose product no longer exists in Shopify"""
+        if not skus:
+            return
+        try:
+            self.cursor.execute("DELETE FROM shopify_id_index WHERE sku = ANY(%s)", (list(skus),))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to delete Shopify IDs: {str(e)}")
+            raise
+
+    def replace_shopify_ids(self, entries: Iterable[Dict[str, Any]], page_size: int = 1000) -> int:
+        """Rebuild the ID index from a full catalog export, in one transaction.
+
+        SKUs missing from the export are removed. remote_hash and
+        metafields_hash are kept for variants that are unchanged, so a rebuild
+        doesn't force a full re-push.
+        Returns the number of entries in the index.
+        """
+        columns = [column for column in SHOPIFY_ID_COLUMNS if column not in ('remote_hash', 'metafields_hash')]
+        try:
+            self.cursor.execute("""
+                CREATE TEMP TABLE shopify_id_staging
+                (LIKE shopify_id_index INCLUDING DEFAULTS)
+                ON COMMIT DROP
+            """)
+            iterator = iter(entries)
+            while True:
+                page = list(islice(iterator, page_size))
+                if not page:
+                    break
+                execute_values(
+                    self.cursor,
+                    f"INSERT INTO shopify_id_staging ({', '.join(columns)}) VALUES %s",
+                    [tuple(entry.get(column) for column in columns) for entry in page],
+                    page_size=page_size
+                )
+
+            self.cursor.execute("""
+                DELETE FROM shopify_id_index i
+                WHERE NOT EXISTS (SELECT 1 FROM shopify_id_staging s WHERE s.sku = i.sku)
+            """)
+            # A SKU can appear on several variants; the export order picks one
+            self.cursor.execute(f"""
+                INSERT INTO shopify_id_index ({', '.join(columns)})
+                SELECT DISTINCT ON (sku) {', '.join(columns)} FROM shopify_id_staging
+                ON CONFLICT (sku) DO UPDATE
+                SET product_gid = EXCLUDED.product_gid,
+                    variant_gid = EXCLUDED.variant_gid,
+                    inventory_item_gid = EXCLUDED.inventory_item_gid,
+                    remote_hash = CASE WHEN shopify_id_index.variant_gid = EXCLUDED.variant_gid
+                                       THEN shopify_id_index.remote_hash END,
+                    metafields_hash = CASE WHEN shopify_id_index.product_gid = EXCLUDED.product_gid
+                                           THEN shopify_id_index.metafields_hash END,
+                    has_image = EXCLUDED.has_image,
+                    updated_at = CURRENT_TIMESTAMP
+            """)
+            self.cursor.execute("SELECT COUNT(*) FROM shopify_id_index")
+            total = self.cursor.fetchone()[0]
+
+            self.conn.commit()
+            logger.info(f"Shopify ID index rebuilt with {total} SKUs")
+            return total
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to rebuild Shopify ID index: {str(e)}")
+            raise
+
+    def get_feed_state(self, url: str) -> Optional[Dict[str, Any]]:
+        """Get the validators stored for the last successfully synced feed"""
+        try:
+            self.cursor.execute("""
+                SELECT etag, last_modified, content_sha256
+                FROM feed_state
+                WHERE url = %s
+            """, (url,))
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+            return {
+                'etag': row[0],
+                'last_modified': row[1],
+                'content_sha256': row[2]
+            }
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to get feed state: {str(e)}")
+            raise
+            
+    def save_feed_state(self, url: str, etag: Optional[str], last_modified: Optional[str], content_sha256: Optional[str]):
+        """Store the validators of the feed that was just synced"""
+        try:
+            self.cursor.execute("""
+                INSERT INTO feed_state (url, etag, last_modified, content_sha256)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (url) DO UPDATE
+                SET etag = EXCLUDED.etag,
+                    last_modified = EXCLUDED.last_modified,
+                    content_sha256 = EXCLUDED.content_sha256,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (url, etag, last_modified, content_sha256))
+            
+            self.conn.commit()
+            logger.info("Feed state recorded successfully")
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to save feed state: {str(e)}")
+            raise
+            
+    def get_all_products(self, diagnostics: bool = True):
+        """Veritabanından filtrelenmiş ürünleri getirir.
+        
+        Reads through the idx_products_exportable partial index.
+        diagnostics=True logs how many products survive each filter stage,
+        computed in a single aggregate scan; pass False to skip it.
+        """
         try:
             logger.info("Fetching filtered products from database...")
             
-            # Önce toplam ürün sayısını kontrol et
-            count_query = "SELECT COUNT(*) as total FROM products"
-            total = pd.read_sql_query(count_query, self.conn).iloc[0]['total']
-            logger.info(f"Toplam ürün sayısı: {total}")
-            
-            # Availability değerlerini kontrol et
-            avail_query = """
-                SELECT sku, title, availability 
-                FROM products 
-                WHERE availability = '0'
-                LIMIT 5
-            """
-            avail_df = pd.read_sql_query(avail_query, self.conn)
-            logger.info("Örnek ürünler (stokta 0 olanlar):")
-            for _, row in avail_df.iterrows():
-                logger.info(f"  SKU: {row['sku']}, Title: {row['title']}, Availability: {row['availability']}")
-            
-            # Şimdi filtreleri tek tek uygulayarak kaç ürün kaldığını görelim
-            filters = [
-                ("sku IS NOT NULL AND sku != ''", "SKU'su olan"),
-                ("title IS NOT NULL", "Başlığı olan"),
-                ("price IS NOT NULL", "Fiyatı olan"),
-                ("image_url IS NOT NULL AND image_url != ''", "Resmi olan"),
-                ("availability != '0'", "Stokta olan")  # 0 olmayan değerler stokta var demek
-            ]
-            
-            current_filter = ""
-            for condition, description in filters:
-                current_filter += f" AND {condition}" if current_filter else f"WHERE {condition}"
-                check_query = f"SELECT COUNT(*) as filtered FROM products {current_filter}"
-                filtered = pd.read_sql_query(check_query, self.conn).iloc[0]['filtered']
-                logger.info(f"{description} ürün sayısı: {filtered}")
+            if diagnostics:
+                self._log_filter_stats()
             
             # Son olarak tüm filtrelerle ürünleri getir
-            query = f"""
-                SELECT * FROM products 
-                {current_filter}
-                ORDER BY sku
-            """
-            return pd.read_sql_query(query, self.conn)
+            return pd.read_sql_query(EXPORTABLE_PRODUCTS_QUERY, self.conn)
         except Exception as e:
             logger.error(f"Error fetching products: {str(e)}")
             raise
-
-    def get_modified_products(self, last_sync: datetime):
-        """Get products modified since last sync with quality filters"""
-        query = """
-        SELECT *
-        FROM products
-        WHERE 1=1
-        AND modified_at > ?
-        AND sku IS NOT NULL AND sku != ''  -- SKU'su olan ürünler
-        AND title IS NOT NULL  -- Başlığı olan ürünler
-        AND price IS NOT NULL  -- Fiyatı olan ürünler
-        AND availability IS NOT NULL  -- Stok durumu belli olan ürünler
+            
+    def iter_products(self, chunk_size: int = 1000) -> Iterator[List[Product]]:
+        """Filtered products in chunks, read through a server-side cursor.
+        
+        Only one chunk is held in memory at a time, however large the
+        catalog is. The cursor runs on a pooled connection of its own, so the
+        caller may commit or roll back on this one while streaming; it sees
+        committed data only.
         """
-        logger.info(f"Fetching filtered products modified since {last_sync}")
-        return pd.read_sql_query(query, self.conn, params=[last_sync]) 
\ No newline at end of file
+        return self._stream_products(EXPORTABLE_PRODUCTS_QUERY, (), chunk_size)
+        
+    def _stream_products(self, query: str, params: Tuple, chunk_size: int) -> Iterator[List[Product]]:
+        self.cursor.execute("SHOW search_path")
+        search_path = self.cursor.fetchone()[0]
+        conn = self.pool.getconn()
+        try:
+            # Same schema as this connection, for the stream's transaction only
+            with conn.cursor() as setup:
+                setup.execute("SELECT set_config('search_path', %s, true)", (search_path,))
+            with conn.cursor(name=f"products_stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [Product.from_db_row(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error streaming products: {str(e)}")
+            raise
+        finally:
+            # Rolled back by the pool, which also ends the search_path setting
+            self.pool.putconn(conn)
+            
+    def _log_filter_stats(self):
+        """Log the product count left after each cumulative export filter, in one scan"""
+        stages = []
+        for i in range(len(EXPORT_FILTERS)):
+            conditions = " AND ".join(condition for condition, _ in EXPORT_FILTERS[:i + 1])
+            stages.append(f"COUNT(*) FILTER (WHERE {conditions})")
+        self.cursor.execute(f"""
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE availability = '0'),
+                   {', '.join(stages)}
+            FROM products
+        """)
+        total, out_of_stock, *filtered = self.cursor.fetchone()
+        
+        logger.info(f"Toplam ürün sayısı: {total}")
+        logger.info(f"Stokta 0 olan ürün sayısı: {out_of_stock}")
+        for (_, description), count in zip(EXPORT_FILTERS, filtered):
+            logger.info(f"{description} ürün sayısı: {count}")
@@ -0,0 +1,117 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+import psycopg2
+from psycopg2 import extensions, pool
+from loguru import logger
+from . import config
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections that are validated on checkout.
+
+    A connection that died while idle (e.g. after a server restart) is
+    discarded and replaced by a fresh one, so long running processes like
+    the scheduler never hand out a stale connection. When all maxconn
+    connections are checked out, getconn() waits up to `timeout` seconds for
+    one to be returned.
+    """
+    def __init__(self, minconn: Optional[int] = None, maxconn: Optional[int] = None,
+                 dsn: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None):
+        self.minconn = config.DB_POOL_MIN if minconn is None else minconn
+        self.maxconn = config.DB_POOL_MAX if maxconn is None else maxconn
+        self.timeout = config.DB_POOL_TIMEOUT if timeout is None else timeout
+        self._pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **(dsn or config.DB_CONFIG))
+        # Notified whenever a connection goes back to the pool
+        self._returned = threading.Condition()
+
+    @staticmethod
+    def _is_usable(conn) -> bool:
+        """Cheap round trip to make sure the server side of the connection is still there"""
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _checkout(self):
+        """A pooled connection, once one is free"""
+        deadline = time.monotonic() + self.timeout
+        with self._returned:
+            while True:
+                try:
+                    return self._pool.getconn()
+                except pool.PoolError:
+                    if self._pool.closed:
+                        raise
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise pool.PoolError(
+                            f"Database connection pool exhausted: all {self.maxconn} connections stayed "
+                            f"checked out for {self.timeout:g}s (see DB_POOL_MAX and DB_POOL_TIMEOUT)")
+                    self._returned.wait(remaining)
+
+    def _return(self, conn, close: bool = False):
+        self._pool.putconn(conn, close=close)
+        with self._returned:
+            self._returned.notify()
+
+    def getconn(self):
+        """Check out a validated connection"""
+        # Every pooled connection may be stale after a restart; one more attempt opens a new one
+        for _ in range(self.maxconn + 1):
+            conn = self._checkout()
+            if self._is_usable(conn):
+                return conn
+            logger.warning("Discarding stale database connection")
+            self._return(conn, close=True)
+        raise psycopg2.OperationalError("Could not get a working database connection from the pool")
+
+    def putconn(self, conn):
+        """Return a connection, rolling back whatever transaction was left open"""
+        if conn.closed:
+            self._return(conn, close=True)
+            return
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._return(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._return(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        self._pool.closeall()
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """The process-wide pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            logger.info(f"Database connection pool created ({_pool.minconn}-{_pool.maxconn} connections)")
+        return _pool
+
+def close_pool():
+    """Close every pooled connection; the next get_pool() starts a new pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logger.info("Database connection pool closed")
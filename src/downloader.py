@@ -1,15 +1,105 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import hashlib
+import json
+import time
 from loguru import logger
-from typing import Optional
+from typing import Optional, Dict, Any
 import tempfile
 import os
 from . import config
 
+class DownloadResult:
+    """Outcome of a feed download, including the validators for the next conditional request"""
+    def __init__(self, path: Optional[str] = None, not_modified: bool = False,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 content_sha256: Optional[str] = None):
+        self.path = path
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_sha256 = content_sha256
+
 class InsizeDownloader:
     def __init__(self):
-        self.session = requests.Session()
+        self.session = self._build_session()
+        self.timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
         self.login_url = "https://eshop.insize-eu.com/documentacion.php"
+        self.logged_in = self._load_cached_session()
+        
+    @staticmethod
+    def _build_session() -> requests.Session:
+        """Session with a pooled adapter and a bounded retry policy"""
+        retry = Retry(
+            total=config.HTTP_MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config.HTTP_POOL_SIZE,
+            pool_maxsize=config.HTTP_POOL_SIZE,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
         
+    def _load_cached_session(self) -> bool:
+        """Restore session cookies saved by a previous run if they have not expired"""
+        try:
+            if not os.path.exists(config.INSIZE_SESSION_CACHE):
+                return False
+            with open(config.INSIZE_SESSION_CACHE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('expires_at', 0) <= time.time():
+                logger.info("Cached Insize session expired")
+                return False
+            for cookie in cached.get('cookies', []):
+                self.session.cookies.set(**cookie)
+            logger.info("Reusing cached Insize session")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to load cached session: {str(e)}")
+            return False
+            
+    def _save_cached_session(self):
+        """Persist the session cookies so the next run can skip the login"""
+        try:
+            cookies = [{
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'expires': cookie.expires
+            } for cookie in self.session.cookies]
+            cache_dir = os.path.dirname(config.INSIZE_SESSION_CACHE)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            # Session cookies are credentials: keep the file private to the owner
+            fd = os.open(config.INSIZE_SESSION_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'expires_at': time.time() + config.INSIZE_SESSION_TTL,
+                    'cookies': cookies
+                }, f)
+        except Exception as e:
+            logger.warning(f"Failed to cache session: {str(e)}")
+            
+    def _clear_cached_session(self):
+        """Forget the current session, in memory and on disk"""
+        self.logged_in = False
+        self.session.cookies.clear()
+        try:
+            if os.path.exists(config.INSIZE_SESSION_CACHE):
+                os.unlink(config.INSIZE_SESSION_CACHE)
+        except Exception as e:
+            logger.warning(f"Failed to remove cached session: {str(e)}")
+            
     def login(self) -> bool:
         """Login to Insize website"""
         try:
@@ -18,7 +108,7 @@ class InsizeDownloader:
                 "password": config.INSIZE_PASSWORD
             }
             
-            response = self.session.post(self.login_url, data=data)
+            response = self.session.post(self.login_url, data=data, timeout=self.timeout)
             response.raise_for_status()
             
             # Check if login was successful (you might need to adjust this based on the actual response)
@@ -26,6 +116,8 @@ class InsizeDownloader:
                 logger.error("Login failed")
                 return False
                 
+            self.logged_in = True
+            self._save_cached_session()
             logger.info("Successfully logged in to Insize")
             return True
             
@@ -33,27 +125,177 @@ class InsizeDownloader:
             logger.error(f"Login failed: {str(e)}")
             return False
             
-    def download_excel(self) -> Optional[str]:
-        """Download the Excel file and return the path to the temporary file"""
+    @staticmethod
+    def _is_auth_failure(response: requests.Response) -> bool:
+        """The shop answers an expired session with 401/403 or with its HTML login page"""
+        if response.status_code in (401, 403):
+            return True
+        return response.ok and 'text/html' in response.headers.get('Content-Type', '')
+        
+    def download_feed(self, previous_state: Optional[Dict[str, Any]] = None) -> Optional[DownloadResult]:
+        """Download the Excel file unless it is unchanged since previous_state.
+
+        previous_state is the stored feed state (etag, last_modified, content_sha256).
+        Returns a DownloadResult with not_modified=True when the server answers 304
+        or the downloaded bytes hash to the same SHA-256 as last time.
+        """
         try:
-            if not self.login():
+            if not self.logged_in and not self.login():
                 return None
                 
-            response = self.session.get(config.INSIZE_EXCEL_URL)
+            # The workbook is already zipped; identity encoding keeps Content-Length and Range in raw bytes
+            headers = {'Accept-Encoding': 'identity'}
+            if previous_state:
+                if previous_state.get('etag'):
+                    headers['If-None-Match'] = previous_state['etag']
+                if previous_state.get('last_modified'):
+                    headers['If-Modified-Since'] = previous_state['last_modified']
+                    
+            response = self.session.get(config.INSIZE_EXCEL_URL, headers=headers, stream=True, timeout=self.timeout)
+            
+            if self._is_auth_failure(response):
+                response.close()
+                logger.info("Insize session rejected, logging in again")
+                self._clear_cached_session()
+                if not self.login():
+                    return None
+                response = self.session.get(config.INSIZE_EXCEL_URL, headers=headers, stream=True, timeout=self.timeout)
+                # Still the login page: don't stream it as the feed
+                if self._is_auth_failure(response):
+                    response.close()
+                    self._clear_cached_session()
+                    logger.error("Insize rejected the new session too, giving up on the download")
+                    return None
+            
+            if response.status_code == 304:
+                response.close()
+                logger.info("Excel file not modified since last download (304)")
+                return DownloadResult(
+                    not_modified=True,
+                    etag=response.headers.get('ETag') or previous_state.get('etag'),
+                    last_modified=response.headers.get('Last-Modified') or previous_state.get('last_modified'),
+                    content_sha256=previous_state.get('content_sha256')
+                )
+                
             response.raise_for_status()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
             
-            # Create a temporary file
+            # Create a temporary file and stream the workbook straight into it
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-            temp_file.write(response.content)
             temp_file.close()
+            try:
+                content_sha256 = self._stream_to_file(response, temp_file.name)
+            except Exception:
+                self.cleanup(temp_file.name)
+                raise
+            
+            # Servers without validators still send the full body; compare content instead
+            if previous_state and previous_state.get('content_sha256') == content_sha256:
+                logger.info("Excel file content unchanged since last download (same SHA-256)")
+                self.cleanup(temp_file.name)
+                return DownloadResult(
+                    not_modified=True,
+                    etag=etag,
+                    last_modified=last_modified,
+                    content_sha256=content_sha256
+                )
             
             logger.info(f"Excel file downloaded successfully to {temp_file.name}")
-            return temp_file.name
+            return DownloadResult(
+                path=temp_file.name,
+                etag=etag,
+                last_modified=last_modified,
+                content_sha256=content_sha256
+            )
             
         except Exception as e:
             logger.error(f"Failed to download Excel file: {str(e)}")
             return None
             
+    def _stream_to_file(self, response: requests.Response, file_path: str) -> str:
+        """Write a streamed response body to file_path chunk by chunk.
+        
+        A dropped connection is resumed with a Range request from the last written byte.
+        The final size is checked against Content-Length. Returns the SHA-256 of the body.
+        """
+        url = response.url
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        expected_size = self._content_length(response)
+        hasher = hashlib.sha256()
+        written = 0
+        resumes = 0
+        
+        with open(file_path, 'wb') as f:
+            while True:
+                error = None
+                try:
+                    for chunk in response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        written += len(chunk)
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                    error = e
+                finally:
+                    response.close()
+                    
+                if error is None and (expected_size is None or written >= expected_size):
+                    break
+                    
+                if resumes >= config.DOWNLOAD_MAX_RESUMES:
+                    raise IOError(f"Download incomplete after {resumes} resumes: {written}/{expected_size} bytes")
+                resumes += 1
+                logger.warning(f"Download interrupted at {written} bytes ({error or 'short read'}), resuming")
+                
+                headers = {'Accept-Encoding': 'identity', 'Range': f"bytes={written}-"}
+                if validator:
+                    headers['If-Range'] = validator
+                response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+                
+                if response.status_code == 206 and self._range_start(response) == written:
+                    continue
+                    
+                response.raise_for_status()
+                
+                # Range ignored or the file changed on the server: start over
+                logger.warning("Server did not resume the download, restarting from the beginning")
+                if response.status_code != 200:
+                    response.close()
+                    response = self.session.get(url, headers={'Accept-Encoding': 'identity'}, stream=True, timeout=self.timeout)
+                    response.raise_for_status()
+                f.seek(0)
+                f.truncate()
+                hasher = hashlib.sha256()
+                written = 0
+                expected_size = self._content_length(response)
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                
+        if expected_size is not None and written != expected_size:
+            raise IOError(f"Downloaded {written} bytes but Content-Length was {expected_size}")
+            
+        logger.info(f"Downloaded {written} bytes in {resumes + 1} request(s)")
+        return hasher.hexdigest()
+        
+    @staticmethod
+    def _content_length(response: requests.Response) -> Optional[int]:
+        """Total body size announced by the server, if any"""
+        content_length = response.headers.get('Content-Length')
+        return int(content_length) if content_length and content_length.isdigit() else None
+        
+    @staticmethod
+    def _range_start(response: requests.Response) -> Optional[int]:
+        """First byte offset of a 206 response, parsed from Content-Range"""
+        content_range = response.headers.get('Content-Range', '')
+        try:
+            return int(content_range.split(' ', 1)[1].split('-', 1)[0])
+        except (IndexError, ValueError):
+            return None
+            
+    def download_excel(self) -> Optional[str]:
+        """Download the Excel file and return the path to the temporary file"""
+        result = self.download_feed()
+        return result.path if result else None
+            
     def cleanup(self, file_path: str):
         """Clean up temporary files"""
         try:
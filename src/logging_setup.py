@@ -0,0 +1,15 @@
+import sys
+from loguru import logger
+from . import config
+
+def setup_logging(level: str = "INFO"):
+    """Route loguru to stderr and the log file through background queues.
+    
+    With enqueue=True formatting and writing happen on loguru's worker
+    thread, so logging never blocks parsing or network calls.
+    """
+    logger.remove()
+    logger.add(sys.stderr, format=config.LOG_FORMAT, level=level, enqueue=True)
+    if config.LOG_FILE:
+        logger.add(config.LOG_FILE, format=config.LOG_FORMAT, level=level, enqueue=True,
+                   rotation="10 MB", retention=10)
@@ -0,0 +1,211 @@
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from loguru import logger
+from . import config
+
+# Stage durations range from sub-second parses to hour long initial pushes
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines of the exposition format"""
+
+class Counter(_Metric):
+    """Monotonically increasing total"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text format.
+
+    Served on an optional local /metrics endpoint (METRICS_PORT) or written to
+    a node-exporter textfile (METRICS_TEXTFILE). Values are recorded per stage,
+    batch or API request, never inside per-row loops.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'insize_stage_duration_seconds', 'Duration of sync stages', ['stage']))
+STAGE_ROWS = REGISTRY.register(Counter(
+    'insize_stage_rows_total', 'Products processed per stage (parsed, upserted, pushed)', ['stage']))
+UPSERTED_ROWS = REGISTRY.register(Counter(
+    'insize_upserted_rows_total', 'Upserted products by result', ['result']))
+PUSHED_ROWS = REGISTRY.register(Counter(
+    'insize_pushed_rows_total', 'Products pushed to Shopify by outcome', ['outcome']))
+SHOPIFY_CALLS = REGISTRY.register(Counter(
+    'insize_shopify_api_calls_total', 'Shopify API requests by operation', ['operation']))
+GRAPHQL_COST = REGISTRY.register(Counter(
+    'insize_shopify_graphql_cost_total', 'Shopify GraphQL query cost points consumed'))
+THROTTLED_SECONDS = REGISTRY.register(Counter(
+    'insize_shopify_throttled_seconds_total',
+    'Wall-clock time requests were held back by a Shopify rate limit, counted once across concurrent waiters',
+    ['limit']))
+SYNC_RUNS = REGISTRY.register(Counter(
+    'insize_sync_runs_total', 'Finished sync runs by type and status', ['sync_type', 'status']))
+LAST_RUN = REGISTRY.register(Gauge(
+    'insize_last_sync_timestamp_seconds', 'Unix time of the last finished sync run', ['sync_type', 'status']))
+
+def record_graphql_cost(data: Dict[str, Any]):
+    """Add the cost reported in a Shopify GraphQL response"""
+    cost = (data.get('extensions') or {}).get('cost', {}).get('actualQueryCost')
+    if cost:
+        GRAPHQL_COST.inc(cost)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+def start_http_server(port: int, addr: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread"""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{addr}:{server.server_port}/metrics")
+    return server
+
+def write_textfile(path: str):
+    """Atomically write the metrics for node-exporter's textfile collector"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(REGISTRY.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+def export(textfile: Optional[str] = None):
+    """Write the textfile if one is configured; called at the end of every run"""
+    textfile = config.METRICS_TEXTFILE if textfile is None else textfile
+    if not textfile:
+        return
+    try:
+        write_textfile(textfile)
+    except Exception as e:
+        logger.warning(f"Failed to write metrics textfile {textfile}: {str(e)}")
@@ -0,0 +1,92 @@
+from typing import Any, Dict, Tuple
+
+# Product fields, in the order the parser builds them
+PRODUCT_FIELDS = (
+    'sku', 'title', 'description', 'description2', 'availability', 'price',
+    'original_price', 'discount', 'range', 'reading', 'family', 'weight',
+    'dimensions', 'image_url', 'product_url', 'category', 'subcategory',
+)
+
+NUMERIC_FIELDS = ('price', 'original_price', 'discount')
+
+def _is_missing(value: Any) -> bool:
+    """None or a NaN coming from pandas"""
+    return value is None or (isinstance(value, float) and value != value)
+
+class Product:
+    """A single INSIZE product as it flows through parser, database and Shopify.
+
+    Slotted to keep large catalogs compact; convert with from_dict/to_dict
+    only where products enter or leave the pipeline.
+    """
+    __slots__ = PRODUCT_FIELDS
+
+    def __init__(self, sku: str, title: str = '', description: str = '', description2: str = '',
+                 availability: str = '0', price: float = 0.0, original_price: float = 0.0,
+                 discount: float = 0.0, range: str = '', reading: str = '', family: str = '',
+                 weight: str = '', dimensions: str = '', image_url: str = '', product_url: str = '',
+                 category: str = '', subcategory: str = ''):
+        self.sku = sku
+        self.title = title
+        self.description = description
+        self.description2 = description2
+        self.availability = availability
+        self.price = price
+        self.original_price = original_price
+        self.discount = discount
+        self.range = range
+        self.reading = reading
+        self.family = family
+        self.weight = weight
+        self.dimensions = dimensions
+        self.image_url = image_url
+        self.product_url = product_url
+        self.category = category
+        self.subcategory = subcategory
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Product':
+        """Build a product from a dictionary with product field keys"""
+        return cls(**{field: data[field] for field in PRODUCT_FIELDS if field in data})
+
+    @classmethod
+    def from_db_row(cls, row: Dict[str, Any]) -> 'Product':
+        """Build a product from a products table row, filling NULLs with defaults"""
+        values = {}
+        for field in PRODUCT_FIELDS:
+            value = row.get(field)
+            if field in NUMERIC_FIELDS:
+                values[field] = 0.0 if _is_missing(value) else float(value)
+            elif field == 'availability':
+                values[field] = '0' if _is_missing(value) else str(value)
+            else:
+                values[field] = '' if _is_missing(value) else str(value)
+        return cls(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in PRODUCT_FIELDS}
+
+    def astuple(self) -> Tuple:
+        return tuple(getattr(self, field) for field in PRODUCT_FIELDS)
+
+    @property
+    def in_stock(self) -> bool:
+        """Availability is either a quantity or the text 'in stock'"""
+        return self.availability.lower() == 'in stock' or self.stock_quantity > 0
+
+    @property
+    def stock_quantity(self) -> int:
+        """Availability as an inventory quantity, 0 when it is not a number"""
+        try:
+            return max(int(float(self.availability)), 0)
+        except (TypeError, ValueError, OverflowError):
+            return 0
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Product):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in PRODUCT_FIELDS)
+        return f"Product({fields})"
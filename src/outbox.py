@@ -0,0 +1,62 @@
+from typing import Callable, Dict, List, Optional
+from loguru import logger
+from . import config, metrics
+from .database import Database
+from .models import Product
+
+def _report_dead_letters(skus: List[str]):
+    if skus:
+        logger.error(f"Giving up on {len(skus)} outbox entries after {config.OUTBOX_MAX_ATTEMPTS} attempts: {', '.join(skus)}")
+        metrics.PUSHED_ROWS.inc(len(skus), outcome='dead_letter')
+
+def drain_outbox(db: Database, push: Callable[[Product], Optional[str]], batch_size: int = 50,
+                 push_many: Optional[Callable[[List[Product]], Dict[str, Optional[str]]]] = None) -> Dict[str, int]:
+    """Push every pending outbox entry, claiming `batch_size` at a time.
+
+    `push` creates or updates one product in Shopify and returns an outcome
+    such as 'added' or 'updated', or None when it failed. `push_many`, when
+    given, pushes each claimed batch at once instead and returns the outcomes
+    by SKU. Entries are only completed after their push succeeded, so a crash
+    leaves the rest of the queue for the next run. Returns the number of
+    products per outcome.
+    """
+    counts: Dict[str, int] = {}
+    _report_dead_letters(db.dead_letter_outbox())
+    while True:
+        claimed = db.claim_outbox(batch_size)
+        if not claimed:
+            break
+        logger.info(f"Claimed {len(claimed)} products from the outbox")
+
+        done = []
+        batch_counts: Dict[str, int] = {}
+        products = db.get_products_by_sku(list(claimed))
+        if push_many:
+            outcomes = push_many(products) if products else {}
+        else:
+            outcomes = {product.sku: push(product) for product in products}
+        for product in products:
+            outcome = outcomes.get(product.sku)
+            if outcome:
+                done.extend(claimed.pop(product.sku))
+            else:
+                _report_dead_letters(db.fail_outbox(claimed.pop(product.sku), f"Push failed for SKU {product.sku}"))
+                outcome = 'failed'
+            counts[outcome] = counts.get(outcome, 0) + 1
+            batch_counts[outcome] = batch_counts.get(outcome, 0) + 1
+
+        # Left over: deleted or incomplete products, nothing to push
+        if claimed:
+            for entry_ids in claimed.values():
+                done.extend(entry_ids)
+            counts['skipped'] = counts.get('skipped', 0) + len(claimed)
+            batch_counts['skipped'] = len(claimed)
+        db.complete_outbox(done)
+        for outcome, count in batch_counts.items():
+            metrics.PUSHED_ROWS.inc(count, outcome=outcome)
+
+    purged = db.purge_outbox()
+    if purged:
+        logger.info(f"Purged {purged} old outbox entries")
+    logger.info(f"Outbox drained: {counts}")
+    return counts
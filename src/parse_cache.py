@@ -0,0 +1,146 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from loguru import logger
+from . import config
+from .models import NUMERIC_FIELDS, PRODUCT_FIELDS, Product
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # pyarrow is optional; without it the cache is disabled
+    pa = None
+
+# Bump when the product transform changes so stale cached feeds are ignored
+CACHE_VERSION = 2
+
+class ParseCache:
+    """Columnar (Arrow IPC) copies of parsed feeds, keyed by the workbook's SHA-256.
+
+    Cached tables are memory-mapped on read. The directory is kept under
+    max_bytes by evicting the least recently used files.
+    """
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = config.PARSE_CACHE_DIR if cache_dir is None else cache_dir
+        self.max_bytes = config.PARSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return pa is not None and bool(self.cache_dir)
+
+    @property
+    def schema(self):
+        return pa.schema([
+            (field, pa.float64() if field in NUMERIC_FIELDS else pa.string())
+            for field in PRODUCT_FIELDS
+        ])
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """SHA-256 of a workbook, read in chunks"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _path(self, content_sha256: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_sha256}-v{CACHE_VERSION}.arrow")
+
+    def load_table(self, content_sha256: str):
+        """Memory-map the cached table for a workbook, or None on a miss"""
+        path = self._path(content_sha256)
+        if not os.path.exists(path):
+            return None
+        try:
+            with pa.memory_map(path) as source:
+                table = pyarrow.ipc.open_file(source).read_all()
+            # Mark as recently used for eviction
+            os.utime(path)
+            return table
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable parse cache file {path}: {str(e)}")
+            return None
+
+    @staticmethod
+    def _to_products(table) -> List[Product]:
+        columns = [table.column(field).to_pylist() for field in PRODUCT_FIELDS]
+        return [Product(*row) for row in zip(*columns)]
+
+    def load(self, content_sha256: str) -> Optional[List[Product]]:
+        """Cached products for a workbook, or None on a miss"""
+        table = self.load_table(content_sha256)
+        return self._to_products(table) if table is not None else None
+
+    def iter_batches(self, content_sha256: str, batch_size: int) -> Optional[Iterator[List[Product]]]:
+        """Cached products in batches, without materializing the whole table"""
+        table = self.load_table(content_sha256)
+        if table is None:
+            return None
+        return (self._to_products(batch) for batch in table.to_batches(max_chunksize=batch_size))
+
+    def skipped_rows(self, content_sha256: str) -> Dict[str, int]:
+        """Rows the parser dropped from a cached workbook, by rule"""
+        path = self._path(content_sha256)
+        try:
+            with pa.memory_map(path) as source:
+                reader = pyarrow.ipc.open_file(source)
+                if not reader.num_record_batches:
+                    return {}
+                # Counts are cumulative, so the last batch holds the totals
+                _, metadata = reader.get_batch_with_custom_metadata(reader.num_record_batches - 1)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable parse cache file {path}: {str(e)}")
+            return {}
+        return {key.decode(): int(value) for key, value in (metadata or {}).items()}
+
+    def store(self, content_sha256: str, products: List[Product], skipped: Optional[Dict[str, int]] = None):
+        """Cache the products parsed from a workbook"""
+        with self.writer(content_sha256) as write:
+            write(products, skipped)
+
+    @contextmanager
+    def writer(self, content_sha256: str):
+        """Write products in batches; the file only becomes visible if the block completes.
+
+        write() takes the rows skipped so far by rule, kept as batch metadata.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        schema = self.schema
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink, pyarrow.ipc.new_file(sink, schema) as ipc_writer:
+                def write(products: List[Product], skipped: Optional[Dict[str, int]] = None):
+                    if products or skipped:
+                        columns = [[getattr(p, field) for p in products] for field in PRODUCT_FIELDS]
+                        metadata = {rule: str(count) for rule, count in skipped.items()} if skipped else None
+                        ipc_writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema),
+                                               custom_metadata=metadata)
+                yield write
+            os.replace(tmp_path, self._path(content_sha256))
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used cache files until the directory fits max_bytes"""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.arrow'):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            # Oldest first; never evict the most recently used file
+            for _, size, name in sorted(entries)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                os.unlink(os.path.join(self.cache_dir, name))
+                total -= size
+                logger.info(f"Evicted parse cache file {name}")
+        except Exception as e:
+            logger.warning(f"Parse cache eviction failed: {str(e)}")
@@ -1,35 +1,411 @@
+import importlib.util
+import numpy as np
+import openpyxl
 import pandas as pd
 from loguru import logger
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from . import config
+from .models import PRODUCT_FIELDS, Product
+from .parse_cache import ParseCache
+from .validation import ValidationReport
+
+# Excel column -> product field, in the order the product dictionaries are built
+COLUMN_MAP = {
+    'Unnamed: 1': 'sku',
+    'Unnamed: 2': 'description',
+    'Unnamed: 3': 'description2',
+    'Unnamed: 4': 'availability',
+    'Unnamed: 5': 'range',
+    'Unnamed: 6': 'reading',
+    'Unnamed: 7': 'family',
+    'Unnamed: 8': 'weight',
+    'Unnamed: 9': 'dimensions',
+    'Unnamed: 10': 'image_url',
+    'Unnamed: 11': 'product_url',
+    'Unnamed: 12': 'category',
+    'Unnamed: 13': 'subcategory',
+    'Unnamed: 16': 'price',
+    'Unnamed: 17': 'discount',
+}
+
+# Strings pandas.read_excel turns into NaN by default
+NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+# Rows transformed together when streaming the sheet
+STREAM_BATCH_ROWS = 2000
+
+# Rules for rows dropped before products are built; their counts are kept in the parse cache
+SKIPPED_ROW_RULES = ('empty_sku', 'header_row')
+
+def _convert_cell(value: Any) -> Any:
+    """Normalize an openpyxl cell value the way pandas.read_excel does"""
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in NA_STRINGS:
+        return np.nan
+    return value
+
+def _to_float(value: Any) -> Optional[float]:
+    """float(value), or None when the cell cannot be converted"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+# Workbook reader engines, fastest first
+ENGINES = ['calamine', 'openpyxl-readonly', 'openpyxl']
+
+def available_engines() -> List[str]:
+    """Reader engines usable in this environment, fastest first"""
+    engines = []
+    # pandas gained the calamine engine in 2.2; python-calamine is an optional extra
+    if (importlib.util.find_spec('python_calamine') is not None
+            and importlib.util.find_spec('pandas.io.excel._calamine') is not None):
+        engines.append('calamine')
+    engines.extend(['openpyxl-readonly', 'openpyxl'])
+    return engines
 
 class ExcelParser:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, engine: Optional[str] = None, content_sha256: Optional[str] = None,
+                 cache: Optional[ParseCache] = None):
         self.file_path = file_path
+        self.engine = self._select_engine(engine or config.EXCEL_ENGINE)
+        # Known hash of the workbook (e.g. from the downloader) saves re-hashing it for the cache
+        self.content_sha256 = content_sha256
+        self.cache = cache or ParseCache()
+        self.report = ValidationReport()
+        
+    @staticmethod
+    def _select_engine(engine: str) -> str:
+        """Resolve 'auto' to the fastest installed engine"""
+        if engine == 'auto':
+            return available_engines()[0]
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown Excel engine: {engine} (expected one of {ENGINES} or 'auto')")
+        if engine not in available_engines():
+            raise ValueError(f"Excel engine {engine} is not installed")
+        return engine
+        
+    def read_frame(self) -> pd.DataFrame:
+        """Read the first sheet into the normalized frame all engines agree on.
+        
+        Blank rows and trailing blank columns are dropped, every column has
+        object dtype, and the first row becomes the header with blank cells
+        named 'Unnamed: N' like pandas.read_excel does.
+        """
+        if self.engine == 'openpyxl-readonly':
+            raw = self._read_openpyxl_readonly()
+        else:
+            raw = pd.read_excel(self.file_path, engine=self.engine, header=None, dtype=object)
+        return self._normalize_frame(raw)
         
-    def parse(self) -> List[Dict]:
-        """Parse the Excel file and return a list of product dictionaries"""
+    def _read_openpyxl_readonly(self) -> pd.DataFrame:
+        """Build the raw frame straight from openpyxl's read-only row iterator"""
+        workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
         try:
-            logger.info(f"Reading Excel file: {self.file_path}")
-            df = pd.read_excel(self.file_path)
+            rows = list(self._iter_sheet_rows(workbook.worksheets[0]))
+        finally:
+            workbook.close()
+        # Rows are ragged when the sheet has no stored dimensions; pad them with NaN, not None
+        width = max((len(row) for row in rows), default=0)
+        return pd.DataFrame([row + (np.nan,) * (width - len(row)) for row in rows], dtype=object)
             
-            # Skip the first row as it contains column headers
-            products = []
-            for index, row in df.iloc[1:].iterrows():
-                try:
-                    product = self._transform_row(row)
-                    if product and self._validate_product(product):
-                        products.append(product)
-                except Exception as e:
-                    logger.error(f"Failed to transform row: {str(e)}")
-                    continue
+    @staticmethod
+    def _normalize_frame(raw: pd.DataFrame) -> pd.DataFrame:
+        """Apply the header row and drop blank rows and trailing blank columns"""
+        raw = raw.astype(object).dropna(how='all')
+        width = raw.shape[1]
+        while width and raw.iloc[:, width - 1].isna().all():
+            width -= 1
+        raw = raw.iloc[:, :width]
+        if raw.empty:
+            return pd.DataFrame()
+            
+        header = raw.iloc[0].tolist()
+        frame = raw.iloc[1:].reset_index(drop=True)
+        frame.columns = [
+            f"Unnamed: {index}" if pd.isna(value) else str(value)
+            for index, value in enumerate(header)
+        ]
+        return frame
+        
+    def _cache_key(self) -> Optional[str]:
+        """Workbook hash used as the parse cache key, or None when caching is off"""
+        if not self.cache.enabled:
+            return None
+        if not self.content_sha256:
+            self.content_sha256 = ParseCache.file_hash(self.file_path)
+        return self.content_sha256
+        
+    def parse(self) -> List[Product]:
+        """Parse the Excel file and return a list of products"""
+        self.report = ValidationReport()
+        try:
+            cache_key = self._cache_key()
+            if cache_key:
+                products = self.cache.load(cache_key)
+                if products is not None:
+                    logger.info(f"Loaded {len(products)} products from parse cache for {self.file_path}")
+                    self._restore_skipped_rows(cache_key)
+                    self._validate_cached(products)
+                    self.report.log_summary()
+                    return products
                     
+            logger.info(f"Reading Excel file: {self.file_path} (engine: {self.engine})")
+            df = self.read_frame()
+            
+            products = self._parse_frame(df)
             logger.info(f"Successfully parsed {len(products)} products")
+            self.report.log_summary()
+            
+            if cache_key and products:
+                try:
+                    self.cache.store(cache_key, products, self._skipped_rows())
+                except Exception as e:
+                    logger.warning(f"Failed to cache parsed products: {str(e)}")
             return products
             
         except Exception as e:
             logger.error(f"Failed to parse Excel file: {str(e)}")
             return []
             
+    def iter_products(self, chunk_size: Optional[int] = None) -> Iterator[Union[Product, List[Product]]]:
+        """Stream validated products from the workbook in constant memory.
+        
+        Rows are read with openpyxl in read-only mode and transformed in small
+        batches, so the sheet is never held in memory as a whole. A cached copy
+        of the same workbook is streamed from its memory-mapped table instead.
+        Yields one product at a time, or lists of chunk_size products.
+        """
+        self.report = ValidationReport()
+        cache_key = self._cache_key()
+        cached = self.cache.iter_batches(cache_key, STREAM_BATCH_ROWS) if cache_key else None
+        if cached is not None:
+            logger.info(f"Streaming cached products for {self.file_path}")
+            self._restore_skipped_rows(cache_key)
+            batches = cached
+        else:
+            batches = self._stream_workbook(cache_key)
+            
+        pending = []
+        for products in batches:
+            if cached is not None:
+                self._validate_cached(products)
+            if not chunk_size:
+                yield from products
+                continue
+            pending.extend(products)
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+        if chunk_size and pending:
+            yield pending
+        self.report.log_summary()
+            
+    def _stream_workbook(self, cache_key: Optional[str]) -> Iterator[List[Product]]:
+        """Transformed product batches read from the workbook, cached as they go"""
+        logger.info(f"Streaming Excel file: {self.file_path}")
+        workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            rows = self._iter_sheet_rows(workbook.worksheets[0])
+            header = next(rows, None)
+            positions = self._column_positions(header or ())
+            missing = [column for column, position in positions.items() if position is None]
+            if missing:
+                logger.error(f"Excel file is missing columns: {missing}")
+                return
+                
+            # Skip the first row as it contains column headers
+            next(rows, None)
+            
+            batches = (self._transform_frame(batch) for batch in self._iter_row_batches(rows, positions))
+            count = 0
+            if cache_key:
+                # The cache file is only kept if the whole sheet is streamed
+                with self.cache.writer(cache_key) as write:
+                    for products in batches:
+                        write(products, self._skipped_rows())
+                        count += len(products)
+                        yield products
+            else:
+                for products in batches:
+                    count += len(products)
+                    yield products
+                    
+            logger.info(f"Successfully streamed {count} products")
+        finally:
+            workbook.close()
+            
+    @staticmethod
+    def _iter_sheet_rows(sheet) -> Iterator[Tuple]:
+        """Non-empty sheet rows with cells normalized like pandas.read_excel"""
+        for row in sheet.iter_rows(values_only=True):
+            values = tuple(_convert_cell(value) for value in row)
+            if any(not (isinstance(value, float) and np.isnan(value)) for value in values):
+                yield values
+                
+    @staticmethod
+    def _column_positions(header: Tuple) -> Dict[str, Optional[int]]:
+        """Position of every COLUMN_MAP column, named the way pandas names header cells"""
+        names = {}
+        for index, value in enumerate(header):
+            if isinstance(value, float) and np.isnan(value):
+                names.setdefault(f"Unnamed: {index}", index)
+            else:
+                names.setdefault(str(value), index)
+        positions = {}
+        for column in COLUMN_MAP:
+            position = names.get(column)
+            if position is None and column.startswith('Unnamed: '):
+                # Columns past the end of the header row are unnamed as well
+                index = int(column.split(': ')[1])
+                position = index if index >= len(header) else None
+            positions[column] = position
+        return positions
+        
+    @staticmethod
+    def _iter_row_batches(rows: Iterable[Tuple], positions: Dict[str, int]) -> Iterator[pd.DataFrame]:
+        """Group rows into small object frames holding only the mapped columns"""
+        columns = list(positions)
+        indexes = [positions[column] for column in columns]
+        batch = []
+        for row in rows:
+            batch.append([row[i] if i < len(row) else np.nan for i in indexes])
+            if len(batch) >= STREAM_BATCH_ROWS:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+            
+    def _parse_frame(self, df: pd.DataFrame) -> List[Product]:
+        """Transform and validate the whole sheet with column-wise operations.
+        
+        Produces exactly the same products as _parse_rows.
+        """
+        # Skip the first row as it contains column headers
+        return self._transform_frame(df.iloc[1:])
+        
+    def _transform_frame(self, df: pd.DataFrame) -> List[Product]:
+        """Transform a frame of data rows into validated products"""
+        missing = [column for column in COLUMN_MAP if column not in df.columns]
+        if missing:
+            logger.error(f"Excel file is missing columns: {missing}")
+            return []
+            
+        frame = df[list(COLUMN_MAP)].rename(columns=COLUMN_MAP)
+        
+        sku = self._text_column(frame['sku'], None)
+        availability = self._text_column(frame['availability'], '0')
+        
+        # Skip header rows and empty SKUs
+        empty_sku = sku.isna() | (sku == '')
+        header_row = ~empty_sku & ((sku == 'No') | (availability == 'Availability'))
+        keep = ~empty_sku & ~header_row
+        self.report.rows_checked += len(frame)
+        self.report.add('empty_sku', empty_sku.sum())
+        self.report.add('header_row', header_row.sum())
+        frame = frame[keep]
+        sku = sku[keep]
+        availability = availability[keep]
+        
+        description = self._text_column(frame['description'], '')
+        description2 = self._text_column(frame['description2'], '')
+        
+        # Combine descriptions for title
+        title = description.where(description2 == '', description + ' - ' + description2)
+        
+        # Apply discount if available
+        original_price, invalid_price = self._float_column(frame['price'])
+        discount, invalid_discount = self._float_column(frame['discount'])
+        price = original_price.where(~(discount > 0), original_price * (1 - discount / 100))
+        
+        columns = {
+            'sku': sku,
+            'title': title,
+            'description': description,
+            'description2': description2,
+            'availability': availability,
+            'price': price,
+            'original_price': original_price,
+            'discount': discount,
+        }
+        for field in PRODUCT_FIELDS:
+            if field not in columns:
+                columns[field] = self._text_column(frame[field], '')
+                
+        for rule, failed in (('unparseable_price', invalid_price),
+                             ('unparseable_discount', invalid_discount),
+                             ('missing_title', title == ''),
+                             ('missing_price', price == 0)):
+            self.report.add(rule, failed.sum(), sku[failed].head(self.report.sample_size))
+        
+        values = [columns[field].tolist() for field in PRODUCT_FIELDS]
+        return [Product(*row) for row in zip(*values)]
+        
+    @staticmethod
+    def _text_column(column: pd.Series, default: Optional[str]) -> pd.Series:
+        """str(value).strip() for every present cell, default for empty ones"""
+        present = column.notna()
+        text = pd.Series(default, index=column.index, dtype=object)
+        if present.any():
+            text[present] = column[present].astype(object).map(str).str.strip()
+        return text
+        
+    @staticmethod
+    def _float_column(column: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """float(value) for every present cell, 0.0 for empty or unparseable ones.
+        
+        Also returns the mask of cells float() could not convert.
+        """
+        present = column.notna()
+        numbers = pd.to_numeric(column, errors='coerce').astype('float64')
+        invalid = pd.Series(False, index=column.index)
+        # Rare cells that only Python's float() understands (e.g. 'nan', '1_000')
+        fallback = present & numbers.isna()
+        if fallback.any():
+            converted = column[fallback].map(_to_float)
+            failed = np.array([value is None for value in converted], dtype=bool)
+            invalid[fallback] = failed
+            numbers[fallback] = converted.where(~failed, 0.0).astype('float64')
+        numbers[~present] = 0.0
+        return numbers, invalid
+        
+    def _skipped_rows(self) -> Dict[str, int]:
+        """Rows dropped so far by the transform, stored alongside the cached products"""
+        return {rule: self.report.counts.get(rule, 0) for rule in SKIPPED_ROW_RULES}
+        
+    def _restore_skipped_rows(self, cache_key: str):
+        """Count the dropped rows of a cached workbook as a fresh parse would"""
+        for rule, count in self.cache.skipped_rows(cache_key).items():
+            self.report.rows_checked += count
+            self.report.add(rule, count)
+            
+    def _validate_cached(self, products: List[Product]):
+        """Re-check the optional fields of products loaded from the parse cache"""
+        self.report.rows_checked += len(products)
+        for rule, failed in (('missing_title', [p.sku for p in products if not p.title]),
+                             ('missing_price', [p.sku for p in products if not p.price])):
+            self.report.add(rule, len(failed), failed)
+            
+    def _parse_rows(self, df: pd.DataFrame) -> List[Product]:
+        """Row-by-row reference implementation of _parse_frame"""
+        # Skip the first row as it contains column headers
+        products = []
+        for index, row in df.iloc[1:].iterrows():
+            try:
+                product = self._transform_row(row)
+                if product and self._validate_product(product):
+                    products.append(Product.from_dict(product))
+            except Exception as e:
+                logger.error(f"Failed to transform row: {str(e)}")
+                continue
+        return products
+            
     def _transform_row(self, row: pd.Series) -> Optional[Dict]:
         """Transform a row into a product dictionary"""
         try:
@@ -0,0 +1,124 @@
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from . import config
+
+def _function_name(func) -> str:
+    filename, line, name = func
+    # Built-ins have no source location
+    return name if filename == '~' else f"{name} ({os.path.basename(filename)}:{line})"
+
+class Profiler:
+    """cProfile and tracemalloc capture per pipeline stage.
+
+    Each stage writes <entry>-<timestamp>-<stage>.prof (pstats, e.g. for
+    snakeviz) and a matching .txt with the hottest functions and the top
+    allocations into output_dir.
+    """
+    def __init__(self, name: str, output_dir: Optional[str] = None, top: Optional[int] = None):
+        self.name = name
+        self.output_dir = config.PROFILE_DIR if output_dir is None else output_dir
+        self.top = config.PROFILE_TOP if top is None else top
+        self.results: List[Dict[str, Any]] = []
+        self._active_stage: Optional[str] = None
+
+    @contextmanager
+    def stage(self, stage: str):
+        # cProfile can't nest; inner stages are covered by the outer one
+        if self._active_stage is not None:
+            yield
+            return
+        self._active_stage = stage
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self._active_stage = None
+            try:
+                self._write(stage, profile, seconds, peak, before, after)
+            except Exception as e:
+                logger.warning(f"Failed to write profile for stage {stage}: {str(e)}")
+
+    def _write(self, stage: str, profile: cProfile.Profile, seconds: float, peak: int,
+               before: tracemalloc.Snapshot, after: tracemalloc.Snapshot):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}-{stage}")
+        profile.dump_stats(f"{prefix}.prof")
+
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+        allocations = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')[:self.top]
+        text.write(f"\nTop {self.top} allocations (net, by line); peak traced memory {peak / 1024 / 1024:.1f} MiB\n")
+        for allocation in allocations:
+            text.write(f"{allocation}\n")
+        with open(f"{prefix}.txt", 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+
+        # Hottest functions by own time, for the end of run summary
+        hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:3]
+        self.results.append({
+            'stage': stage,
+            'seconds': seconds,
+            'peak_mib': peak / 1024 / 1024,
+            'hot': [(_function_name(func), data[2]) for func, data in hot],
+            'path': f"{prefix}.prof"
+        })
+
+    def report(self):
+        """Log a short summary of the stages profiled since the last report"""
+        for result in self.results:
+            hot = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in result['hot'])
+            logger.info(
+                f"Profile {result['stage']}: {result['seconds']:.2f}s, peak {result['peak_mib']:.1f} MiB; "
+                f"hottest: {hot} -> {result['path']}"
+            )
+        self.results = []
+
+_profiler: Optional[Profiler] = None
+
+def enable(name: str, output_dir: Optional[str] = None) -> Profiler:
+    """Profile every stage from now on; `name` prefixes the output files"""
+    global _profiler
+    _profiler = Profiler(name, output_dir)
+    logger.info(f"Profiling enabled, writing to {_profiler.output_dir}/")
+    return _profiler
+
+def disable():
+    global _profiler
+    _profiler = None
+
+def stage(name: str):
+    """Profile a pipeline stage when profiling is enabled; a no-op otherwise"""
+    return _profiler.stage(name) if _profiler is not None else nullcontext()
+
+def report():
+    if _profiler is not None:
+        _profiler.report()
+
+def add_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--profile', action='store_true',
+                        help=f"write cProfile and tracemalloc output per stage to {config.PROFILE_DIR}/")
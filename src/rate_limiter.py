@@ -0,0 +1,197 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+import requests
+import shopify
+from loguru import logger
+from pyactiveresource.connection import ClientError
+from . import config, metrics
+
+T = TypeVar('T')
+
+# Assumed cost of a GraphQL call until its response reports the actual one
+DEFAULT_QUERY_COST = 10
+
+class RateLimiter:
+    """Local leaky bucket model of one Shopify rate limit.
+
+    Calls drain `available` by their cost; it refills at restore_rate per
+    second up to capacity. Every response reports the store's real state,
+    which replaces the estimate through update(). reserve() books a call and
+    returns how long to wait before making it, so threads and coroutines can
+    share one bucket; acquire() books and waits. A booking stays in flight
+    until release() once its response arrived: the store's state doesn't
+    include it yet, so update() keeps it deducted. Waits are counted in
+    THROTTLED_SECONDS once per limiter, however many callers wait at a time.
+    """
+    def __init__(self, name: str, capacity: float, restore_rate: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.capacity = capacity
+        self.restore_rate = restore_rate
+        self.available = capacity
+        # Cost booked by calls that have not been answered yet
+        self.in_flight = 0.0
+        self._clock = clock
+        self._updated = clock()
+        # End of the latest wait counted in THROTTLED_SECONDS
+        self._throttled_until = self._updated
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.restore_rate)
+        self._updated = now
+
+    def _record_wait(self, now: float, delay: float):
+        """Count the part of a wait not already covered by another caller's (lock held)"""
+        until = now + delay
+        if until > self._throttled_until:
+            metrics.THROTTLED_SECONDS.inc(until - max(now, self._throttled_until), limit=self.name)
+            self._throttled_until = until
+
+    def reserve(self, cost: float = 1) -> float:
+        """Book `cost` from the bucket; returns the seconds to wait before the call"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            # A call costlier than the whole bucket still runs once the bucket is full
+            cost = min(cost, self.capacity)
+            self.available -= cost
+            self.in_flight += cost
+            delay = max(0.0, -self.available / self.restore_rate)
+            self._record_wait(now, delay)
+        return delay
+
+    def throttled(self, seconds: float):
+        """Record a wait imposed by the store, e.g. the Retry-After of an HTTP 429"""
+        with self._lock:
+            self._record_wait(self._clock(), seconds)
+
+    def acquire(self, cost: float = 1) -> float:
+        delay = self.reserve(cost)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def release(self, cost: float = 1):
+        """The call booked with `cost` was answered, or never made"""
+        with self._lock:
+            self.in_flight = max(0.0, self.in_flight - min(cost, self.capacity))
+
+    def update(self, available: float, capacity: Optional[float] = None, restore_rate: Optional[float] = None):
+        """Replace the model with the state reported by Shopify, less the calls still in flight"""
+        with self._lock:
+            if capacity:
+                self.capacity = capacity
+            if restore_rate:
+                self.restore_rate = restore_rate
+            self.available = min(available, self.capacity) - self.in_flight
+            self._updated = self._clock()
+
+graphql_bucket = RateLimiter('graphql', config.SHOPIFY_GRAPHQL_BUCKET, config.SHOPIFY_GRAPHQL_RESTORE_RATE)
+rest_bucket = RateLimiter('rest', config.SHOPIFY_REST_BUCKET, config.SHOPIFY_REST_RESTORE_RATE)
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def retry_after(headers: Mapping[str, str]) -> float:
+    try:
+        return float(_header(headers, 'Retry-After') or 2)
+    except ValueError:
+        return 2.0
+
+def _sleep(bucket: RateLimiter, seconds: float):
+    bucket.throttled(seconds)
+    time.sleep(seconds)
+
+def record_graphql_response(body: Dict[str, Any], bucket: RateLimiter = graphql_bucket):
+    """Sync the bucket with extensions.cost.throttleStatus of a GraphQL response"""
+    status = ((body.get('extensions') or {}).get('cost') or {}).get('throttleStatus')
+    if status:
+        bucket.update(status['currentlyAvailable'], status.get('maximumAvailable'), status.get('restoreRate'))
+
+def record_rest_headers(headers: Mapping[str, str], bucket: RateLimiter = rest_bucket):
+    """Sync the bucket with the X-Shopify-Shop-Api-Call-Limit header, e.g. '32/40'"""
+    limit = _header(headers, 'X-Shopify-Shop-Api-Call-Limit')
+    if not limit:
+        return
+    used, capacity = (float(value) for value in limit.split('/'))
+    bucket.update(capacity - used, capacity)
+
+def is_throttled(body: Dict[str, Any]) -> bool:
+    return any((error.get('extensions') or {}).get('code') == 'THROTTLED' for error in body.get('errors') or [])
+
+def graphql_post(session: Any, url: str, headers: Dict[str, str], query: str,
+                 variables: Optional[Dict[str, Any]] = None, cost: float = DEFAULT_QUERY_COST,
+                 timeout: Any = None, bucket: RateLimiter = graphql_bucket) -> requests.Response:
+    """POST a GraphQL request once the bucket allows it.
+
+    THROTTLED responses and HTTP 429 are retried up to SHOPIFY_MAX_RETRIES
+    times; the last response is returned either way, for the caller's checks.
+    `session` is a requests.Session or the requests module.
+    """
+    for attempt in range(config.SHOPIFY_MAX_RETRIES + 1):
+        bucket.acquire(cost)
+        try:
+            response = session.post(url, json={'query': query, 'variables': variables or {}},
+                                    headers=headers, timeout=timeout)
+        finally:
+            bucket.release(cost)
+        last_attempt = attempt == config.SHOPIFY_MAX_RETRIES
+        if response.status_code == 429 and not last_attempt:
+            logger.warning(f"GraphQL request rate limited, retrying ({attempt + 1}/{config.SHOPIFY_MAX_RETRIES})")
+            bucket.update(0)
+            _sleep(bucket, retry_after(response.headers))
+            continue
+        if response.status_code != 200:
+            return response
+
+        body = response.json()
+        metrics.record_graphql_cost(body)
+        record_graphql_response(body, bucket)
+        if not is_throttled(body) or last_attempt:
+            return response
+        # Wait until the bucket holds what the query asked for
+        cost = ((body.get('extensions') or {}).get('cost') or {}).get('requestedQueryCost') or cost
+        logger.warning(f"GraphQL request throttled, retrying ({attempt + 1}/{config.SHOPIFY_MAX_RETRIES})")
+    return response
+
+def rest_call(call: Callable[[], T], bucket: RateLimiter = rest_bucket) -> T:
+    """Run a ShopifyAPI REST call once the bucket allows it, retrying HTTP 429"""
+    for attempt in range(config.SHOPIFY_MAX_RETRIES + 1):
+        bucket.acquire()
+        rate_limited = None
+        try:
+            result = call()
+        except ClientError as e:
+            if e.code != 429 or attempt == config.SHOPIFY_MAX_RETRIES:
+                raise
+            rate_limited = e
+        finally:
+            bucket.release()
+        if rate_limited:
+            logger.warning(f"REST request rate limited, retrying ({attempt + 1}/{config.SHOPIFY_MAX_RETRIES})")
+            bucket.update(0)
+            _sleep(bucket, retry_after(rate_limited.response.headers or {}))
+            continue
+        response = shopify.ShopifyResource.connection.response
+        if response is not None:
+            record_rest_headers(response.headers or {}, bucket)
+        return result
+
+class ApiCallCounter:
+    """Counts the Shopify API requests of a client in api_calls, for run statistics"""
+    api_calls = 0
+
+    def _api_call(self, operation: str, count: int = 1):
+        """Count Shopify API requests about to be made"""
+        self.api_calls += count
+        metrics.SHOPIFY_CALLS.inc(count, operation=operation)
+
+    def _rest(self, operation: str, call: Callable[[], T]) -> T:
+        """Make a REST request once the rate limit allows it"""
+        self._api_call(operation)
+        return rest_call(call)
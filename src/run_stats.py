@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from . import metrics, profiling
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size since the last reset_peak_rss(), in MiB; None off Linux"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """Restart the kernel's peak RSS counter so the next reading covers one stage.
+    Without it (older kernels, restricted /proc) readings are peaks since startup
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+class RunStats:
+    """Duration, throughput and resource use of each stage of one sync run.
+
+    Stored in sync_logs.stage_metrics so slow runs can be traced to a stage.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.bytes_downloaded = 0
+        self.api_calls = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage; set record['rows'] inside the block to get rows per second"""
+        record: Dict[str, Any] = {'rows': None}
+        start = time.perf_counter()
+        reset_peak_rss()
+        try:
+            with profiling.stage(name):
+                yield record
+        finally:
+            seconds = time.perf_counter() - start
+            record['seconds'] = round(seconds, 3)
+            if record['rows'] is not None and seconds > 0:
+                record['rows_per_second'] = round(record['rows'] / seconds, 1)
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.stages[name] = record
+            metrics.STAGE_SECONDS.observe(seconds, stage=name)
+            if record['rows']:
+                metrics.STAGE_ROWS.inc(record['rows'], stage=name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        peaks = [stage['peak_rss_mb'] for stage in self.stages.values() if stage['peak_rss_mb'] is not None]
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 3),
+            'bytes_downloaded': self.bytes_downloaded,
+            'api_calls': self.api_calls,
+            'peak_rss_mb': max(peaks) if peaks else None,
+            'stages': self.stages
+        }
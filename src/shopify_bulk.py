@@ -0,0 +1,425 @@
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import requests
+from loguru import logger
+from . import config, metrics
+from .models import Product
+from .rate_limiter import graphql_post
+from .shopify_fields import inventory_quantity, metafields_hash, product_hash, product_input, product_update_input
+
+STAGED_UPLOADS_CREATE = """
+mutation stagedUploadsCreate($input: [StagedUploadInput!]!) {
+    stagedUploadsCreate(input: $input) {
+        stagedTargets {
+            url
+            resourceUrl
+            parameters {
+                name
+                value
+            }
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+BULK_OPERATION_RUN_MUTATION = """
+mutation bulkOperationRunMutation($mutation: String!, $stagedUploadPath: String!) {
+    bulkOperationRunMutation(mutation: $mutation, stagedUploadPath: $stagedUploadPath) {
+        bulkOperation {
+            id
+            status
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+BULK_OPERATION_RUN_QUERY = """
+mutation bulkOperationRunQuery($query: String!) {
+    bulkOperationRunQuery(query: $query) {
+        bulkOperation {
+            id
+            status
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+CURRENT_BULK_OPERATION = """
+query($type: BulkOperationType!) {
+    currentBulkOperation(type: $type) {
+        id
+        status
+        errorCode
+        objectCount
+        url
+        partialDataUrl
+    }
+}
+"""
+
+# Mutations run once per JSONL line by the bulk operation
+PRODUCT_CREATE = """
+mutation call($input: ProductInput!) {
+    productCreate(input: $input) {
+        product {
+            id
+            variants(first: 1) {
+                edges {
+                    node {
+                        id
+                        sku
+                        inventoryItem {
+                            id
+                        }
+                    }
+                }
+            }
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+PRODUCT_UPDATE = PRODUCT_CREATE.replace('productCreate', 'productUpdate')
+
+DEFAULT_LOCATION = """
+query {
+    locations(first: 1) {
+        edges {
+            node {
+                id
+            }
+        }
+    }
+}
+"""
+
+# Stock of updated products; productUpdate leaves inventory alone
+INVENTORY_SET = """
+mutation inventorySetOnHandQuantities($input: InventorySetOnHandQuantitiesInput!) {
+    inventorySetOnHandQuantities(input: $input) {
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+# Quantities per inventorySetOnHandQuantities call
+INVENTORY_BATCH_SIZE = 250
+
+# Every variant in the shop, one JSONL line each, for the ID index
+VARIANTS_EXPORT = """
+{
+    productVariants {
+        edges {
+            node {
+                id
+                sku
+                inventoryItem {
+                    id
+                }
+                product {
+                    id
+                    featuredImage {
+                        id
+                    }
+                }
+            }
+        }
+    }
+}
+"""
+
+FINISHED_STATUSES = ('COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED')
+
+class BulkImportResult:
+    """Per-SKU outcome of a bulk import: product GIDs of the successes, messages of the failures"""
+    def __init__(self):
+        self.succeeded: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
+        # shopify_id_index entries of the successes
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def __repr__(self) -> str:
+        return f"BulkImportResult(succeeded={len(self.succeeded)}, failed={len(self.failed)})"
+
+class BulkImporter:
+    """Creates and updates products through Shopify bulk mutation operations.
+
+    Products are written to JSONL files of at most max_file_bytes, uploaded
+    with stagedUploadsCreate and run with bulkOperationRunMutation:
+    productCreate for new SKUs, productUpdate for SKUs already in the shop,
+    whose stock is then set with inventorySetOnHandQuantities. Each operation is polled until it finishes and its result JSONL is mapped
+    back to SKUs by line number. export_variants() reads the shop's variants
+    the same way with bulkOperationRunQuery.
+    """
+    def __init__(self, graphql_url: str, headers: Dict[str, str], poll_interval: Optional[float] = None,
+                 timeout: Optional[float] = None, max_file_bytes: Optional[int] = None):
+        self.graphql_url = graphql_url
+        self.headers = headers
+        self.poll_interval = config.SHOPIFY_BULK_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.timeout = config.SHOPIFY_BULK_TIMEOUT if timeout is None else timeout
+        self.max_file_bytes = config.SHOPIFY_BULK_MAX_FILE_BYTES if max_file_bytes is None else max_file_bytes
+        self.http_timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+        self.session = requests.Session()
+        # Shopify API requests made by this importer, for run statistics
+        self.api_calls = 0
+
+    def _graphql(self, operation: str, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self.api_calls += 1
+        metrics.SHOPIFY_CALLS.inc(operation=operation)
+        response = graphql_post(self.session, self.graphql_url, self.headers, query, variables,
+                                timeout=self.http_timeout)
+        response.raise_for_status()
+        body = response.json()
+        if body.get('errors'):
+            raise Exception(f"GraphQL {operation} failed: {body['errors']}")
+        return body['data']
+
+    def import_products(self, chunks: Iterable[List[Product]],
+                        existing: Optional[Dict[str, Dict[str, Any]]] = None) -> BulkImportResult:
+        """Bulk create or update products, e.g. from Database.iter_products().
+
+        existing maps SKUs already in Shopify to their ID index entries, e.g.
+        Database.get_shopify_ids(); it is exported from the shop when not given.
+        """
+        result = BulkImportResult()
+        if existing is None:
+            existing = {entry['sku']: entry for entry in self.export_variants()}
+        location_id = self._default_location_id()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parts = self._write_parts(chunks, existing, location_id, tmp_dir)
+            for number, part in enumerate(parts, start=1):
+                logger.info(f"Bulk {part['kind']} {number}/{len(parts)}: {len(part['skus'])} products")
+                try:
+                    self._run_part(part, result, location_id)
+                except Exception as e:
+                    logger.error(f"Bulk {part['kind']} {number} failed: {str(e)}")
+                    for sku in part['skus']:
+                        result.failed.setdefault(sku, str(e))
+
+        logger.info(f"Bulk import finished: {len(result.succeeded)} succeeded, {len(result.failed)} failed")
+        return result
+
+    def export_variants(self) -> Iterator[Dict[str, Any]]:
+        """ID index entries (without remote_hash) for every variant with a SKU in the shop"""
+        data = self._graphql('bulk_run_query', BULK_OPERATION_RUN_QUERY, {
+            'query': VARIANTS_EXPORT
+        })['bulkOperationRunQuery']
+        if data['userErrors']:
+            raise Exception(f"bulkOperationRunQuery failed: {data['userErrors']}")
+        operation = self._wait(data['bulkOperation']['id'], 'QUERY')
+        if operation['status'] != 'COMPLETED':
+            raise Exception(f"Variant export {operation['status']} ({operation.get('errorCode')})")
+        # No url when the shop has no variants
+        if not operation.get('url'):
+            return
+
+        response = self.session.get(operation['url'], stream=True, timeout=self.http_timeout)
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            node = json.loads(line)
+            if not node.get('sku'):
+                continue
+            yield {
+                'sku': node['sku'],
+                'product_gid': node['product']['id'],
+                'variant_gid': node['id'],
+                'inventory_item_gid': (node.get('inventoryItem') or {}).get('id'),
+                'has_image': bool(node['product'].get('featuredImage'))
+            }
+
+    def _default_location_id(self) -> Optional[str]:
+        edges = self._graphql('location_find', DEFAULT_LOCATION)['locations']['edges']
+        return edges[0]['node']['id'] if edges else None
+
+    def _write_parts(self, chunks: Iterable[List[Product]], existing: Dict[str, Dict[str, Any]],
+                     location_id: Optional[str], tmp_dir: str) -> List[Dict[str, Any]]:
+        """Write one JSONL line per product, starting a new file per kind at max_file_bytes"""
+        parts: List[Dict[str, Any]] = []
+        current: Dict[str, Dict[str, Any]] = {}
+        try:
+            for chunk in chunks:
+                for product in chunk:
+                    ids = existing.get(product.sku)
+                    if ids:
+                        kind = 'update'
+                        data = product_update_input(product, ids)
+                    else:
+                        kind = 'create'
+                        data = product_input(product, location_id)
+                    has_image = bool(ids and ids.get('has_image')) or 'images' in data
+                    line = (json.dumps({'input': data}, ensure_ascii=False) + '\n').encode('utf-8')
+
+                    part = current.get(kind)
+                    if part and part['size'] + len(line) > self.max_file_bytes:
+                        part['file'].close()
+                        part = None
+                    if part is None:
+                        path = os.path.join(tmp_dir, f"{kind}-{len(parts)}.jsonl")
+                        part = {'kind': kind, 'path': path, 'file': open(path, 'wb'), 'skus': [],
+                                'hashes': [], 'metafield_hashes': [], 'images': [], 'quantities': [],
+                                'size': 0}
+                        parts.append(part)
+                        current[kind] = part
+                    part['file'].write(line)
+                    part['skus'].append(product.sku)
+                    part['hashes'].append(product_hash(product))
+                    part['metafield_hashes'].append(metafields_hash(product))
+                    part['images'].append(has_image)
+                    part['quantities'].append(inventory_quantity(product))
+                    part['size'] += len(line)
+        finally:
+            for part in current.values():
+                part['file'].close()
+        return parts
+
+    def _run_part(self, part: Dict[str, Any], result: BulkImportResult, location_id: Optional[str]):
+        staged_upload_path = self._upload(part['path'])
+        mutation = PRODUCT_CREATE if part['kind'] == 'create' else PRODUCT_UPDATE
+        data = self._graphql('bulk_run_mutation', BULK_OPERATION_RUN_MUTATION, {
+            'mutation': mutation,
+            'stagedUploadPath': staged_upload_path
+        })['bulkOperationRunMutation']
+        if data['userErrors']:
+            raise Exception(f"bulkOperationRunMutation failed: {data['userErrors']}")
+        operation = self._wait(data['bulkOperation']['id'])
+        self._collect(operation, part, result)
+        if part['kind'] == 'update':
+            self._set_inventory(part, result, location_id)
+
+    def _set_inventory(self, part: Dict[str, Any], result: BulkImportResult, location_id: Optional[str]):
+        """Set the stock of the products a bulk productUpdate part updated, in batches.
+        Products whose stock could not be set count as failed and keep no remote hash
+        """
+        if not location_id:
+            return
+        quantities = {
+            sku: {
+                'inventoryItemId': result.entries[sku]['inventory_item_gid'],
+                'locationId': location_id,
+                'quantity': quantity
+            } for sku, quantity in zip(part['skus'], part['quantities'])
+            if sku in result.succeeded and result.entries.get(sku, {}).get('inventory_item_gid')
+        }
+        skus = list(quantities)
+        for start in range(0, len(skus), INVENTORY_BATCH_SIZE):
+            batch = skus[start:start + INVENTORY_BATCH_SIZE]
+            try:
+                data = self._graphql('inventory_set', INVENTORY_SET, {'input': {
+                    'reason': 'correction',
+                    'setQuantities': [quantities[sku] for sku in batch]
+                }})
+                errors = data['inventorySetOnHandQuantities']['userErrors']
+                if errors:
+                    raise Exception('; '.join(error['message'] for error in errors))
+            except Exception as e:
+                logger.error(f"Failed to set inventory of {len(batch)} updated products: {str(e)}")
+                for sku in batch:
+                    del result.succeeded[sku]
+                    result.entries[sku]['remote_hash'] = None
+                    result.failed[sku] = f"Inventory not set: {str(e)}"
+
+    def _upload(self, path: str) -> str:
+        """Upload a JSONL file to Shopify's staged storage; returns its staged upload path"""
+        data = self._graphql('staged_upload', STAGED_UPLOADS_CREATE, {'input': [{
+            'resource': 'BULK_MUTATION_VARIABLES',
+            'filename': os.path.basename(path),
+            'mimeType': 'text/jsonl',
+            'httpMethod': 'POST'
+        }]})['stagedUploadsCreate']
+        if data['userErrors']:
+            raise Exception(f"stagedUploadsCreate failed: {data['userErrors']}")
+        target = data['stagedTargets'][0]
+        parameters = {parameter['name']: parameter['value'] for parameter in target['parameters']}
+
+        with open(path, 'rb') as f:
+            response = self.session.post(
+                target['url'],
+                data=parameters,
+                files={'file': (os.path.basename(path), f, 'text/jsonl')},
+                timeout=self.http_timeout
+            )
+        response.raise_for_status()
+        return parameters['key']
+
+    def _wait(self, operation_id: str, operation_type: str = 'MUTATION') -> Dict[str, Any]:
+        """Poll currentBulkOperation until the operation finishes"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            operation = self._graphql('bulk_poll', CURRENT_BULK_OPERATION, {'type': operation_type})['currentBulkOperation']
+            if operation and operation['id'] == operation_id and operation['status'] in FINISHED_STATUSES:
+                logger.info(f"Bulk operation {operation_id} {operation['status']} ({operation['objectCount']} objects)")
+                return operation
+            if time.monotonic() > deadline:
+                raise Exception(f"Bulk operation {operation_id} did not finish within {self.timeout}s")
+            time.sleep(self.poll_interval)
+
+    def _collect(self, operation: Dict[str, Any], part: Dict[str, Any], result: BulkImportResult):
+        """Map the result JSONL lines back to the SKUs of the uploaded file"""
+        key = 'productCreate' if part['kind'] == 'create' else 'productUpdate'
+        skus = part['skus']
+        seen = set()
+        url = operation.get('url') or operation.get('partialDataUrl')
+        if url:
+            response = self.session.get(url, stream=True, timeout=self.http_timeout)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                row = json.loads(line)
+                index = row.get('__lineNumber')
+                if index is None or not 0 <= index < len(skus):
+                    continue
+                sku = skus[index]
+                seen.add(index)
+                payload = (row.get('data') or {}).get(key) or {}
+                errors = payload.get('userErrors') or row.get('errors')
+                if payload.get('product') and not errors:
+                    result.succeeded[sku] = payload['product']['id']
+                    variants = (payload['product'].get('variants') or {}).get('edges') or []
+                    if variants:
+                        variant = variants[0]['node']
+                        result.entries[sku] = {
+                            'sku': sku,
+                            'product_gid': payload['product']['id'],
+                            'variant_gid': variant['id'],
+                            'inventory_item_gid': (variant.get('inventoryItem') or {}).get('id'),
+                            'remote_hash': part['hashes'][index],
+                            'has_image': part['images'][index],
+                            'metafields_hash': part['metafield_hashes'][index]
+                        }
+                else:
+                    result.failed[sku] = '; '.join(
+                        error.get('message', str(error)) for error in errors
+                    ) if errors else 'No product returned'
+
+        # Lines without a result were never run, e.g. when the operation failed midway
+        for index, sku in enumerate(skus):
+            if index not in seen:
+                result.failed.setdefault(
+                    sku, f"No result (bulk operation {operation['status']}, {operation.get('errorCode')})"
+                )
@@ -1,10 +1,21 @@
 import shopify
 from loguru import logger
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional
 from . import config
+from .database import Database
+from .models import Product
+from .rate_limiter import ApiCallCounter
+from .shopify_bulk import BulkImporter
+from .shopify_fields import product_hash
+from .shopify_ids import from_gid, index_entry, refresh_id_index
 
-class ShopifyClient:
-    def __init__(self):
+class ShopifyClient(ApiCallCounter):
+    def __init__(self, database: Database):
+        # Shopify API requests made by this client, for run statistics
+        self.api_calls = 0
+        # Connected by the caller for each run; holds the SKU -> Shopify ID index
+        self.database = database
+        self._location: Optional[shopify.Location] = None
         self.setup_shopify()
         
     def setup_shopify(self):
@@ -17,7 +28,18 @@ class ShopifyClient:
             logger.error(f"Failed to initialize Shopify API: {str(e)}")
             raise
             
-    def update_products(self, products: List[Dict[str, Any]]) -> tuple:
+    def prepare_id_index(self):
+        """Build the ID index from a bulk variant export if it is still empty"""
+        importer = BulkImporter(
+            f"https://{config.SHOPIFY_SHOP_URL}/admin/api/2024-01/graphql.json",
+            {'Content-Type': 'application/json', 'X-Shopify-Access-Token': config.SHOPIFY_ACCESS_TOKEN}
+        )
+        try:
+            refresh_id_index(self.database, importer)
+        finally:
+            self.api_calls += importer.api_calls
+            
+    def update_products(self, products: List[Product]) -> tuple:
         """Update or create products in Shopify
         Returns tuple of (updated_count, added_count)
         """
@@ -25,23 +47,12 @@ class ShopifyClient:
         added = 0
         
         try:
-            for product_data in products:
-                try:
-                    # Try to find existing product by SKU
-                    existing_products = shopify.Product.find(
-                        sku=product_data['sku']
-                    )
-                    
-                    if existing_products:
-                        self._update_product(existing_products[0], product_data)
-                        updated += 1
-                    else:
-                        self._create_product(product_data)
-                        added += 1
-                        
-                except Exception as e:
-                    logger.error(f"Failed to process product {product_data.get('sku')}: {str(e)}")
-                    continue
+            for product in products:
+                outcome = self.push_product(product)
+                if outcome == 'updated':
+                    updated += 1
+                elif outcome == 'added':
+                    added += 1
                     
             logger.info(f"Successfully processed {updated} updates and {added} additions")
             return updated, added
@@ -50,92 +61,120 @@ class ShopifyClient:
             logger.error(f"Failed to update products: {str(e)}")
             raise
             
-    def _create_product(self, product_data: Dict[str, Any]):
-        """Create new product in Shopify"""
+    def push_product(self, product: Product) -> Optional[str]:
+        """Create or update one product
+        Returns 'updated', 'added' or 'unchanged', or None if it failed
+        """
+        try:
+            # Shopify IDs come from the local index; no lookup requests
+            ids = self.database.get_shopify_ids([product.sku]).get(product.sku)
+            # Unchanged since a full ShopifySync push
+            if ids and ids['remote_hash'] == product_hash(product):
+                return 'unchanged'
+            
+            if ids:
+                entry = self._update_product(ids, product)
+                outcome = 'updated'
+            else:
+                entry = self._create_product(product)
+                outcome = 'added'
+            # Only part of the product is sent, so it doesn't count as pushed in full
+            entry['remote_hash'] = None
+            self.database.save_shopify_ids([entry])
+            return outcome
+            
+        except Exception as e:
+            logger.error(f"Failed to process product {product.sku}: {str(e)}")
+            return None
+            
+    def _create_product(self, product: Product) -> Dict[str, Any]:
+        """Create new product in Shopify
+        Returns its ID index entry
+        """
         try:
             new_product = shopify.Product()
-            new_product.title = product_data['title']
-            new_product.body_html = product_data.get('description', '')
+            new_product.title = product.title
+            new_product.body_html = product.description
             
             # Create variant
             variant = shopify.Variant({
-                'price': str(product_data['price']),
-                'sku': product_data['sku'],
+                'price': str(product.price),
+                'sku': product.sku,
                 'inventory_management': 'shopify',
-                'inventory_quantity': product_data['stock']
+                'inventory_quantity': product.stock_quantity
             })
             
             new_product.variants = [variant]
-            new_product.save()
+            if not self._rest('product_create', new_product.save):
+                raise Exception(f"Product was not saved: {new_product.errors.full_messages()}")
             
             # Set inventory
-            self._update_inventory(variant, product_data['stock'])
+            variant = new_product.variants[0]
+            self._update_inventory(variant.inventory_item_id, product.stock_quantity)
             
-            logger.info(f"Created new product: {product_data['sku']}")
+            logger.info(f"Created new product: {product.sku}")
+            return index_entry(product, new_product.id, variant.id, variant.inventory_item_id, False)
             
         except Exception as e:
-            logger.error(f"Failed to create product {product_data.get('sku')}: {str(e)}")
+            logger.error(f"Failed to create product {product.sku}: {str(e)}")
             raise
             
-    def _update_product(self, product: shopify.Product, product_data: Dict[str, Any]):
-        """Update existing product in Shopify"""
+    def _update_product(self, ids: Dict[str, Any], product: Product) -> Dict[str, Any]:
+        """Update existing product in Shopify
+        Returns its ID index entry
+        """
         try:
-            product.title = product_data['title']
-            product.body_html = product_data.get('description', '')
-            
-            # Update variant
-            variant = product.variants[0]
-            variant.price = str(product_data['price'])
+            # Only the changed fields are sent; the IDs make this a PUT without fetching the product
+            shopify_product = shopify.Product({
+                'id': from_gid(ids['product_gid']),
+                'title': product.title,
+                'body_html': product.description,
+                'variants': [{
+                    'id': from_gid(ids['variant_gid']),
+                    'price': str(product.price)
+                }]
+            })
             
-            product.save()
+            if not self._rest('product_update', shopify_product.save):
+                raise Exception(f"Product was not saved: {shopify_product.errors.full_messages()}")
             
             # Update inventory
-            self._update_inventory(variant, product_data['stock'])
+            variant = shopify_product.variants[0]
+            inventory_item_id = getattr(variant, 'inventory_item_id', None) or from_gid(ids['inventory_item_gid'])
+            self._update_inventory(inventory_item_id, product.stock_quantity)
             
-            logger.info(f"Updated product: {product_data['sku']}")
+            logger.info(f"Updated product: {product.sku}")
+            return index_entry(product, shopify_product.id, variant.id, inventory_item_id, ids['has_image'])
             
         except Exception as e:
-            logger.error(f"Failed to update product {product_data.get('sku')}: {str(e)}")
+            logger.error(f"Failed to update product {product.sku}: {str(e)}")
             raise
             
-    def _update_inventory(self, variant: shopify.Variant, quantity: int):
-        """Update product inventory"""
+    def _update_inventory(self, inventory_item_id: int, quantity: int):
+        """Update product inventory; set connects the item to the location if needed"""
         try:
             location = self._get_default_location()
             
-            inventory_item = shopify.InventoryItem.find(
-                variant.inventory_item_id
-            )
-            
-            inventory_level = shopify.InventoryLevel.find(
-                inventory_item_id=variant.inventory_item_id,
-                location_id=location.id
-            )
-            
-            if inventory_level:
-                inventory_level.set(quantity)
-            else:
-                shopify.InventoryLevel.connect(
-                    location.id,
-                    variant.inventory_item_id
-                )
-                shopify.InventoryLevel.set(
-                    location.id,
-                    variant.inventory_item_id,
-                    quantity
-                )
+            self._rest('inventory_set', lambda: shopify.InventoryLevel.set(
+                location.id,
+                inventory_item_id,
+                quantity
+            ))
                 
         except Exception as e:
             logger.error(f"Failed to update inventory: {str(e)}")
             raise
             
     def _get_default_location(self) -> shopify.Location:
-        """Get default inventory location"""
+        """Get default inventory location, fetched once per client"""
+        if self._location is not None:
+            return self._location
         try:
-            locations = shopify.Location.find()
+            locations = self._rest('location_find', shopify.Location.find)
             if not locations:
                 raise Exception("No locations found")
-            return locations[0]
+            self._location = locations[0]
+            return self._location
         except Exception as e:
             logger.error(f"Failed to get default location: {str(e)}")
             raise 
\ No newline at end of file
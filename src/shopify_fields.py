@@ -0,0 +1,78 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from .models import Product
+
+def product_metafields(product: Product) -> Dict[str, str]:
+    """Custom metafields stored on every Shopify product"""
+    return {
+        'range': product.range,
+        'reading': product.reading,
+        'family': product.family,
+        'weight': product.weight,
+        'dimensions': product.dimensions
+    }
+
+def metafield_inputs(product: Product) -> List[Dict[str, str]]:
+    """MetafieldInput for every metafield with a value"""
+    return [
+        {'namespace': 'custom', 'key': key, 'value': str(value), 'type': 'single_line_text_field'}
+        for key, value in product_metafields(product).items() if value
+    ]
+
+def metafields_hash(product: Product) -> str:
+    """Hash of the metafield values; unchanged metafields are not written again"""
+    data = json.dumps(metafield_inputs(product), sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+def inventory_quantity(product: Product) -> int:
+    """Quantity from a numeric availability, or a nominal 100 for 'in stock'"""
+    if product.stock_quantity:
+        return product.stock_quantity
+    return 100 if product.in_stock else 0
+
+def product_input(product: Product, location_id: Optional[str] = None) -> Dict[str, Any]:
+    """GraphQL ProductInput (API 2024-01) creating a product with its single variant"""
+    variant = {
+        'sku': product.sku,
+        'price': str(product.price) if product.price else "0.00",
+        'compareAtPrice': str(product.original_price) if product.original_price else None,
+        'inventoryManagement': 'SHOPIFY',
+        'options': ['Default Title']
+    }
+    if location_id:
+        variant['inventoryQuantities'] = [{
+            'availableQuantity': inventory_quantity(product),
+            'locationId': location_id
+        }]
+    data = {
+        'title': product.title or f"INSIZE {product.sku}",
+        'descriptionHtml': product.description,
+        'vendor': "INSIZE",
+        'productType': product.category or "Measuring Tools",
+        'status': "ACTIVE" if product.in_stock else "DRAFT",
+        'metafields': metafield_inputs(product),
+        'variants': [variant]
+    }
+    if product.image_url:
+        data['images'] = [{'src': product.image_url}]
+    return data
+
+def product_update_input(product: Product, ids: Dict[str, Any]) -> Dict[str, Any]:
+    """ProductInput updating an indexed product and its variant; inventory is not touched"""
+    data = product_input(product)
+    data['id'] = ids['product_gid']
+    data['variants'][0]['id'] = ids['variant_gid']
+    del data['variants'][0]['options']
+    # Images are only added to products that have none
+    if ids.get('has_image'):
+        data.pop('images', None)
+    if ids.get('metafields_hash') == metafields_hash(product):
+        del data['metafields']
+    return data
+
+def product_hash(product: Product) -> str:
+    """Hash of everything a push sends, stock included; unchanged products need no push"""
+    pushed = {'input': product_input(product), 'inventory': inventory_quantity(product)}
+    data = json.dumps(pushed, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
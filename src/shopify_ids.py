@@ -0,0 +1,44 @@
+from typing import Any, Dict, Optional, Union
+from loguru import logger
+from .database import Database
+from .models import Product
+from .shopify_bulk import BulkImporter
+from .shopify_fields import product_hash
+
+def to_gid(resource: str, value: Union[int, str]) -> str:
+    """GraphQL global ID of a REST resource ID, e.g. to_gid('Product', 123)"""
+    value = str(value)
+    return value if value.startswith('gid://') else f"gid://shopify/{resource}/{value}"
+
+def from_gid(gid: str) -> int:
+    """Numeric REST ID of a GraphQL global ID"""
+    return int(gid.rsplit('/', 1)[-1])
+
+def index_entry(product: Product, product_id: Union[int, str], variant_id: Union[int, str],
+                inventory_item_id: Optional[Union[int, str]], has_image: bool,
+                metafields_hash: Optional[str] = None) -> Dict[str, Any]:
+    """shopify_id_index entry for a product that was just pushed.
+    metafields_hash is only given when the push also wrote the metafields
+    """
+    return {
+        'sku': product.sku,
+        'product_gid': to_gid('Product', product_id),
+        'variant_gid': to_gid('ProductVariant', variant_id),
+        'inventory_item_gid': to_gid('InventoryItem', inventory_item_id) if inventory_item_id else None,
+        'remote_hash': product_hash(product),
+        'has_image': has_image,
+        'metafields_hash': metafields_hash
+    }
+
+def refresh_id_index(db: Database, importer: BulkImporter, rebuild: bool = False) -> int:
+    """Build shopify_id_index from a bulk export of the shop's variants.
+
+    Only runs when the index is empty unless rebuild=True; after that it is
+    kept up to date from mutation responses. Returns the number of entries.
+    """
+    if not rebuild:
+        count = db.count_shopify_ids()
+        if count:
+            return count
+    logger.info("Exporting Shopify variants to rebuild the ID index...")
+    return db.replace_shopify_ids(importer.export_variants())
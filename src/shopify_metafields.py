@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from loguru import logger
+from . import metrics
+from .models import Product
+from .rate_limiter import graphql_post
+from .shopify_fields import metafield_inputs, metafields_hash
+
+METAFIELDS_SET = """
+mutation metafieldsSet($metafields: [MetafieldsSetInput!]!) {
+    metafieldsSet(metafields: $metafields) {
+        metafields {
+            id
+        }
+        userErrors {
+            field
+            message
+            code
+        }
+    }
+}
+"""
+
+# Shopify's limit on metafields per metafieldsSet call
+MAX_METAFIELDS_PER_CALL = 25
+
+class MetafieldWriter:
+    """Writes product metafields with batched metafieldsSet calls.
+
+    add() queues the metafields of a pushed product unless their hash matches
+    the last one written; queued metafields of several products are sent
+    together, up to MAX_METAFIELDS_PER_CALL per call and never splitting a
+    product over two calls. metafieldsSet is atomic, so a failed call fails
+    every product in it; flush() reports those so their push can be retried.
+    """
+    def __init__(self, graphql_url: str, headers: Dict[str, str], session: Any = requests):
+        self.graphql_url = graphql_url
+        self.headers = headers
+        self.session = session
+        # Queued (SKU, metafields hash, MetafieldsSetInput list)
+        self.pending: List[Tuple[str, str, List[Dict[str, str]]]] = []
+        # Hashes of the metafields written since the last flush(), by SKU
+        self.written: Dict[str, str] = {}
+        # SKUs whose metafields failed since the last flush()
+        self.failed: List[str] = []
+        # Shopify API requests made by this writer, for run statistics
+        self.api_calls = 0
+
+    def add(self, product: Product, product_gid: str, known_hash: Optional[str] = None) -> bool:
+        """Queue a product's metafields; returns False when they are unchanged"""
+        new_hash = metafields_hash(product)
+        if new_hash == known_hash:
+            return False
+        metafields = [dict(metafield, ownerId=product_gid) for metafield in metafield_inputs(product)]
+        if not metafields:
+            self.written[product.sku] = new_hash
+            return False
+        self.pending.append((product.sku, new_hash, metafields))
+        if sum(len(queued) for _, _, queued in self.pending) >= MAX_METAFIELDS_PER_CALL:
+            self._send_full_calls()
+        return True
+
+    def flush(self) -> Tuple[Dict[str, str], List[str]]:
+        """Send everything queued
+        Returns the metafields hashes written by SKU, and the SKUs that failed
+        """
+        self._send_full_calls()
+        if self.pending:
+            self._send(self.pending)
+            self.pending = []
+        written, self.written = self.written, {}
+        failed, self.failed = self.failed, []
+        return written, failed
+
+    def _send_full_calls(self):
+        """Send the queued products that fill a call, keeping the remainder queued"""
+        while self.pending:
+            count = size = 0
+            for _, _, metafields in self.pending:
+                if count + len(metafields) > MAX_METAFIELDS_PER_CALL:
+                    break
+                count += len(metafields)
+                size += 1
+            if size == len(self.pending) and count < MAX_METAFIELDS_PER_CALL:
+                return
+            size = max(size, 1)
+            self._send(self.pending[:size])
+            self.pending = self.pending[size:]
+
+    def _send(self, batch: List[Tuple[str, str, List[Dict[str, str]]]]):
+        skus = [sku for sku, _, _ in batch]
+        self.api_calls += 1
+        metrics.SHOPIFY_CALLS.inc(operation='metafields_set')
+        try:
+            response = graphql_post(self.session, self.graphql_url, self.headers, METAFIELDS_SET, {
+                'metafields': [metafield for _, _, metafields in batch for metafield in metafields]
+            })
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}: {response.text}")
+            body = response.json()
+            if body.get('errors'):
+                raise Exception(str(body['errors']))
+            user_errors = body['data']['metafieldsSet']['userErrors']
+            if user_errors:
+                raise Exception('; '.join(error['message'] for error in user_errors))
+        except Exception as e:
+            logger.error(f"Failed to set metafields for {', '.join(skus)}: {str(e)}")
+            self.failed.extend(skus)
+            return
+        for sku, new_hash, _ in batch:
+            self.written[sku] = new_hash
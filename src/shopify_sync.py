@@ -1,17 +1,33 @@
+import argparse
 import shopify
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import os
 import json
-import time
 import requests
 from loguru import logger
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from . import metrics, profiling
+from .async_push import AsyncPushEngine
 from .database import Database
+from .logging_setup import setup_logging
+from .models import Product
+from .outbox import drain_outbox
+from .rate_limiter import ApiCallCounter, graphql_post
+from .shopify_bulk import BulkImporter
+from .shopify_fields import inventory_quantity, metafields_hash, product_hash
+from .shopify_ids import index_entry, refresh_id_index
+from .shopify_metafields import MetafieldWriter
+from .run_stats import RunStats
 
 load_dotenv()
 
-class ShopifySync:
+def _unchanged(ids: Optional[Dict[str, Any]], product: Product) -> bool:
+    """Whether the last push of an indexed product sent exactly this"""
+    return bool(ids) and ids['remote_hash'] == product_hash(product) \
+        and ids['metafields_hash'] == metafields_hash(product)
+
+class ShopifySync(ApiCallCounter):
     def __init__(self):
         """Initialize Shopify API connection"""
         self.shop_url = os.getenv('SHOPIFY_SHOP_URL')
@@ -28,75 +44,65 @@ class ShopifySync:
             'Content-Type': 'application/json',
             'X-Shopify-Access-Token': self.access_token
         }
+        
+        # Shopify API requests made by this instance, for run statistics
+        self.api_calls = 0
+        # Connection of the running sync; holds the SKU -> Shopify ID index
+        self.db: Optional[Database] = None
+        # Set for concurrent pushes, see push_products
+        self.engine: Optional[AsyncPushEngine] = None
+        # Metafields of the pushed products, written in batches
+        self.metafields = MetafieldWriter(self.graphql_url, self.headers)
 
-    def _create_product(self, product_data: Dict[str, Any]) -> bool:
-        """Create a new product in Shopify using GraphQL"""
+    def _create_product(self, product: Product) -> Optional[Dict[str, Any]]:
+        """Create a new product in Shopify
+        Returns its ID index entry, or None if it failed
+        """
         try:
             # Önce ürünü REST API ile oluşturalım
             shopify_product = shopify.Product()
-            shopify_product.title = product_data.get('title') or f"INSIZE {product_data['sku']}"
-            shopify_product.body_html = product_data.get('description', '')
+            shopify_product.title = product.title or f"INSIZE {product.sku}"
+            shopify_product.body_html = product.description
             shopify_product.vendor = "INSIZE"
-            shopify_product.product_type = product_data.get('category') or "Measuring Tools"
-            shopify_product.status = "active" if product_data.get('availability', '').lower() == 'in stock' else "draft"
+            shopify_product.product_type = product.category or "Measuring Tools"
+            shopify_product.status = "active" if product.in_stock else "draft"
             
             # Variant bilgilerini ekleyelim
             variant = shopify.Variant()
-            variant.sku = product_data['sku']
-            variant.price = str(product_data.get('price', 0.00))
-            if product_data.get('original_price'):
-                variant.compare_at_price = str(product_data['original_price'])
+            variant.sku = product.sku
+            variant.price = str(product.price)
+            if product.original_price:
+                variant.compare_at_price = str(product.original_price)
             variant.inventory_management = "shopify"
-            variant.inventory_quantity = 100 if product_data.get('availability', '').lower() == 'in stock' else 0
+            variant.inventory_quantity = inventory_quantity(product)
             variant.option1 = "Default Title"  # Tek variant için gerekli
             
             shopify_product.variants = [variant]
             
             # Resim varsa ekleyelim
-            if product_data.get('image_url'):
+            if product.image_url:
                 image = shopify.Image()
-                image.src = product_data['image_url']
+                image.src = product.image_url
                 shopify_product.images = [image]
             
             # Ürünü kaydedelim
-            if not shopify_product.save():
-                logger.error(f"Failed to create product for SKU {product_data['sku']}")
-                return False
-            
-            # Metafield'ları ayrı ayrı kaydedelim
-            metafields = {
-                'range': product_data.get('range', ''),
-                'reading': product_data.get('reading', ''),
-                'family': product_data.get('family', ''),
-                'weight': product_data.get('weight', ''),
-                'dimensions': product_data.get('dimensions', '')
-            }
-            
-            for key, value in metafields.items():
-                if value:
-                    try:
-                        metafield = shopify.Metafield({
-                            'namespace': 'custom',
-                            'key': key,
-                            'value': str(value),
-                            'type': 'single_line_text_field',
-                            'owner_id': shopify_product.id,
-                            'owner_resource': 'product'
-                        })
-                        metafield.save()
-                    except Exception as e:
-                        logger.warning(f"Failed to set metafield {key} for product {shopify_product.id}: {str(e)}")
-                        continue
+            if not self._rest('product_create', shopify_product.save):
+                logger.error(f"Failed to create product for SKU {product.sku}")
+                return None
             
-            logger.info(f"Successfully created product with SKU {product_data['sku']}")
-            return True
+            logger.info(f"Successfully created product with SKU {product.sku}")
+            created_variant = shopify_product.variants[0]
+            return index_entry(product, shopify_product.id, created_variant.id,
+                               created_variant.inventory_item_id, bool(product.image_url))
             
         except Exception as e:
-            logger.error(f"Error creating product {product_data['sku']}: {str(e)}")
-            return False
+            logger.error(f"Error creating product {product.sku}: {str(e)}")
+            return None
 
-    def _update_product(self, existing_product: shopify.Product, existing_variant: shopify.Variant, product_data: Dict[str, Any]) -> bool:
-        """Update an existing product in Shopify using GraphQL"""
+    def _update_product(self, ids: Dict[str, Any], product: Product) -> Optional[Dict[str, Any]]:
+        """Update an existing product in Shopify using GraphQL
+        Returns its ID index entry, or None if it failed
+        """
         try:
             mutation = """
             mutation productUpdate($input: ProductInput!) {
@@ -107,6 +113,9 @@ class ShopifySync:
                             edges {
                                 node {
                                     id
+                                    inventoryItem {
+                                        id
+                                    }
                                 }
                             }
                         }
@@ -121,203 +130,224 @@ class ShopifySync:
             
             variables = {
                 'input': {
-                    'id': f"gid://shopify/Product/{existing_product.id}",
-                    'title': product_data['title'] or f"INSIZE {product_data['sku']}",
-                    'descriptionHtml': product_data['description'],
+                    'id': ids['product_gid'],
+                    'title': product.title or f"INSIZE {product.sku}",
+                    'descriptionHtml': product.description,
                     'vendor': "INSIZE",
-                    'productType': product_data['category'] or "Measuring Tools",
-                    'status': "ACTIVE" if product_data['availability'].lower() == 'in stock' else "DRAFT",
+                    'productType': product.category or "Measuring Tools",
+                    'status': "ACTIVE" if product.in_stock else "DRAFT",
                     'variants': [{
-                        'id': f"gid://shopify/ProductVariant/{existing_variant.id}",
-                        'sku': product_data['sku'],
-                        'price': str(product_data['price']) if product_data['price'] else "0.00",
-                        'compareAtPrice': str(product_data['original_price']) if product_data['original_price'] else None,
+                        'id': ids['variant_gid'],
+                        'sku': product.sku,
+                        'price': str(product.price) if product.price else "0.00",
+                        'compareAtPrice': str(product.original_price) if product.original_price else None,
                         'inventoryQuantities': [{
-                            'availableQuantity': 100 if product_data['availability'].lower() == 'in stock' else 0
+                            'availableQuantity': inventory_quantity(product)
                         }]
                     }]
                 }
             }
             
-            if product_data.get('image_url') and not existing_product.images:
-                variables['input']['images'] = [{'src': product_data['image_url']}]
+            if product.image_url and not ids['has_image']:
+                variables['input']['images'] = [{'src': product.image_url}]
             
-            response = requests.post(
-                self.graphql_url,
-                json={'query': mutation, 'variables': variables},
-                headers=self.headers
-            )
+            self._api_call('product_update')
+            response = graphql_post(requests, self.graphql_url, self.headers, mutation, variables)
             
             if response.status_code != 200:
-                logger.error(f"GraphQL mutation failed for SKU {product_data['sku']}: {response.text}")
-                return False
+                logger.error(f"GraphQL mutation failed for SKU {product.sku}: {response.text}")
+                return None
             
             data = response.json()
-            user_errors = data.get('data', {}).get('productUpdate', {}).get('userErrors', [])
+            result = (data.get('data') or {}).get('productUpdate') or {}
+            user_errors = result.get('userErrors', [])
             
             if user_errors:
-                logger.error(f"Failed to update product for SKU {product_data['sku']}: {user_errors}")
-                return False
-            
-            # Update metafields
-            self._set_metafields(existing_product.id, product_data)
-            
-            logger.info(f"Successfully updated product with SKU {product_data['sku']}")
-            return True
+                logger.error(f"Failed to update product for SKU {product.sku}: {user_errors}")
+                return None
+            if not result.get('product'):
+                # Deleted in Shopify since it was indexed; the next push creates it again
+                logger.warning(f"Product for SKU {product.sku} no longer exists in Shopify")
+                self.db.delete_shopify_ids([product.sku])
+                return None
+            
+            logger.info(f"Successfully updated product with SKU {product.sku}")
+            variant = result['product']['variants']['edges'][0]['node']
+            return index_entry(product, result['product']['id'], variant['id'],
+                               (variant.get('inventoryItem') or {}).get('id'),
+                               ids['has_image'] or bool(product.image_url))
             
         except Exception as e:
-            logger.error(f"Error updating product {product_data['sku']}: {str(e)}")
-            return False
+            logger.error(f"Error updating product {product.sku}: {str(e)}")
+            return None
 
-    def _set_metafields(self, product_id: int, product_data: Dict[str, Any]) -> None:
-        """Set metafields for a product"""
-        metafields = {
-            'range': product_data.get('range', ''),
-            'reading': product_data.get('reading', ''),
-            'family': product_data.get('family', ''),
-            'weight': product_data.get('weight', ''),
-            'dimensions': product_data.get('dimensions', '')
-        }
+    def push_product(self, product: Product) -> Optional[str]:
+        """Create or update one product
+        Returns 'updated', 'added' or 'unchanged', or None if it failed
+        """
+        # Shopify IDs come from the local index; no lookup requests
+        ids = self.db.get_shopify_ids([product.sku]).get(product.sku)
+        if _unchanged(ids, product):
+            return 'unchanged'
         
-        for key, value in metafields.items():
-            if value:
-                try:
-                    metafield = shopify.Metafield({
-                        'namespace': 'custom',
-                        'key': key,
-                        'value': str(value),
-                        'type': 'single_line_text_field',
-                        'owner_id': product_id,
-                        'owner_resource': 'product'
-                    })
-                    metafield.save()
-                except Exception as e:
-                    logger.warning(f"Failed to set metafield {key} for product {product_id}: {str(e)}")
+        # Create or update product
+        if ids:
+            entry = self._update_product(ids, product)
+            outcome = 'updated'
+        else:
+            entry = self._create_product(product)
+            outcome = 'added'
+        if not entry:
+            return None
+        self.db.save_shopify_ids([entry])
+        # Written with the rest of the batch by push_products
+        self.metafields.add(product, entry['product_gid'], ids['metafields_hash'] if ids else None)
+        return outcome
 
-    def _find_product_by_sku(self, sku: str) -> tuple:
-        """Find a product and its variant by SKU using GraphQL"""
-        try:
-            query = """
-            query($query: String!) {
-                products(first: 1, query: $query) {
-                    edges {
-                        node {
-                            id
-                            title
-                            variants(first: 1) {
-                                edges {
-                                    node {
-                                        id
-                                        sku
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-            """
-            
-            variables = {
-                'query': f'variant:sku:"{sku}"'
-            }
-            
-            response = requests.post(
-                self.graphql_url,
-                json={'query': query, 'variables': variables},
-                headers=self.headers
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"GraphQL query failed for SKU {sku}: {response.text}")
-                return None, None
-            
-            data = response.json()
-            products = data.get('data', {}).get('products', {}).get('edges', [])
-            
-            if not products:
-                logger.info(f"No existing product found for SKU {sku}")
-                return None, None
-            
-            product_data = products[0]['node']
-            product_id = product_data['id'].split('/')[-1]  # Extract numeric ID
-            variant_data = product_data['variants']['edges'][0]['node']
-            variant_id = variant_data['id'].split('/')[-1]  # Extract numeric ID
-            
-            # Get full product and variant objects
-            product = shopify.Product.find(product_id)
-            variant = shopify.Variant.find(variant_id)
-            
-            logger.info(f"Found existing product with SKU {sku}")
-            return product, variant
-            
-        except Exception as e:
-            logger.error(f"Error finding product for SKU {sku}: {str(e)}")
-            return None, None
+    def _flush_metafields(self) -> List[str]:
+        """Write the queued metafields and remember what was written
+        Returns the SKUs whose metafields failed
+        """
+        api_calls = self.metafields.api_calls
+        written, failed = self.metafields.flush()
+        self.api_calls += self.metafields.api_calls - api_calls
+        self.db.save_metafields_hashes(written)
+        return failed
 
-    def sync_products(self, is_initial_load: bool = False):
-        """Sync products to Shopify"""
+    def push_products(self, products: List[Product]) -> Dict[str, Optional[str]]:
+        """Push a batch, with the concurrent engine when it is set up
+        Returns the outcome of push_product by SKU
+        """
+        if self.engine is None:
+            outcomes = {product.sku: self.push_product(product) for product in products}
+            # Failed like the product itself, so the outbox retries them
+            for sku in self._flush_metafields():
+                outcomes[sku] = None
+            return outcomes
+        
+        existing = self.db.get_shopify_ids([product.sku for product in products])
+        outcomes: Dict[str, Optional[str]] = {}
+        pending = []
+        for product in products:
+            if _unchanged(existing.get(product.sku), product):
+                outcomes[product.sku] = 'unchanged'
+            else:
+                pending.append(product)
+        if not pending:
+            return outcomes
+        
+        api_calls = self.engine.api_calls
+        result = self.engine.push(pending, existing)
+        self.api_calls += self.engine.api_calls - api_calls
+        self.db.save_shopify_ids(result.entries.values())
+        self.db.delete_shopify_ids(result.stale)
+        outcomes.update(result.outcomes)
+        return outcomes
+
+    def _push_catalog(self, db: Database, batch_size: int) -> Tuple[int, int]:
+        """Push every exportable product batch by batch
+        Returns the number of products pushed and failed
+        """
+        success_count = 0
+        error_count = 0
+        # Batches are streamed from the database; the total is only known at the end
+        for batch_number, batch in enumerate(db.iter_products(chunk_size=batch_size), start=1):
+            logger.info(f"Processing batch {batch_number} ({len(batch)} products)...")
+            
+            outcomes = {}
+            for outcome in self.push_products(batch).values():
+                outcome = outcome or 'failed'
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            for outcome, count in outcomes.items():
+                metrics.PUSHED_ROWS.inc(count, outcome=outcome)
+            error_count += outcomes.pop('failed', 0)
+            success_count += sum(outcomes.values())
+            
+            logger.info(f"Batch {batch_number} complete. Progress: {success_count + error_count} products")
+        return success_count, error_count
+
+    def sync_products(self, is_initial_load: bool = False, bulk: bool = False, concurrent: bool = False):
+        """Sync products to Shopify
+        
+        Full pushes (initial load, or no successful push yet) go through
+        Shopify bulk operations when bulk=True. Otherwise concurrent=True pushes
+        each batch with several requests in flight (needs aiohttp).
+        """
         try:
             db = Database()
             db.connect()
+            self.db = db
+            if concurrent:
+                self.engine = AsyncPushEngine(self.graphql_url, self.headers)
+                # One connection pool for the whole run
+                self.engine.open()
+                logger.info(f"Pushing with up to {self.engine.concurrency} concurrent requests")
             
-            # Get products from database
-            if is_initial_load:
-                logger.info("Starting initial bulk load of all products...")
-                products_df = db.get_all_products()
-            else:
-                # Get only products modified since last sync
-                last_sync = db.get_last_successful_sync()
-                if last_sync:
-                    logger.info(f"Getting products modified since {last_sync}")
-                    products_df = db.get_modified_products(last_sync)
-                else:
-                    logger.info("No previous successful sync found, getting all products...")
-                    products_df = db.get_all_products()
-            
-            products = products_df.to_dict('records')
-            total_products = len(products)
-            
-            if total_products == 0:
-                logger.info("No products to sync")
-                db.log_sync(
-                    products_updated=0,
-                    products_added=0,
-                    status="SUCCESS",
-                    error_message=""
-                )
-                return
-            
-            logger.info(f"Starting sync of {total_products} products...")
+            # Products modified from here on are left for the next incremental run
+            started_at = db.current_timestamp()
             
             # Process products in batches
             batch_size = 1000 if is_initial_load else 50
             success_count = 0
             error_count = 0
             
-            for i in range(0, total_products, batch_size):
-                batch = products[i:i + batch_size]
-                logger.info(f"Processing batch {i//batch_size + 1} ({len(batch)} products)...")
+            stats = RunStats()
+            api_calls = self.api_calls
+            with stats.stage('push') as stage:
+                # Get products from database
+                last_sync = None if is_initial_load else db.get_last_successful_sync()
                 
-                for product_data in batch:
-                    # Find existing product
-                    existing_product, existing_variant = self._find_product_by_sku(product_data['sku'])
-                    
-                    # Create or update product
-                    if existing_product and existing_variant:
-                        success = self._update_product(existing_product, existing_variant, product_data)
+                # Full pushes start from a fresh ID index; otherwise it is only built once
+                importer = BulkImporter(self.graphql_url, self.headers)
+                refresh_id_index(db, importer, rebuild=not last_sync)
+                self.api_calls += importer.api_calls
+                
+                if last_sync:
+                    # Only the products queued in the outbox since then
+                    logger.info(f"Pushing products queued in the outbox since {last_sync}")
+                    counts = drain_outbox(db, self.push_product, batch_size=batch_size, push_many=self.push_products)
+                    success_count = counts.get('added', 0) + counts.get('updated', 0) + counts.get('unchanged', 0)
+                    error_count = counts.get('failed', 0)
+                else:
+                    if is_initial_load:
+                        logger.info("Starting initial bulk load of all products...")
                     else:
-                        success = self._create_product(product_data)
+                        logger.info("No previous successful sync found, getting all products...")
                     
-                    if success:
-                        success_count += 1
+                    if bulk:
+                        # One bulk mutation operation per JSONL file instead of a request per product
+                        export_calls = importer.api_calls
+                        result = importer.import_products(db.iter_products(chunk_size=batch_size),
+                                                          existing=db.get_shopify_ids())
+                        db.save_shopify_ids(result.entries.values())
+                        self.api_calls += importer.api_calls - export_calls
+                        success_count = len(result.succeeded)
+                        error_count = len(result.failed)
+                        metrics.PUSHED_ROWS.inc(success_count, outcome='bulk')
+                        metrics.PUSHED_ROWS.inc(error_count, outcome='failed')
                     else:
-                        error_count += 1
+                        success_count, error_count = self._push_catalog(db, batch_size)
                     
-                    # Add small delay to avoid rate limits
-                    time.sleep(0.5)
+                    # The full push covered everything queued before it started
+                    if error_count == 0:
+                        db.complete_outbox_before(started_at)
                 
-                logger.info(f"Batch {i//batch_size + 1} complete. Progress: {success_count + error_count}/{total_products}")
+                stage['rows'] = success_count + error_count
+            stats.api_calls = self.api_calls - api_calls
+            
+            total_products = success_count + error_count
+            if total_products == 0:
+                logger.info("No products to sync")
+                db.log_sync(
+                    products_updated=0,
+                    products_added=0,
+                    status="SUCCESS",
+                    error_message="",
+                    sync_type="shopify_push",
+                    started_at=started_at,
+                    stage_metrics=stats.to_dict()
+                )
+                return
             
             status = "SUCCESS" if error_count == 0 else "PARTIAL_SUCCESS"
             error_message = f"{error_count} products failed to sync" if error_count > 0 else ""
@@ -329,7 +359,10 @@ class ShopifySync:
                 products_updated=success_count,
                 products_added=success_count,
                 status=status,
-                error_message=error_message
+                error_message=error_message,
+                sync_type="shopify_push",
+                started_at=started_at,
+                stage_metrics=stats.to_dict()
             )
             
         except Exception as e:
@@ -339,9 +372,34 @@ class ShopifySync:
                     products_updated=0,
                     products_added=0,
                     status="FAILED",
-                    error_message=str(e)
+                    error_message=str(e),
+                    sync_type="shopify_push",
+                    stage_metrics=stats.to_dict() if 'stats' in locals() else None
                 )
             raise
         finally:
+            self.db = None
+            if self.engine:
+                self.engine.close()
+                self.engine = None
             if 'db' in locals():
-                db.close() 
\ No newline at end of file
+                db.close()
+            metrics.export()
+            profiling.report()
+
+def main():
+    parser = argparse.ArgumentParser(description="Push products from the database to Shopify")
+    parser.add_argument('--initial', action='store_true', help="push every exportable product, not just the outbox")
+    parser.add_argument('--bulk', action='store_true', help="use Shopify bulk operations for full pushes")
+    parser.add_argument('--concurrent', action='store_true',
+                        help="push with several requests in flight (needs aiohttp)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    
+    setup_logging()
+    if args.profile:
+        profiling.enable('shopify_sync')
+    ShopifySync().sync_products(is_initial_load=args.initial, bulk=args.bulk, concurrent=args.concurrent)
+
+if __name__ == '__main__':
+    main() 
\ No newline at end of file
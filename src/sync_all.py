@@ -1,5 +1,8 @@
+import argparse
 from loguru import logger
 from .csv_exporter import export_to_shopify_csv
+from .logging_setup import setup_logging
+from . import profiling
 import os
 import shutil
 
@@ -30,4 +33,11 @@ def sync_all():
         raise
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Veritabanındaki ürünleri Shopify CSV dosyasına export eder")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    
+    setup_logging()
+    if args.profile:
+        profiling.enable('sync_all')
     sync_all() 
\ No newline at end of file
@@ -1,24 +1,30 @@
+import argparse
 from loguru import logger
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
-from . import config
+import os
+from . import config, metrics, profiling
 from .downloader import InsizeDownloader
 from .parser import ExcelParser
 from .database import Database
+from .db_pool import close_pool
 from .shopify_client import ShopifyClient
+from .outbox import drain_outbox
+from .logging_setup import setup_logging
+from .run_stats import RunStats
 
 class SyncManager:
     def __init__(self):
         self.downloader = InsizeDownloader()
         self.database = Database()
-        self.shopify_client = ShopifyClient()
+        self.shopify_client = ShopifyClient(self.database)
         
     def setup(self):
-        """Initialize connections and create tables"""
+        """Create tables; connections are checked out from the pool per sync run"""
         try:
-            self.database.connect()
-            self.database.create_tables()
+            with self.database:
+                self.database.create_tables()
         except Exception as e:
             logger.error(f"Setup failed: {str(e)}")
             raise
@@ -27,6 +33,7 @@ class SyncManager:
         """Close connections"""
         try:
             self.database.close()
+            close_pool()
         except Exception as e:
             logger.error(f"Cleanup failed: {str(e)}")
             
@@ -34,31 +41,74 @@ class SyncManager:
         """Main synchronization logic"""
         logger.info("Starting synchronization")
         excel_file = None
+        parser = None
+        stats = RunStats()
         
         try:
-            # Download Excel file
-            excel_file = self.downloader.download_excel()
-            if not excel_file:
+            # Fresh, validated connection for every run; the scheduler holds none in between
+            self.database.connect()
+            
+            # Download Excel file, unless it is unchanged since the last successful sync
+            with stats.stage('download'):
+                feed_state = self.database.get_feed_state(config.INSIZE_EXCEL_URL)
+                download = self.downloader.download_feed(feed_state)
+            if not download:
                 raise Exception("Failed to download Excel file")
                 
+            if download.not_modified:
+                # Finish pushes left over by an interrupted run
+                updated, added = self._push_outbox(stats)
+                self.database.save_feed_state(
+                    config.INSIZE_EXCEL_URL,
+                    download.etag,
+                    download.last_modified,
+                    download.content_sha256
+                )
+                self.database.log_sync(
+                    products_updated=updated,
+                    products_added=added,
+                    status="skipped_unchanged",
+                    stage_metrics=stats.to_dict()
+                )
+                logger.info("Excel file unchanged since last sync, skipping")
+                return
+                
+            excel_file = download.path
+            stats.bytes_downloaded = os.path.getsize(excel_file)
+                
             # Parse Excel file
-            parser = ExcelParser(excel_file)
-            products = parser.parse()
+            parser = ExcelParser(excel_file, content_sha256=download.content_sha256)
+            with stats.stage('parse') as stage:
+                products = parser.parse()
+                stage['rows'] = len(products)
             
             if not products:
                 raise Exception("No products found in Excel file")
                 
             # Update database
-            self.database.upsert_products(products)
+            with stats.stage('upsert') as stage:
+                result = self.database.upsert_products(products)
+                stage['rows'] = len(products)
             
-            # Update Shopify
-            updated, added = self.shopify_client.update_products(products)
+            # Update Shopify with the products that actually changed, queued in the outbox by the upsert
+            logger.info(f"{len(result.delta)} of {len(products)} products changed since the last sync")
+            updated, added = self._push_outbox(stats)
+            
+            # Remember the feed only once it is fully synced, so failed runs are retried
+            self.database.save_feed_state(
+                config.INSIZE_EXCEL_URL,
+                download.etag,
+                download.last_modified,
+                download.content_sha256
+            )
             
             # Log success
             self.database.log_sync(
                 products_updated=updated,
                 products_added=added,
-                status="success"
+                status="success",
+                validation_report=parser.report.to_dict(),
+                stage_metrics=stats.to_dict()
             )
             
             logger.info(f"Sync completed: {updated} updated, {added} added")
@@ -73,22 +123,43 @@ class SyncManager:
                     products_updated=0,
                     products_added=0,
                     status="failed",
-                    error_message=error_message
+                    error_message=error_message,
+                    validation_report=parser.report.to_dict() if parser else None,
+                    stage_metrics=stats.to_dict()
                 )
             except Exception as log_error:
                 logger.error(f"Failed to log sync failure: {str(log_error)}")
                 
         finally:
+            self.database.close()
+            metrics.export()
+            profiling.report()
+            
             # Cleanup temporary file
             if excel_file:
                 self.downloader.cleanup(excel_file)
                 
+    def _push_outbox(self, stats: RunStats) -> tuple:
+        """Push pending outbox entries to Shopify
+        Returns tuple of (updated_count, added_count)
+        """
+        api_calls = self.shopify_client.api_calls
+        with stats.stage('push') as stage:
+            self.shopify_client.prepare_id_index()
+            counts = drain_outbox(self.database, self.shopify_client.push_product)
+            stage['rows'] = sum(counts.values())
+        stats.api_calls += self.shopify_client.api_calls - api_calls
+        return counts.get('updated', 0), counts.get('added', 0)
+                
 def run_scheduler():
     """Run the scheduler"""
     try:
         manager = SyncManager()
         manager.setup()
         
+        if config.METRICS_PORT:
+            metrics.start_http_server(int(config.METRICS_PORT), config.METRICS_ADDR)
+            
         scheduler = BlockingScheduler()
         
         # Add jobs for both sync times
@@ -114,5 +185,25 @@ def run_scheduler():
     finally:
         manager.cleanup()
         
+def main():
+    parser = argparse.ArgumentParser(description="INSIZE feed to database and Shopify sync")
+    parser.add_argument('--once', action='store_true', help="run a single sync now instead of scheduling")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    
+    setup_logging()
+    if args.profile:
+        profiling.enable('sync_manager')
+    if not args.once:
+        run_scheduler()
+        return
+        
+    manager = SyncManager()
+    try:
+        manager.setup()
+        manager.sync()
+    finally:
+        manager.cleanup()
+        
 if __name__ == "__main__":
-    run_scheduler() 
\ No newline at end of file
+    main() 
\ No newline at end of file
@@ -0,0 +1,52 @@
+from typing import Any, Dict, Iterable, List, Optional
+from loguru import logger
+
+# Offending SKUs kept per rule
+SAMPLE_SIZE = 10
+
+class ValidationReport:
+    """Per-rule counts of rows that failed validation, with a capped sample of SKUs.
+
+    Collected while parsing and logged once at the end instead of one
+    warning per product.
+    """
+    def __init__(self, sample_size: int = SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.rows_checked = 0
+        self.counts: Dict[str, int] = {}
+        self.samples: Dict[str, List[str]] = {}
+
+    def add(self, rule: str, count: int, skus: Optional[Iterable[Any]] = None):
+        """Count `count` failures of `rule`, sampling from `skus` until the cap is reached"""
+        if not count:
+            return
+        self.counts[rule] = self.counts.get(rule, 0) + int(count)
+        sample = self.samples.setdefault(rule, [])
+        if skus is not None and len(sample) < self.sample_size:
+            for sku in skus:
+                sample.append(str(sku))
+                if len(sample) >= self.sample_size:
+                    break
+
+    @property
+    def total_issues(self) -> int:
+        return sum(self.counts.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows_checked': self.rows_checked,
+            'rules': {
+                rule: {'count': count, 'sample': self.samples.get(rule, [])}
+                for rule, count in sorted(self.counts.items())
+            }
+        }
+
+    def log_summary(self):
+        """One summary line plus one line per failed rule"""
+        if not self.counts:
+            logger.info(f"Validation: {self.rows_checked} rows checked, no issues")
+            return
+        logger.warning(f"Validation: {self.rows_checked} rows checked, {self.total_issues} issues")
+        for rule, count in sorted(self.counts.items()):
+            sample = ', '.join(self.samples.get(rule, []))
+            logger.warning(f"  {rule}: {count}" + (f" (e.g. {sample})" if sample else ''))
@@ -1,7 +1,7 @@
-import pandas as pd
 from loguru import logger
 import sys
 from src.downloader import InsizeDownloader
+from src.parser import ExcelParser
 
 # Configure logger
 logger.remove()  # Remove default handler
@@ -20,8 +20,9 @@ def test_excel_structure():
         file_path = downloader.download_excel()
         
         # Read the Excel file
-        logger.info(f"Reading Excel file: {file_path}")
-        df = pd.read_excel(file_path)
+        parser = ExcelParser(file_path)
+        logger.info(f"Reading Excel file: {file_path} (engine: {parser.engine})")
+        df = parser.read_frame()
         
         # Log DataFrame info
         logger.info(f"DataFrame shape: {df.shape}")
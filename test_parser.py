@@ -36,7 +36,7 @@ def test_parser():
             logger.info("Sample products:")
             for i, product in enumerate(products[:3], 1):
                 logger.info(f"\nProduct {i}:")
-                for key, value in product.items():
+                for key, value in product.to_dict().items():
                     logger.info(f"{key}: {value}")
                     
         # Clean up
@@ -0,0 +1,60 @@
+import uuid
+
+import openpyxl
+import pytest
+
+from src import config
+from src.database import Database
+
+SUB_HEADER = ['No', 'Description', 'Description 2', 'Availability', 'Range', 'Reading', 'Family',
+              'Weight', 'Dimensions', 'Image', 'URL', 'Category', 'Subcategory', None, None,
+              'Precio', 'Descuento EU']
+
+
+@pytest.fixture(autouse=True)
+def no_parse_cache(monkeypatch):
+    """Parse from the workbook unless a test opts into a cache explicitly"""
+    monkeypatch.setattr(config, 'PARSE_CACHE_DIR', '')
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['INSIZE EUROPE PRICE LIST'])
+    sheet.append([None] + SUB_HEADER)
+    for i in range(250):
+        sku = f"1108-{i}" if i % 50 else None
+        description2 = 'Digital' if i % 3 else None
+        availability = 'N/A' if i == 7 else str(i % 4)
+        sheet.append([None, sku, f"Caliper {i}", description2, availability, '0-150mm', 0.01,
+                      'Calipers', '0.2 kg', None, f"https://img/{i}.jpg", None, 'Measuring',
+                      'Calipers', None, None, 10.0 + i, float(i % 5) * 5])
+    sheet.append([])
+    sheet.append([None, 1108999, 'Integer SKU', None, 3, None, None, None, None, None, None,
+                  None, None, None, None, None, 20, 0])
+    path = tmp_path / 'INSIZE_EUROPE.xlsx'
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def db():
+    """Database with the tables created in a throwaway schema; skipped without Postgres"""
+    database = Database()
+    try:
+        database.connect()
+    except Exception as e:
+        pytest.skip(f"PostgreSQL not available: {e}")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    database.cursor.execute(f"CREATE SCHEMA {schema}")
+    database.cursor.execute(f"SET search_path TO {schema}")
+    database.conn.commit()
+    database.create_tables()
+    yield database
+    database.conn.rollback()
+    database.cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+    # Pooled connections keep session settings
+    database.cursor.execute("RESET search_path")
+    database.conn.commit()
+    database.close()
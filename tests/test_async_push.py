@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.models import Product
+from src.rate_limiter import RateLimiter
+
+pytest.importorskip('aiohttp')
+from src.async_push import AsyncPushEngine  # noqa: E402
+
+
+class GraphQLStub(BaseHTTPRequestHandler):
+    """Shopify GraphQL stand-in answering slowly enough for requests to overlap"""
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    clients = set()
+    in_flight = 0
+    max_in_flight = 0
+    inventory = []
+
+    def do_POST(self):
+        with self.lock:
+            type(self).in_flight += 1
+            type(self).max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.clients.add(self.client_address)
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            body = self._answer(request['query'], request['variables'])
+            body['extensions'] = {'cost': {'requestedQueryCost': 10, 'actualQueryCost': 10, 'throttleStatus': {
+                'maximumAvailable': 1000.0, 'currentlyAvailable': 990, 'restoreRate': 50.0}}}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with self.lock:
+                type(self).in_flight -= 1
+
+    def _answer(self, query, variables):
+        if 'locations' in query:
+            return {'data': {'locations': {'edges': [{'node': {'id': 'gid://shopify/Location/7'}}]}}}
+        if 'inventorySetOnHandQuantities' in query:
+            type(self).inventory.extend(variables['input']['setQuantities'])
+            return {'data': {'inventorySetOnHandQuantities': {'userErrors': []}}}
+
+        time.sleep(0.05)
+        product_input = variables['input']
+        sku = product_input['variants'][0]['sku']
+        key = 'productUpdate' if 'productUpdate' in query else 'productCreate'
+        if product_input['title'] == 'GONE':
+            return {'data': {key: {'product': None, 'userErrors': []}}}
+        if product_input['title'] == 'FAIL':
+            return {'data': {key: {'product': None, 'userErrors': [{'field': ['title'], 'message': 'Title is invalid'}]}}}
+        number = sku.rsplit('-', 1)[1]
+        variant = {'id': product_input['variants'][0].get('id', f"gid://shopify/ProductVariant/{number}"),
+                   'sku': sku, 'inventoryItem': {'id': f"gid://shopify/InventoryItem/{number}"}}
+        product = {'id': product_input.get('id', f"gid://shopify/Product/{number}"),
+                   'variants': {'edges': [{'node': variant}]}}
+        return {'data': {key: {'product': product, 'userErrors': []}}}
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def graphql_stub():
+    GraphQLStub.in_flight = 0
+    GraphQLStub.max_in_flight = 0
+    GraphQLStub.inventory = []
+    GraphQLStub.clients = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GraphQLStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/admin/api/2024-01/graphql.json"
+    server.shutdown()
+    server.server_close()
+
+
+def test_push_overlaps_requests_and_collects_results_per_sku(graphql_stub):
+    products = [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0 + i, availability=str(i),
+                        image_url=f"https://img/{i}.jpg") for i in range(12)]
+    products[3].title = 'FAIL'
+    products[5].title = 'GONE'
+    existing = {sku: {'sku': sku, 'product_gid': f"gid://shopify/Product/{n}",
+                      'variant_gid': f"gid://shopify/ProductVariant/{n}", 'has_image': True}
+                for n, sku in ((1, '1108-1'), (5, '1108-5'))}
+    engine = AsyncPushEngine(graphql_stub, {'X-Shopify-Access-Token': 't'}, concurrency=4,
+                             bucket=RateLimiter('test', 1000, 50))
+
+    result = engine.push(products, existing)
+
+    assert 1 < GraphQLStub.max_in_flight <= 4
+    assert result.outcomes['1108-0'] == 'added'
+    assert result.outcomes['1108-1'] == 'updated'
+    assert result.outcomes['1108-3'] is None
+    assert result.errors['1108-3'] == 'Title is invalid'
+    assert result.stale == ['1108-5']
+    assert len(result.entries) == 10
+    assert result.entries['1108-1']['inventory_item_gid'] == 'gid://shopify/InventoryItem/1'
+    # Only updated products need their inventory set separately
+    assert GraphQLStub.inventory == [{'inventoryItemId': 'gid://shopify/InventoryItem/1',
+                                      'locationId': 'gid://shopify/Location/7', 'quantity': 1}]
+    assert engine.api_calls == 14
+
+
+def test_batches_of_one_run_share_connections(graphql_stub):
+    engine = AsyncPushEngine(graphql_stub, {'X-Shopify-Access-Token': 't'}, concurrency=4,
+                             bucket=RateLimiter('test', 1000, 50))
+
+    with engine:
+        for start in range(0, 24, 8):
+            batch = [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0) for i in range(start, start + 8)]
+            assert len(engine.push(batch, {}).entries) == 8
+
+    # Keep-alive connections of the pool, not new ones per batch
+    assert len(GraphQLStub.clients) <= 4
+    assert engine.bucket.in_flight == 0
+
+
+def test_concurrency_is_capped_by_the_cost_bucket():
+    engine = AsyncPushEngine('http://shop/graphql.json', {}, concurrency=50, bucket=RateLimiter('test', 100, 5))
+    assert engine.concurrency == 10
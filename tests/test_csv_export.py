@@ -1,16 +1,39 @@
-from src.csv_exporter import export_to_shopify_csv
+import csv
+
+from src.csv_exporter import export_to_shopify_csv, write_shopify_csv
+from src.models import Product
 from loguru import logger
 
 def test_csv_export():
     """Test CSV export functionality"""
     try:
         logger.info("Starting CSV export test...")
-        # Her dosyada 1000 ürün olacak şekilde export et
-        export_to_shopify_csv(batch_size=1000, output_dir='shopify_exports')
+        # Ürünleri 1000'lik parçalar halinde export et
+        export_to_shopify_csv(chunk_size=1000, output_dir='shopify_exports')
         logger.success("CSV export test completed successfully")
     except Exception as e:
         logger.error(f"CSV export test failed: {str(e)}")
         raise
 
+def test_write_shopify_csv_streams_chunks(tmp_path):
+    """Chunks are written row by row; products without an image are skipped"""
+    chunks = iter([
+        [Product('1108-150', title='Digital caliper', price=42.5, availability='7', image_url='https://img/1.jpg'),
+         Product('NO-IMAGE', title='Skipped')],
+        [Product('2112 25', price=10.0, original_price=12.0, availability='0', image_url='https://img/2.jpg')],
+    ])
+    output_file = tmp_path / 'shopify_products.csv'
+
+    assert write_shopify_csv(chunks, str(output_file)) == 2
+
+    with open(output_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['Handle'] for row in rows] == ['1108-150', '2112-25']
+    assert rows[0]['Variant Price'] == '42.50'
+    assert rows[0]['Status'] == 'active'
+    assert rows[1]['Title'] == 'INSIZE 2112 25'
+    assert rows[1]['Variant Compare At Price'] == '12.00'
+    assert rows[1]['Published'] == 'FALSE'
+
 if __name__ == '__main__':
     test_csv_export() 
\ No newline at end of file
@@ -0,0 +1,212 @@
+import threading
+
+import pytest
+from psycopg2.pool import PoolError
+
+from src.database import EXPORTABLE_PRODUCTS_QUERY, Database
+from src.db_pool import ConnectionPool
+from src.models import Product
+
+
+def _catalog(size=50):
+    return [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0 + i, availability=str(i % 3),
+                    image_url=f"https://img/{i}.jpg") for i in range(size)]
+
+
+@pytest.mark.parametrize('method', ['copy', 'values'])
+def test_upsert_reports_added_changed_unchanged(db, method):
+    products = _catalog()
+    result = db.upsert_products(products, method=method)
+    assert result.counts() == {'inserted': 50, 'updated': 0, 'unchanged': 0}
+
+    products[0].price = 99.0
+    products.append(Product('NEW-1', title='New'))
+    result = db.upsert_products(iter(products), page_size=7, method=method)
+
+    assert result.added == {'NEW-1'}
+    assert result.changed == {'1108-0'}
+    assert len(result.unchanged) == 49
+    assert result.delta == {'NEW-1', '1108-0'}
+
+
+def test_unchanged_rows_are_not_rewritten(db):
+    db.upsert_products(_catalog())
+    db.cursor.execute("SELECT sku, xmin::text, last_updated FROM products ORDER BY sku")
+    before = db.cursor.fetchall()
+
+    db.upsert_products(_catalog())
+
+    db.cursor.execute("SELECT sku, xmin::text, last_updated FROM products ORDER BY sku")
+    assert db.cursor.fetchall() == before
+
+
+def test_existing_rows_get_content_hash_backfilled(db):
+    db.upsert_products([Product('OLD-1', title='Old', price=1.0, availability='2')])
+    db.cursor.execute("UPDATE products SET content_hash = NULL")
+    db.conn.commit()
+    db.create_tables()
+
+    result = db.upsert_products([Product('OLD-1', title='Old', price=1.0, availability='2')])
+
+    assert result.unchanged == {'OLD-1'}
+
+
+def test_copy_escapes_text_and_keeps_last_duplicate(db):
+    db.upsert_products([
+        Product('A-1', title='tab\there', description='line\nbreak \\ backslash'),
+        Product('A-1', title='last wins'),
+    ])
+
+    db.cursor.execute("SELECT title, description FROM products WHERE sku = 'A-1'")
+    assert db.cursor.fetchone() == ('last wins', '')
+
+    db.upsert_products([Product('A-2', title='tab\there', description='line\nbreak \\ backslash')])
+    db.cursor.execute("SELECT title, description FROM products WHERE sku = 'A-2'")
+    assert db.cursor.fetchone() == ('tab\there', 'line\nbreak \\ backslash')
+
+
+def test_get_all_products_applies_export_filters(db):
+    products = _catalog(9)
+    products[1].image_url = ''
+    db.upsert_products(products)
+
+    frame = db.get_all_products()
+
+    # availability '0' (every third product) and the product without an image are filtered out
+    assert sorted(frame['sku']) == ['1108-2', '1108-4', '1108-5', '1108-7', '1108-8']
+    assert db.get_all_products(diagnostics=False).equals(frame)
+
+
+def test_iter_products_streams_filtered_chunks(db):
+    db.upsert_products(_catalog(30))
+
+    chunks = list(db.iter_products(chunk_size=8))
+
+    # availability '0' is filtered out, leaving 20 products
+    assert [len(chunk) for chunk in chunks] == [8, 8, 4]
+    streamed = [p.sku for chunk in chunks for p in chunk]
+    assert streamed == list(db.get_all_products(diagnostics=False)['sku'])
+    assert chunks[0][0].price == 11.0
+
+
+@pytest.fixture
+def pool(db):
+    connection_pool = ConnectionPool(minconn=1, maxconn=2)
+    yield connection_pool
+    connection_pool.closeall()
+
+
+def test_pool_replaces_connections_killed_by_the_server(db, pool):
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            pid = cursor.fetchone()[0]
+
+    # Simulates a server restart dropping the idle pooled connection
+    db.cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    db.conn.commit()
+
+    with Database(pool) as database:
+        database.cursor.execute("SELECT pg_backend_pid()")
+        assert database.cursor.fetchone()[0] != pid
+
+
+def test_returned_connections_are_rolled_back(db, pool):
+    with Database(pool) as database:
+        database.cursor.execute("CREATE TEMP TABLE leftover (id INT)")
+        conn = database.conn
+    assert database.conn is None
+
+    with pool.connection() as reused:
+        assert reused is conn
+        with reused.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pg_temp.leftover')")
+            assert cursor.fetchone()[0] is None
+
+
+def test_exhausted_pool_waits_for_a_returned_connection(db):
+    connection_pool = ConnectionPool(minconn=1, maxconn=1, timeout=5)
+    try:
+        conn = connection_pool.getconn()
+        threading.Timer(0.1, connection_pool.putconn, (conn,)).start()
+        assert connection_pool.getconn() is conn
+
+        connection_pool.timeout = 0.1
+        with pytest.raises(PoolError, match="pool exhausted"):
+            connection_pool.getconn()
+    finally:
+        connection_pool.closeall()
+
+
+def test_modified_at_only_moves_on_content_change(db):
+    db.upsert_products(_catalog(5))
+    since = db.current_timestamp()
+    db.conn.commit()
+
+    products = _catalog(5)
+    products[3].price = 99.0
+    db.upsert_products(products)
+
+    db.cursor.execute("SELECT sku FROM products WHERE modified_at > %s ORDER BY sku", (since,))
+    assert [row[0] for row in db.cursor.fetchall()] == ['1108-3']
+
+
+def test_last_successful_sync_is_the_last_full_push(db):
+    assert db.get_last_successful_sync() is None
+    first = db.current_timestamp()
+    db.log_sync(5, 5, 'SUCCESS', sync_type='shopify_push', started_at=first)
+    db.log_sync(3, 3, 'PARTIAL_SUCCESS', sync_type='shopify_push', started_at=db.current_timestamp())
+    db.log_sync(50, 50, 'success')
+
+    assert db.get_last_successful_sync() == first
+    assert db.get_last_successful_sync('feed') is not None
+
+
+def test_exportable_products_follow_upserts(db):
+    products = _catalog(6)
+    db.upsert_products(products)
+    assert [p.sku for chunk in db.iter_products() for p in chunk] == ['1108-1', '1108-2', '1108-4', '1108-5']
+
+    # Coming back into stock and running out both show up without a refresh
+    products[0].availability = '5'
+    products[1].availability = '0'
+    db.upsert_products(products)
+    assert [p.sku for chunk in db.iter_products() for p in chunk] == ['1108-0', '1108-2', '1108-4', '1108-5']
+
+    # The export filter implies the partial index predicate
+    db.cursor.execute("SET LOCAL enable_seqscan = off")
+    db.cursor.execute(f"EXPLAIN {EXPORTABLE_PRODUCTS_QUERY}")
+    assert 'idx_products_exportable' in ' '.join(row[0] for row in db.cursor.fetchall())
+
+
+def test_stage_trends_over_recent_runs(db):
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        db.log_sync(1, 1, 'success', stage_metrics={'stages': {
+            'parse': {'seconds': seconds, 'rows': 100, 'rows_per_second': 100 / seconds},
+            'upsert': {'seconds': 0.5, 'rows': 100}
+        }})
+    db.log_sync(0, 0, 'SUCCESS', sync_type='shopify_push', stage_metrics={'stages': {'push': {'seconds': 9.0}}})
+
+    trends = db.get_stage_trends(runs=3, sync_type='feed').set_index('stage')
+
+    assert list(trends.index) == ['parse', 'upsert']
+    assert trends.loc['parse', 'runs'] == 3
+    assert trends.loc['parse', 'p50_seconds'] == 3.0
+    assert trends.loc['parse', 'p95_seconds'] == 3.9
+    assert len(db.get_stage_trends()) == 3
+
+
+def test_streams_leave_the_callers_transaction_alone(db):
+    db.upsert_products(_catalog(30))
+    db.cursor.execute("CREATE TABLE scratch (n INTEGER)")
+
+    first, second = db.iter_products(chunk_size=8), db.iter_products(chunk_size=8)
+    # Two streams of one Database at once
+    assert len(next(first)) == len(next(second)) == 8
+    db.conn.rollback()
+    assert sum(len(chunk) for chunk in first) == 12
+    second.close()
+
+    # The uncommitted table was not committed by the streams
+    db.cursor.execute("SELECT to_regclass('scratch')")
+    assert db.cursor.fetchone()[0] is None
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import config
+from src.downloader import InsizeDownloader
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+ETAG = '"insize-feed-v1"'
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with ETag/Range support; can drop the connection mid-body"""
+    drop_after = None
+    requests_seen = []
+    logins = 0
+    session_cookie = None
+    login_page = False
+
+    def do_POST(self):
+        type(self).logins += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        type(self).session_cookie = f"s{type(self).logins}"
+        self.send_response(200)
+        self.send_header('Set-Cookie', f"session={type(self).session_cookie}; Path=/")
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_GET(self):
+        type(self).requests_seen.append(dict(self.headers))
+
+        if type(self).login_page:
+            body = b'<html><form action="documentacion.php"></form></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        session_cookie = type(self).session_cookie
+        if session_cookie and f"session={session_cookie}" not in self.headers.get('Cookie', ''):
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', ETAG) == ETAG:
+            start = int(range_header.split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        body = PAYLOAD[start:]
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        drop_after = type(self).drop_after
+        if drop_after is not None:
+            type(self).drop_after = None
+            self.wfile.write(body[:drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def feed_server(monkeypatch, tmp_path):
+    FeedHandler.drop_after = None
+    FeedHandler.requests_seen = []
+    FeedHandler.logins = 0
+    FeedHandler.session_cookie = None
+    FeedHandler.login_page = False
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FeedHandler.base_url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(config, 'INSIZE_EXCEL_URL', f"{FeedHandler.base_url}/INSIZE_EUROPE.xlsx")
+    monkeypatch.setattr(config, 'INSIZE_SESSION_CACHE', str(tmp_path / 'insize_session.json'))
+    monkeypatch.setattr(config, 'DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+    yield FeedHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader(monkeypatch):
+    downloader = InsizeDownloader()
+    monkeypatch.setattr(downloader, 'login', lambda: True)
+    return downloader
+
+
+def _read_and_cleanup(downloader, path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    downloader.cleanup(path)
+    return data
+
+
+def test_streaming_download(feed_server, downloader):
+    """The workbook is streamed to disk and hashed as it arrives"""
+    result = downloader.download_feed()
+
+    assert result is not None and not result.not_modified
+    assert result.etag == ETAG
+    assert result.content_sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    assert _read_and_cleanup(downloader, result.path) == PAYLOAD
+
+
+def test_resume_after_dropped_connection(feed_server, downloader):
+    """A dropped transfer resumes with a Range request instead of starting over"""
+    feed_server.drop_after = 1024 * 1024
+
+    result = downloader.download_feed()
+
+    assert result is not None
+    assert result.content_sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    assert _read_and_cleanup(downloader, result.path) == PAYLOAD
+    assert len(feed_server.requests_seen) == 2
+    assert feed_server.requests_seen[1]['Range'] == f"bytes={1024 * 1024}-"
+
+
+def test_not_modified_by_etag(feed_server, downloader):
+    """A matching ETag yields a 304 and no file"""
+    previous = {'etag': ETAG, 'last_modified': None, 'content_sha256': 'abc'}
+
+    result = downloader.download_feed(previous)
+
+    assert result.not_modified
+    assert result.path is None
+    assert result.content_sha256 == 'abc'
+
+
+def test_not_modified_by_content_hash(feed_server, downloader):
+    """Identical bytes are reported as not modified even without a 304"""
+    previous = {'etag': '"stale"', 'last_modified': None, 'content_sha256': hashlib.sha256(PAYLOAD).hexdigest()}
+
+    result = downloader.download_feed(previous)
+
+    assert result.not_modified
+    assert result.path is None
+    assert result.etag == ETAG
+
+
+def _real_login_downloader(feed_server):
+    downloader = InsizeDownloader()
+    downloader.login_url = f"{feed_server.base_url}/documentacion.php"
+    return downloader
+
+
+def test_cached_session_is_reused(feed_server):
+    """A second downloader reuses the cached cookies instead of logging in"""
+    first = _real_login_downloader(feed_server)
+    result = first.download_feed()
+    first.cleanup(result.path)
+    assert feed_server.logins == 1
+
+    second = _real_login_downloader(feed_server)
+    assert second.logged_in
+    result = second.download_feed()
+    second.cleanup(result.path)
+    assert feed_server.logins == 1
+
+
+def test_rejected_session_logs_in_again(feed_server):
+    """An expired server-side session triggers exactly one new login"""
+    first = _real_login_downloader(feed_server)
+    first.cleanup(first.download_feed().path)
+
+    feed_server.session_cookie = 'rotated'
+    second = _real_login_downloader(feed_server)
+    result = second.download_feed()
+
+    assert result is not None and result.path
+    assert _read_and_cleanup(second, result.path) == PAYLOAD
+    assert feed_server.logins == 2
+
+
+def test_login_page_after_new_login_is_not_downloaded(feed_server):
+    """A shop that keeps answering with its login page gives no feed, not a saved HTML page"""
+    feed_server.login_page = True
+    downloader = _real_login_downloader(feed_server)
+
+    assert downloader.download_feed() is None
+    assert feed_server.logins == 2
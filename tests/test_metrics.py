@@ -0,0 +1,66 @@
+import urllib.request
+
+import pytest
+
+from src import metrics
+from src.metrics import Counter, Histogram, Registry
+from src.run_stats import RunStats
+
+
+def test_counter_and_histogram_exposition():
+    registry = Registry()
+    calls = registry.register(Counter('shopify_calls_total', 'Shopify calls', ['operation']))
+    latency = registry.register(Histogram('stage_seconds', 'Stage latency', ['stage'], buckets=(1, 5)))
+
+    calls.inc(operation='product_find')
+    calls.inc(2, operation='product_find')
+    calls.inc(operation='say "hi"')
+    latency.observe(0.5, stage='parse')
+    latency.observe(1, stage='parse')
+    latency.observe(7.5, stage='parse')
+
+    text = registry.render()
+
+    assert '# TYPE shopify_calls_total counter' in text
+    assert 'shopify_calls_total{operation="product_find"} 3' in text
+    assert 'shopify_calls_total{operation="say \\"hi\\""} 1' in text
+    assert 'stage_seconds_bucket{stage="parse",le="1"} 2' in text
+    assert 'stage_seconds_bucket{stage="parse",le="5"} 2' in text
+    assert 'stage_seconds_bucket{stage="parse",le="+Inf"} 3' in text
+    assert 'stage_seconds_sum{stage="parse"} 9' in text
+    assert 'stage_seconds_count{stage="parse"} 3' in text
+
+
+def test_labels_must_match():
+    counter = Counter('rows_total', 'Rows', ['stage'])
+    with pytest.raises(ValueError):
+        counter.inc(operation='parse')
+    with pytest.raises(ValueError):
+        counter.inc(-1, stage='parse')
+
+
+def test_run_stats_feed_stage_metrics():
+    before = metrics.STAGE_ROWS.value(stage='test_stage')
+    with RunStats().stage('test_stage') as stage:
+        stage['rows'] = 40
+
+    assert metrics.STAGE_ROWS.value(stage='test_stage') == before + 40
+    assert 'insize_stage_duration_seconds_count{stage="test_stage"}' in metrics.REGISTRY.render()
+
+
+def test_http_endpoint_and_textfile(tmp_path):
+    server = metrics.start_http_server(0)
+    try:
+        port = server.server_port
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert '# TYPE insize_sync_runs_total counter' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    textfile = tmp_path / 'collector' / 'insize_sync.prom'
+    metrics.export(str(textfile))
+    assert textfile.read_text() == metrics.REGISTRY.render()
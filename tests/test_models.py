@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from src.models import PRODUCT_FIELDS, Product
+
+
+def test_product_round_trips_through_dict():
+    product = Product('1108-150', title='Caliper', price=9.5, original_price=10.0, discount=5.0)
+
+    assert Product.from_dict(product.to_dict()) == product
+    assert list(product.to_dict()) == list(PRODUCT_FIELDS)
+    assert not hasattr(product, '__dict__')
+
+
+def test_product_from_db_row_fills_nulls():
+    row = {'sku': '1108-150', 'title': None, 'price': Decimal('12.50'), 'original_price': None,
+           'discount': float('nan'), 'availability': None, 'last_updated': '2024-01-01'}
+
+    product = Product.from_db_row(row)
+
+    assert product.title == ''
+    assert product.price == 12.5 and isinstance(product.price, float)
+    assert product.original_price == 0.0 and product.discount == 0.0
+    assert product.availability == '0'
+    assert product.description2 == ''
+
+
+def test_stock_from_availability():
+    assert Product('a', availability='12').stock_quantity == 12
+    assert Product('a', availability='12').in_stock
+    assert Product('a', availability='In stock').in_stock
+    assert Product('a', availability='In stock').stock_quantity == 0
+    assert not Product('a', availability='0').in_stock
+    assert Product('a', availability='nan').stock_quantity == 0
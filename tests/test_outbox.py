@@ -0,0 +1,97 @@
+from src import config
+from src.database import Database
+from src.models import Product
+from src.outbox import drain_outbox
+
+
+def _catalog(size=10):
+    return [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0 + i, availability=str(i % 3))
+            for i in range(size)]
+
+
+def _pending(db):
+    db.cursor.execute("SELECT sku, change_type FROM product_outbox WHERE processed_at IS NULL ORDER BY id")
+    return db.cursor.fetchall()
+
+
+def test_upsert_queues_added_and_changed_skus(db):
+    db.upsert_products(_catalog(3))
+    assert _pending(db) == [('1108-0', 'added'), ('1108-1', 'added'), ('1108-2', 'added')]
+
+    products = _catalog(3)
+    products[1].price = 99.0
+    db.upsert_products(products)
+
+    # 1108-1 is still waiting unclaimed, so it is not queued twice
+    assert len(_pending(db)) == 3
+    db.complete_outbox([entry_id for ids in db.claim_outbox().values() for entry_id in ids])
+
+    products[2].title = 'Renamed'
+    db.upsert_products(products)
+    assert _pending(db) == [('1108-2', 'changed')]
+
+
+def test_drain_pushes_each_queued_product_once(db):
+    db.upsert_products(_catalog(10))
+    pushed = []
+
+    def push(product):
+        pushed.append(product.sku)
+        return None if product.sku == '1108-4' else 'added'
+
+    counts = drain_outbox(db, push, batch_size=3)
+
+    assert sorted(pushed) == [f"1108-{i}" for i in range(10)]
+    assert counts == {'added': 9, 'failed': 1}
+    # The failed entry waits for its lease to expire before it is retried
+    db.cursor.execute("SELECT sku, attempts, last_error FROM product_outbox WHERE processed_at IS NULL")
+    assert db.cursor.fetchall() == [('1108-4', 1, 'Push failed for SKU 1108-4')]
+    assert drain_outbox(db, push) == {}
+
+
+def test_drain_can_push_whole_batches(db):
+    db.upsert_products(_catalog(5))
+    batches = []
+
+    def push_many(products):
+        batches.append([product.sku for product in products])
+        return {product.sku: 'updated' for product in products if product.sku != '1108-2'}
+
+    counts = drain_outbox(db, None, batch_size=2, push_many=push_many)
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert counts == {'updated': 4, 'failed': 1}
+
+
+def test_claim_skips_entries_locked_by_another_worker(db):
+    db.upsert_products(_catalog(4))
+    db.cursor.execute("SHOW search_path")
+    search_path = db.cursor.fetchone()[0]
+
+    with Database() as other:
+        other.cursor.execute(f"SET search_path TO {search_path}")
+        other.cursor.execute("SELECT id FROM product_outbox WHERE sku = '1108-0' FOR UPDATE")
+
+        claimed = db.claim_outbox()
+        other.conn.rollback()
+        other.cursor.execute("RESET search_path")
+        other.conn.commit()
+
+    assert sorted(claimed) == ['1108-1', '1108-2', '1108-3']
+
+
+def test_entries_out_of_attempts_are_dead_lettered(db, monkeypatch):
+    monkeypatch.setattr(config, 'OUTBOX_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(config, 'OUTBOX_LEASE_SECONDS', 0)
+    db.upsert_products(_catalog(3))
+    # A worker that crashed on its last attempt
+    db.cursor.execute("UPDATE product_outbox SET attempts = 2, claimed_at = CURRENT_TIMESTAMP WHERE sku = '1108-2'")
+    db.conn.commit()
+
+    counts = drain_outbox(db, lambda product: None if product.sku == '1108-1' else 'added')
+
+    # 1108-1 failed twice; both entries are closed instead of waiting forever
+    assert counts == {'added': 1, 'failed': 2}
+    db.cursor.execute("SELECT sku, failed, last_error FROM product_outbox WHERE failed ORDER BY sku")
+    assert db.cursor.fetchall() == [('1108-1', True, 'Push failed for SKU 1108-1'), ('1108-2', True, 'Lease expired')]
+    assert _pending(db) == []
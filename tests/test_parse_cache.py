@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from src.models import Product
+from src.parse_cache import ParseCache
+from src.parser import ExcelParser
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ParseCache(cache_dir=str(tmp_path / 'cache'), max_bytes=10 * 1024 * 1024)
+
+
+def test_second_parse_is_served_from_cache(workbook_path, cache, monkeypatch):
+    """A re-parse of the same workbook reads the cached table instead of the xlsx"""
+    products = ExcelParser(workbook_path, cache=cache).parse()
+
+    parser = ExcelParser(workbook_path, cache=cache)
+    monkeypatch.setattr(parser, 'read_frame', lambda: pytest.fail('workbook decoded again'))
+
+    assert parser.parse() == products
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+
+def test_streaming_fills_and_reads_cache(workbook_path, cache, monkeypatch):
+    expected = ExcelParser(workbook_path).parse()
+
+    assert list(ExcelParser(workbook_path, cache=cache).iter_products()) == expected
+
+    parser = ExcelParser(workbook_path, cache=cache)
+    monkeypatch.setattr(parser, '_stream_workbook', lambda key: pytest.fail('workbook decoded again'))
+    assert [p for chunk in parser.iter_products(chunk_size=100) for p in chunk] == expected
+
+
+def test_cached_parses_report_the_skipped_rows(workbook_path, cache):
+    parser = ExcelParser(workbook_path, cache=cache)
+    parser.parse()
+    fresh = parser.report.to_dict()
+    assert fresh['rules']['empty_sku']['count']
+
+    parser.parse()
+    assert parser.report.to_dict() == fresh
+
+    streamed = ExcelParser(workbook_path, cache=ParseCache(cache_dir=cache.cache_dir + '-stream'))
+    list(streamed.iter_products())
+    list(streamed.iter_products())
+    assert streamed.report.to_dict() == fresh
+
+
+def test_partially_streamed_workbook_is_not_cached(workbook_path, cache):
+    products = ExcelParser(workbook_path, cache=cache).iter_products()
+    next(products)
+    products.close()
+
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith('.arrow')]
+
+
+def test_least_recently_used_files_are_evicted(cache):
+    products = [Product(f"SKU-{i}", title='x' * 200, description='y' * 200, price=1.0) for i in range(200)]
+    cache.store('a' * 64, products)
+    size = os.path.getsize(cache._path('a' * 64))
+    cache.max_bytes = int(size * 2.5)
+
+    cache.store('b' * 64, products)
+    os.utime(cache._path('a' * 64), (0, 0))
+    cache.store('c' * 64, products)
+
+    assert cache.load('a' * 64) is None
+    assert cache.load('b' * 64) == products
+    assert cache.load('c' * 64) == products
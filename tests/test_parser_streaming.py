@@ -0,0 +1,19 @@
+from src.parser import ExcelParser
+
+
+def test_streamed_products_match_parse(workbook_path):
+    """iter_products yields the same products as the DataFrame based parse"""
+    parser = ExcelParser(workbook_path)
+
+    streamed = list(parser.iter_products())
+
+    assert len(streamed) == 246
+    assert streamed == parser.parse()
+
+
+def test_streamed_products_in_chunks(workbook_path):
+    """Chunked mode yields fixed-size lists with the remainder last"""
+    chunks = list(ExcelParser(workbook_path).iter_products(chunk_size=100))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 46]
+    assert chunks[-1][-1].sku == '1108999'
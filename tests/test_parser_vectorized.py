@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from src.parser import ExcelParser
+
+HEADER = ['INSIZE', 'No', 'Description', 'Description 2', 'Availability', 'Range', 'Reading',
+          'Family', 'Weight', 'Dimensions', 'Image', 'URL', 'Category', 'Subcategory',
+          'Unused', 'Unused', 'Precio', 'Descuento EU']
+
+
+def _row(sku, description='Caliper', description2='', availability='5', price=10.0, discount=0.0, **extra):
+    row = [np.nan, sku, description, description2, availability, '0-150mm', 0.01, 'Calipers',
+           '0.2 kg', '230x80x16mm', 'https://img/1.jpg', 'https://shop/1', 'Measuring', 'Calipers',
+           np.nan, np.nan, price, discount]
+    for position, value in extra.items():
+        row[int(position.lstrip('c'))] = value
+    return row
+
+
+def _sheet(rows):
+    return pd.DataFrame([HEADER] + rows, columns=[f"Unnamed: {i}" for i in range(len(HEADER))])
+
+
+def test_vectorized_parse_matches_row_parse():
+    """The column-wise parser builds exactly the same product dicts as the row loop"""
+    df = _sheet([
+        _row('1108-150'),
+        _row('  1108-200 ', description2='Digital', discount=15.0),
+        _row(1108300, description=np.nan, availability=np.nan, price=np.nan),
+        _row(np.nan),
+        _row(''),
+        _row('No'),
+        _row('1108-400', availability='Availability'),
+        _row('1108-500', price='12.5', discount='10'),
+        _row('1108-600', price='n/a', discount='nan'),
+        _row('1108-700', price=' 7 ', discount=-5.0),
+        _row('1108-800', price=0, description='', description2='Only second'),
+        _row(1108.5, description2=np.nan, c5=np.nan, c10=np.nan, c13=42),
+        _row('1108-900', availability=0, price=199.99, discount=33.3),
+    ])
+    parser = ExcelParser('unused.xlsx')
+
+    expected = parser._parse_rows(df)
+    actual = parser._parse_frame(df)
+
+    assert len(expected) == 9
+    # repr compares values, NaNs and Python vs numpy types in one go
+    assert repr(actual) == repr(expected)
+
+
+def test_vectorized_parse_with_typed_columns():
+    """Float and string dtype columns are cleaned the same way as object columns"""
+    rows = [_row(f"SKU-{i}", price=float(i), discount=float(i % 3) * 5, c5=f"{i} mm") for i in range(50)]
+    df = _sheet(rows)
+    df.iloc[0, 16:18] = np.nan
+    typed = df.convert_dtypes(convert_integer=False, convert_boolean=False).infer_objects()
+    typed['Unnamed: 16'] = typed['Unnamed: 16'].astype('float64')
+    parser = ExcelParser('unused.xlsx')
+
+    assert repr(parser._parse_frame(typed)) == repr(parser._parse_rows(typed))
+
+
+def test_missing_columns_yield_no_products():
+    df = _sheet([_row('1108-150')]).drop(columns=['Unnamed: 16'])
+
+    assert ExcelParser('unused.xlsx')._parse_frame(df) == []
+
+
+def test_validation_report_counts_rules():
+    """Problems are aggregated per rule with sample SKUs instead of logged per row"""
+    df = _sheet([
+        _row('1108-150'),
+        _row(np.nan),
+        _row('No'),
+        _row('1108-400', availability='Availability'),
+        _row('1108-600', price='n/a'),
+        _row('1108-700', description='', price=0),
+    ])
+    parser = ExcelParser('unused.xlsx')
+
+    parser._parse_frame(df)
+    report = parser.report.to_dict()
+
+    assert report['rows_checked'] == 6
+    assert report['rules'] == {
+        'empty_sku': {'count': 1, 'sample': []},
+        'header_row': {'count': 2, 'sample': []},
+        'missing_price': {'count': 2, 'sample': ['1108-600', '1108-700']},
+        'missing_title': {'count': 1, 'sample': ['1108-700']},
+        'unparseable_price': {'count': 1, 'sample': ['1108-600']},
+    }
@@ -0,0 +1,35 @@
+from contextlib import nullcontext
+
+from src import profiling
+
+
+def _work():
+    return sorted(str(i) for i in range(20000))
+
+
+def test_stages_write_profiles_and_summary(tmp_path):
+    profiler = profiling.enable('test', str(tmp_path))
+    try:
+        with profiling.stage('parse'):
+            with profiling.stage('inner'):
+                _work()
+    finally:
+        profiling.disable()
+
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert len(files) == 2
+    assert files[0].startswith('test-') and files[0].endswith('-parse.prof')
+    text = (tmp_path / files[1]).read_text()
+    assert '_work' in text
+    assert 'Top 25 allocations' in text
+
+    # Nested stages are covered by the outer one
+    assert [result['stage'] for result in profiler.results] == ['parse']
+    profiler.report()
+    assert profiler.results == []
+
+
+def test_disabled_profiling_is_a_noop():
+    profiling.disable()
+    assert isinstance(profiling.stage('parse'), nullcontext)
+    profiling.report()
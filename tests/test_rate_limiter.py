@@ -0,0 +1,108 @@
+from src import metrics
+from src.rate_limiter import RateLimiter, graphql_post, record_rest_headers
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Returns the queued responses in order and records the requests"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.requests.append(json)
+        return self.responses.pop(0)
+
+
+def _cost(available, requested=10):
+    return {'cost': {'requestedQueryCost': requested, 'actualQueryCost': requested,
+                     'throttleStatus': {'maximumAvailable': 1000.0, 'currentlyAvailable': available,
+                                        'restoreRate': 1000.0}}}
+
+
+def test_bucket_only_delays_once_drained():
+    clock = FakeClock()
+    bucket = RateLimiter('test', capacity=100, restore_rate=50, clock=clock)
+
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(40) == 0
+    # Empty: the next 10 points take 0.2s to restore
+    assert bucket.reserve(10) == 0.2
+
+    clock.now += 2
+    assert bucket.available == -10
+    assert bucket.reserve(10) == 0
+
+
+def test_concurrent_waits_are_counted_once():
+    clock = FakeClock()
+    bucket = RateLimiter('concurrent-test', capacity=100, restore_rate=50, clock=clock)
+    bucket.reserve(100)
+
+    # Three callers wait 0.2s, 0.4s and 0.6s side by side: 0.6s of throttling
+    assert [bucket.reserve(10) for _ in range(3)] == [0.2, 0.4, 0.6]
+    assert metrics.THROTTLED_SECONDS.value(limit='concurrent-test') == 0.6
+
+    clock.now += 1
+    bucket.throttled(2)
+    assert metrics.THROTTLED_SECONDS.value(limit='concurrent-test') == 2.6
+
+
+def test_update_replaces_the_local_estimate():
+    clock = FakeClock()
+    bucket = RateLimiter('test', capacity=1000, restore_rate=50, clock=clock)
+
+    bucket.update(100, capacity=2000, restore_rate=100)
+    assert bucket.reserve(150) == 0.5
+    bucket.release(150)
+
+    record_rest_headers({'x-shopify-shop-api-call-limit': '39/40'}, bucket)
+    assert (bucket.capacity, bucket.available) == (40, 1)
+
+
+def test_update_keeps_calls_in_flight_deducted():
+    clock = FakeClock()
+    bucket = RateLimiter('test', capacity=1000, restore_rate=50, clock=clock)
+    for _ in range(3):
+        bucket.reserve(100)
+
+    # Shopify's state doesn't include the three unanswered calls yet
+    bucket.update(900)
+    assert bucket.available == 600
+    bucket.release(100)
+    bucket.update(800)
+    assert bucket.available == 600
+
+
+def test_graphql_post_retries_throttled_requests():
+    bucket = RateLimiter('test', capacity=1000, restore_rate=1000)
+    throttled = {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}], 'extensions': _cost(0, 50)}
+    session = FakeSession([
+        FakeResponse({}, status_code=429, headers={'Retry-After': '0'}),
+        FakeResponse(throttled),
+        FakeResponse({'data': {'shop': {'id': 1}}, 'extensions': _cost(940)}),
+    ])
+
+    response = graphql_post(session, 'https://shop/graphql.json', {}, '{ shop { id } }', bucket=bucket)
+
+    assert response.json()['data'] == {'shop': {'id': 1}}
+    assert len(session.requests) == 3
+    assert bucket.available <= 940
+    assert bucket.in_flight == 0
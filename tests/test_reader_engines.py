@@ -0,0 +1,43 @@
+import openpyxl
+import pytest
+
+from src.parser import ExcelParser, available_engines
+
+
+@pytest.mark.parametrize('engine', available_engines())
+def test_engines_produce_identical_frames(workbook_path, engine):
+    """Every installed engine yields the same normalized frame and products"""
+    reference = ExcelParser(workbook_path, engine='openpyxl')
+    parser = ExcelParser(workbook_path, engine=engine)
+
+    frame = parser.read_frame()
+
+    assert frame.equals(reference.read_frame())
+    assert list(frame.columns[:3]) == ['INSIZE EUROPE PRICE LIST', 'Unnamed: 1', 'Unnamed: 2']
+    assert parser.parse() == reference.parse()
+
+
+def test_auto_engine_picks_fastest_available(workbook_path):
+    assert ExcelParser(workbook_path, engine='auto').engine == available_engines()[0]
+
+
+def test_unknown_engine_is_rejected(workbook_path):
+    with pytest.raises(ValueError):
+        ExcelParser(workbook_path, engine='xlrd')
+
+
+@pytest.mark.parametrize('engine', available_engines())
+def test_engines_agree_on_sheets_without_dimensions(tmp_path, engine):
+    """Write-only workbooks have ragged rows; engines must still agree"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Title'])
+    sheet.append([None, 'No', 'Description'])
+    sheet.append([None, 'A-1', 'Caliper', None, 5])
+    path = str(tmp_path / 'ragged.xlsx')
+    workbook.save(path)
+
+    frame = ExcelParser(path, engine=engine).read_frame()
+
+    assert frame.equals(ExcelParser(path, engine='openpyxl').read_frame())
+    assert list(frame.columns) == ['Title', 'Unnamed: 1', 'Unnamed: 2', 'Unnamed: 3', 'Unnamed: 4']
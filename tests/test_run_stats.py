@@ -0,0 +1,47 @@
+import time
+
+from src.run_stats import RunStats
+
+
+def test_stages_record_duration_and_throughput():
+    stats = RunStats()
+    with stats.stage('parse') as stage:
+        time.sleep(0.01)
+        stage['rows'] = 500
+    with stats.stage('download'):
+        pass
+    stats.bytes_downloaded = 2048
+
+    metrics = stats.to_dict()
+
+    parse = metrics['stages']['parse']
+    assert parse['seconds'] >= 0.01
+    assert 0 < parse['rows_per_second'] <= 50000
+    assert 'rows_per_second' not in metrics['stages']['download']
+    assert metrics['bytes_downloaded'] == 2048
+    assert metrics['peak_rss_mb'] > 0
+
+
+def test_peak_rss_is_measured_per_stage():
+    stats = RunStats()
+    with stats.stage('parse'):
+        buffer = bytearray(100 * 1024 * 1024)
+        buffer[::4096] = b'x' * len(buffer[::4096])
+        del buffer
+    with stats.stage('push'):
+        pass
+
+    stages = stats.to_dict()['stages']
+    # The parse peak does not carry over into later stages of a long-lived process
+    assert stages['push']['peak_rss_mb'] < stages['parse']['peak_rss_mb'] - 50
+
+
+def test_failed_stage_is_still_recorded():
+    stats = RunStats()
+    try:
+        with stats.stage('upsert'):
+            raise RuntimeError('boom')
+    except RuntimeError:
+        pass
+
+    assert 'seconds' in stats.to_dict()['stages']['upsert']
@@ -0,0 +1,185 @@
+import json
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.models import Product
+from src.shopify_bulk import BulkImporter
+from src.shopify_ids import refresh_id_index
+
+
+class ShopifyStub(BaseHTTPRequestHandler):
+    """Stand-in for the Shopify GraphQL bulk operation endpoints and staged upload storage"""
+    uploads = {}
+    operations = []
+    current = None
+    polls = 0
+    inventory = []
+    # Result of the variant export query
+    variants = [
+        {'id': 'gid://shopify/ProductVariant/1', 'sku': '1108-1',
+         'inventoryItem': {'id': 'gid://shopify/InventoryItem/1'},
+         'product': {'id': 'gid://shopify/Product/1', 'featuredImage': {'id': 'gid://shopify/ProductImage/1'}}},
+        {'id': 'gid://shopify/ProductVariant/9', 'sku': None,
+         'inventoryItem': {'id': 'gid://shopify/InventoryItem/9'},
+         'product': {'id': 'gid://shopify/Product/9', 'featuredImage': None}},
+    ]
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/upload':
+            message = BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                      for part in message.get_payload()}
+            type(self).uploads[fields['key'].decode()] = fields['file'].decode()
+            self._send(204, b'')
+            return
+
+        request = json.loads(body)
+        query, variables = request['query'], request['variables']
+        if 'bulkOperationRunQuery' in query:
+            assert 'productVariants' in variables['query']
+            type(self).current = {'id': 'gid://shopify/BulkOperation/export', 'lines': self.variants,
+                                  'url': f"http://127.0.0.1:{self.server.server_port}/export"}
+            self._send(200, {'data': {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': self.current['id'], 'status': 'CREATED'}, 'userErrors': []}}})
+        elif 'inventorySetOnHandQuantities' in query:
+            type(self).inventory.extend(variables['input']['setQuantities'])
+            self._send(200, {'data': {'inventorySetOnHandQuantities': {'userErrors': []}}})
+        elif 'locations' in query:
+            self._send(200, {'data': {'locations': {'edges': [{'node': {'id': 'gid://shopify/Location/7'}}]}}})
+        elif 'stagedUploadsCreate' in query:
+            key = f"tmp/bulk/{len(self.uploads)}/{variables['input'][0]['filename']}"
+            target = {'url': f"http://127.0.0.1:{self.server.server_port}/upload", 'resourceUrl': None,
+                      'parameters': [{'name': 'key', 'value': key}, {'name': 'policy', 'value': 'p'}]}
+            self._send(200, {'data': {'stagedUploadsCreate': {'stagedTargets': [target], 'userErrors': []}}})
+        elif 'bulkOperationRunMutation' in query:
+            operation_id = f"gid://shopify/BulkOperation/{len(self.operations) + 1}"
+            type(self).current = {'id': operation_id, 'mutation': variables['mutation'],
+                                  'lines': self.uploads[variables['stagedUploadPath']].splitlines(),
+                                  'url': f"http://127.0.0.1:{self.server.server_port}/results/{len(self.operations)}"}
+            type(self).operations.append(self.current)
+            self._send(200, {'data': {'bulkOperationRunMutation': {
+                'bulkOperation': {'id': operation_id, 'status': 'CREATED'}, 'userErrors': []}}})
+        elif 'currentBulkOperation' in query:
+            # Every operation is reported as running on the first poll
+            type(self).polls += 1
+            operation = self.current
+            done = self.polls % 2 == 0
+            self._send(200, {'data': {'currentBulkOperation': {
+                'id': operation['id'], 'status': 'COMPLETED' if done else 'RUNNING', 'errorCode': None,
+                'objectCount': str(len(operation['lines'])), 'partialDataUrl': None,
+                'url': operation['url'] if done else None
+            }}, 'extensions': {'cost': {'actualQueryCost': 1}}})
+        else:
+            self._send(200, {'errors': [{'message': 'unknown query'}]})
+
+    def do_GET(self):
+        if self.path == '/export':
+            self._send(200, '\n'.join(json.dumps(variant) for variant in self.variants).encode(), 'application/jsonl')
+            return
+        operation = self.operations[int(self.path.rsplit('/', 1)[1])]
+        key = 'productCreate' if 'productCreate' in operation['mutation'] else 'productUpdate'
+        results = []
+        for number, line in enumerate(operation['lines']):
+            product_input = json.loads(line)['input']
+            if product_input['title'] == 'FAIL':
+                payload = {'product': None, 'userErrors': [{'field': ['title'], 'message': 'Title is invalid'}]}
+            elif product_input['title'] == 'LOST':
+                continue
+            else:
+                product_id = product_input.get('id', f"gid://shopify/Product/{100 + number}")
+                variant_id = product_input['variants'][0].get('id', f"gid://shopify/ProductVariant/{100 + number}")
+                variant = {'id': variant_id, 'sku': product_input['variants'][0]['sku'],
+                           'inventoryItem': {'id': f"gid://shopify/InventoryItem/{100 + number}"}}
+                payload = {'product': {'id': product_id, 'variants': {'edges': [{'node': variant}]}},
+                           'userErrors': []}
+            results.append(json.dumps({'data': {key: payload}, '__lineNumber': number}))
+        # Results are not guaranteed to come back in input order
+        self._send(200, '\n'.join(reversed(results)).encode(), 'application/jsonl')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def shopify_stub():
+    ShopifyStub.uploads = {}
+    ShopifyStub.operations = []
+    ShopifyStub.current = None
+    ShopifyStub.polls = 0
+    ShopifyStub.inventory = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ShopifyStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/admin/api/2024-01/graphql.json"
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_import_maps_results_to_skus(shopify_stub):
+    products = [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0 + i, availability=str(i),
+                        image_url=f"https://img/{i}.jpg", range='0-150mm') for i in range(6)]
+    products[3].title = 'FAIL'
+    products[4].title = 'LOST'
+    # Small files so the catalog is split over several bulk operations
+    importer = BulkImporter(shopify_stub, {'X-Shopify-Access-Token': 't'}, poll_interval=0, max_file_bytes=1500)
+
+    result = importer.import_products(iter([products[:4], products[4:]]))
+
+    assert sorted(result.succeeded) == ['1108-0', '1108-1', '1108-2', '1108-5']
+    assert result.succeeded['1108-1'] == 'gid://shopify/Product/1'
+    assert result.failed == {'1108-3': 'Title is invalid',
+                             '1108-4': 'No result (bulk operation COMPLETED, None)'}
+    assert sorted(result.entries) == sorted(result.succeeded)
+    assert result.entries['1108-1']['variant_gid'] == 'gid://shopify/ProductVariant/1'
+    assert result.entries['1108-1']['has_image'] is True
+
+    operations = ShopifyStub.operations
+    assert len(operations) > 2
+    assert sum(len(operation['lines']) for operation in operations) == 6
+    update = next(operation for operation in operations if 'productUpdate' in operation['mutation'])
+    update_input = json.loads(update['lines'][0])['input']
+    assert update_input['id'] == 'gid://shopify/Product/1'
+    assert update_input['variants'][0]['id'] == 'gid://shopify/ProductVariant/1'
+    # The existing product already has an image
+    assert 'images' not in update_input
+    create_input = json.loads(operations[0]['lines'][1])['input']
+    assert create_input['variants'][0]['sku'] == '1108-2'
+    assert create_input['variants'][0]['inventoryQuantities'] == [
+        {'availableQuantity': 2, 'locationId': 'gid://shopify/Location/7'}]
+    # Only the updated product needs its stock set after the operation
+    assert ShopifyStub.inventory == [{'inventoryItemId': result.entries['1108-1']['inventory_item_gid'],
+                                      'locationId': 'gid://shopify/Location/7', 'quantity': 1}]
+    assert create_input['metafields'] == [
+        {'namespace': 'custom', 'key': 'range', 'value': '0-150mm', 'type': 'single_line_text_field'}]
+
+
+def test_id_index_built_from_variant_export(shopify_stub, db):
+    importer = BulkImporter(shopify_stub, {'X-Shopify-Access-Token': 't'}, poll_interval=0)
+    db.save_shopify_ids([{'sku': '1108-1', 'product_gid': 'gid://shopify/Product/1',
+                          'variant_gid': 'gid://shopify/ProductVariant/1', 'remote_hash': 'a' * 32},
+                         {'sku': 'deleted', 'product_gid': 'gid://shopify/Product/5',
+                          'variant_gid': 'gid://shopify/ProductVariant/5'}])
+
+    # Not empty, so nothing is exported
+    assert refresh_id_index(db, importer) == 2
+    assert importer.api_calls == 0
+
+    assert refresh_id_index(db, importer, rebuild=True) == 1
+    entry = db.get_shopify_ids(['1108-1', 'deleted'])['1108-1']
+    assert set(db.get_shopify_ids()) == {'1108-1'}
+    assert entry['inventory_item_gid'] == 'gid://shopify/InventoryItem/1'
+    assert entry['has_image'] is True
+    # Same variant, so the hash of the last push still applies
+    assert entry['remote_hash'] == 'a' * 32
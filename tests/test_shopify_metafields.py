@@ -0,0 +1,64 @@
+from src.models import Product
+from src.shopify_fields import metafields_hash
+from src.shopify_metafields import MetafieldWriter
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ''
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers every metafieldsSet call, failing those listed in fail_calls"""
+    def __init__(self, fail_calls=()):
+        self.fail_calls = set(fail_calls)
+        self.requests = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.requests.append(json['variables']['metafields'])
+        errors = [{'field': ['metafields'], 'message': 'Value is invalid', 'code': 'INVALID'}] \
+            if len(self.requests) in self.fail_calls else []
+        return FakeResponse({'data': {'metafieldsSet': {'metafields': [], 'userErrors': errors}}})
+
+
+def _product(number, **fields):
+    values = dict(range='0-150mm', reading='0.01mm', family='Caliper', weight='160g', dimensions='235x80x16mm')
+    values.update(fields)
+    return Product(f"1108-{number}", title=f"Caliper {number}", **values)
+
+
+def test_metafields_of_several_products_share_a_call():
+    session = FakeSession()
+    writer = MetafieldWriter('https://shop/graphql.json', {}, session=session)
+    products = [_product(i) for i in range(7)]
+
+    for i, product in enumerate(products):
+        writer.add(product, f"gid://shopify/Product/{i}")
+    # Five products fill the first call as soon as they are queued
+    assert [len(metafields) for metafields in session.requests] == [25]
+
+    written, failed = writer.flush()
+
+    assert [len(metafields) for metafields in session.requests] == [25, 10]
+    assert session.requests[1][0]['ownerId'] == 'gid://shopify/Product/5'
+    assert written == {product.sku: metafields_hash(product) for product in products}
+    assert failed == []
+    assert writer.api_calls == 2
+
+
+def test_unchanged_metafields_are_skipped_and_failed_calls_are_reported():
+    session = FakeSession(fail_calls=[1])
+    writer = MetafieldWriter('https://shop/graphql.json', {}, session=session)
+    unchanged, failing = _product(1), _product(2, weight='', dimensions='')
+
+    assert not writer.add(unchanged, 'gid://shopify/Product/1', known_hash=metafields_hash(unchanged))
+    assert writer.add(failing, 'gid://shopify/Product/2')
+
+    assert writer.flush() == ({}, ['1108-2'])
+    assert [len(metafields) for metafields in session.requests] == [3]
@@ -0,0 +1,105 @@
+from src import config
+from src.models import Product
+from src.outbox import drain_outbox
+from src.shopify_client import ShopifyClient
+from src.shopify_ids import index_entry
+from src.shopify_metafields import MetafieldWriter
+from src.shopify_sync import ShopifySync
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    text = ''
+
+    def __init__(self, user_errors):
+        self.user_errors = user_errors
+
+    def json(self):
+        return {'data': {'metafieldsSet': {'metafields': [], 'userErrors': self.user_errors}}}
+
+
+class FakeSession:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requests = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.requests.append(json['variables']['metafields'])
+        return FakeResponse([{'field': ['value'], 'message': 'Value is invalid', 'code': 'INVALID'}] if self.fail else [])
+
+
+def _catalog(size):
+    return [Product(f"1108-{i}", title=f"Caliper {i}", price=10.0 + i, availability=str(i % 3),
+                    image_url=f"https://img/{i}.jpg", family='Caliper') for i in range(size)]
+
+
+def test_sequential_full_push_writes_the_index_while_streaming(db):
+    db.upsert_products(_catalog(30))
+    sync = ShopifySync()
+    sync.db = db
+    session = FakeSession()
+    sync.metafields = MetafieldWriter('https://shop/graphql.json', {}, session=session)
+
+    def create(product):
+        number = int(product.sku.rsplit('-', 1)[1])
+        if number == 4:
+            return None
+        return index_entry(product, number, number, number, True)
+
+    sync._create_product = create
+
+    # Every push commits index entries on the connection the catalog is streamed from
+    assert sync._push_catalog(db, batch_size=8) == (19, 1)
+    assert db.count_shopify_ids() == 19
+    assert len(session.requests) == 3
+    assert all(ids['metafields_hash'] for ids in db.get_shopify_ids().values())
+
+
+def test_client_pushes_do_not_mark_the_full_input_as_pushed(db):
+    product = _catalog(2)[1]
+    client = ShopifyClient(db)
+    client._create_product = lambda product: index_entry(product, 1, 1, 1, False)
+
+    assert client.push_product(product) == 'added'
+
+    # ShopifySync still sends the fields the client left out
+    assert db.get_shopify_ids()[product.sku]['remote_hash'] is None
+
+
+def test_stock_changes_are_pushed(db):
+    product = _catalog(2)[1]
+    sync = ShopifySync()
+    sync.db = db
+    sync.metafields = MetafieldWriter('https://shop/graphql.json', {}, session=FakeSession())
+    sync._create_product = lambda product: index_entry(product, 1, 1, 1, True)
+    updated = []
+
+    def update(ids, product):
+        updated.append(product.availability)
+        return index_entry(product, 1, 1, 1, True)
+
+    sync._update_product = update
+    assert sync.push_products([product]) == {product.sku: 'added'}
+    assert sync.push_products([product]) == {product.sku: 'unchanged'}
+
+    product.availability = '7'
+    assert sync.push_products([product]) == {product.sku: 'updated'}
+    assert updated == ['7']
+
+
+def test_failed_metafields_leave_the_outbox_entry_for_a_retry(db, monkeypatch):
+    monkeypatch.setattr(config, 'OUTBOX_LEASE_SECONDS', 3600)
+    db.upsert_products(_catalog(3)[1:])
+    sync = ShopifySync()
+    sync.db = db
+    sync.metafields = MetafieldWriter('https://shop/graphql.json', {}, session=FakeSession(fail=True))
+    sync._create_product = lambda product: index_entry(product, 1, 1, 1, True)
+
+    counts = drain_outbox(db, sync.push_product, push_many=sync.push_products)
+
+    assert counts == {'failed': 2}
+    db.cursor.execute("SELECT sku FROM product_outbox WHERE processed_at IS NULL ORDER BY sku")
+    assert [row[0] for row in db.cursor.fetchall()] == ['1108-1', '1108-2']
+    # Not unchanged on the retry: no metafields hash was recorded
+    assert not any(ids['metafields_hash'] for ids in db.get_shopify_ids().values())